@@ -2,3 +2,8 @@
 LOAD_MODEL_SIGNAL = "Load model"
 UNLOAD_MODEL_SIGNAL = "Unload model"
 TERMINATE_SIGNAL = "Terminate"
+
+
+def is_signal(message, signal: str) -> bool:
+    """Checks if a queue message is the signal, audio messages are arrays"""
+    return isinstance(message, str) and message == signal
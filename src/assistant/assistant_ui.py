@@ -1,5 +1,8 @@
 import os
 import sys
+from queue import Empty
+from time import time
+from uuid import uuid4
 from typing import Union, Optional
 import logging
 import logging.config
@@ -38,6 +41,8 @@ from src.config import (
     OLLAMA_HOST,
     CHAINLIT_HOST,
     CHAINLIT_PORT,
+    TRANSCRIPTION_ACK_TIMEOUT,
+    TRANSCRIPTION_TIMEOUT,
 )
 
 from PIL import Image
@@ -48,6 +53,43 @@ import base64
 # langchain.debug = True
 
 
+def wait_transcription(results: Queue, request_id: str) -> Optional[str]:
+    """
+    Waits for the transcription of a request.
+
+    Args:
+        results (Queue): Transcriptions sent back by the ASR module
+        request_id (str): Id the request was sent with
+
+    Returns:
+        transcription (str): The text, None if the service is stopped or
+            the text did not come in time
+    """
+    # Accepted quickly while the service runs, the transcription may take long
+    deadline = time() + TRANSCRIPTION_ACK_TIMEOUT
+    while True:
+        remaining = deadline - time()
+        if remaining <= 0:
+            return None
+        try:
+            output = results.get(block=True, timeout=remaining)
+        except Empty:
+            return None
+
+        # Results of requests that timed out before are left behind
+        if output.get("request_id", None) != request_id:
+            continue
+
+        status = output.get("status", None)
+        if status == "stopped":
+            return None
+        if status in ("queued", "progress"):
+            deadline = time() + TRANSCRIPTION_TIMEOUT
+            continue
+
+        return output.get("transcription", None)
+
+
 async def transcribe_audio(audio: list):
 
     # from chainlit import secret
@@ -80,10 +122,19 @@ async def transcribe_audio(audio: list):
 
         # Sending sound to model for inference
         queue: Queue = secret.chars
-        queue.put({"message": file.path, "do_action": False})
-
-        output = queue.get(block=True, timeout=10)
-        transcription = output.get("transcription", None)
+        request_id = uuid4().hex
+        queue.put(
+            {
+                "message": file.path,
+                "do_action": False,
+                "request_id": request_id,
+                "queued_at": time(),
+            }
+        )
+
+        transcription = await cl.make_async(wait_transcription)(
+            secret.results, request_id
+        )
 
         if transcription:
             # This to keep queue in the global scope
@@ -92,6 +143,11 @@ async def transcribe_audio(audio: list):
                 f"**Transcription of `{file.name}`:** \n\n{transcription}",
                 author="Speech-Assistant",
             ).send()
+        elif transcription is not None:
+            await cl.ErrorMessage(
+                f"No speech was transcribed in `{file.name}`.",
+                author="❌ Error",
+            ).send()
         else:
             await cl.ErrorMessage(
                 f"Please start the transcription service on the GUI and try again.",
@@ -541,11 +597,12 @@ def run_app():
     run_chainlit(__file__)
 
 
-def run_ui(queue: Queue):
+def run_ui(queue: Queue, results: Queue):
     from chainlit.cli import run_chainlit
     from chainlit import secret
 
     secret.chars = queue
+    secret.results = results
 
     os.environ["CHAINTLIT_HOST"] = CHAINLIT_HOST
     os.environ["CHAINLIT_PORT"] = CHAINLIT_PORT
@@ -2,22 +2,52 @@ from datetime import datetime
 import os
 import json
 
-from src.utils.funcs import type_writing
+from src.utils.funcs import auto_writing
 
 
 # Global variables
 # -----------------------------------
 
 ## Default values
-# Choosing which way to write text.
-WRITE = type_writing
+# Choosing which way to write text, type_writing or copy_writing force one
+WRITE = auto_writing
+
+# Injectors writing the text at the cursor, "auto" picks one for each text.
+# Texts of CLIPBOARD_MIN_CHARS or more are pasted, the clipboard is restored
+# CLIPBOARD_RESTORE_S later. Shorter ones are typed with XTest on X11, key
+# events of XTEST_BATCH_CHARS characters are sent per round trip
+TEXT_INJECTORS = ["auto", "xtest", "clipboard", "typewrite"]
+TEXT_INJECTOR = "auto"
+CLIPBOARD_MIN_CHARS = 200
+CLIPBOARD_RESTORE_S = 0.5
+XTEST_BATCH_CHARS = 32
 
 # Deciding whether to save audio file or not.
 SAVE_AUDIO = False
 
+# Keeping the microphone open, the last PRE_ROLL_MS of audio before
+# the hotkey is pressed are added to the recording
+DEFAULT_ALWAYS_ON_MIC = False
+PRE_ROLL_MS = 300
+
 # Hotkey for the listener.
 HOTKEY = {"Super", "Shift"}
 # HOTKEY = {"Alt", "F9"}
+
+# The X11 listener only records key events and reads the hotkey keys
+# straight from the recorded bytes, other traffic is skipped undecoded
+X11_FAST_EVENTS = True
+
+# Source of the hotkey presses, "auto" picks X11 or Windows from the OS.
+# "trace" replays the press and release timeline in KEY_TRACE_FILE instead
+# of reading the keyboard, for measuring the capture path unattended
+KEY_LISTENER_BACKENDS = ["auto", "x11", "windows", "trace"]
+KEY_LISTENER_BACKEND = "auto"
+KEY_TRACE_FILE = "key_trace.json"
+
+# Seconds Stop and Close wait for the threads to end before reporting them
+SHUTDOWN_TIMEOUT_S = 3.0
+
 AGENT_TRIGGER = "assistant"
 
 # Available models for ASR #
@@ -31,12 +61,104 @@ SPEECH_MODELS = [
     # "optimum/whisper-tiny.en",  # ~400 MiB of GPU memory
 ]
 
+# Memory budget of the ASR models kept loaded at once, least recently used are evicted
+MODEL_MEMORY_BUDGET_MB = 6144
+
+# Engines for CPU inference, int8 dynamically quantizes the linear layers
+CPU_ENGINES = ["float32", "int8"]
+DEFAULT_CPU_ENGINE = "float32"
+
+# Backends running the ASR model
+ASR_BACKENDS = ["transformers", "onnxruntime"]
+DEFAULT_ASR_BACKEND = "transformers"
+
+# Intra-op threads of the ONNX Runtime sessions, 0 lets ORT decide
+ORT_NUM_THREADS = 0
+
+# CPU threads of ASR inference, tuned once per machine on first load.
+# CPU_RESERVED_CORES are left to the GUI, key listener and audio capture.
+# The fastest setting keeping the GUI within CPU_TUNING_MAX_JITTER_MS of
+# its schedule is used. CPU_PINNING pins the model service to the other
+# cores before the model is loaded, its worker threads inherit the affinity
+# when they are created. Linux only
+CPU_TUNING = True
+CPU_RESERVED_CORES = 2
+CPU_PINNING = False
+CPU_INTEROP_THREADS = 1
+CPU_TUNING_MAX_JITTER_MS = 20
+
 # Available tasks for ASR
 TASKS = ["transcribe", "translate"]
 
 DEFAULT_MODEL_ID = 1
 DEFAULT_TRANSLATE_SPEECH = False
 
+# Language of the speech, like "english" or "de", None lets Whisper detect it
+DEFAULT_SPEECH_LANGUAGE = None
+
+# Dictation modes, streaming transcribes while the hotkey is held and
+# leaves only the audio after the last stable words to the final decode
+DICTATION_MODES = ["push-to-talk", "streaming"]
+DEFAULT_DICTATION_MODE = 0
+
+# Seconds of new audio between partial decodes in streaming mode
+STREAM_STEP_S = 1.0
+# Seconds between looks at the queue for newer audio while a partial is decoded
+NEWER_AUDIO_CHECK_S = 0.1
+
+# Recording the next utterance while the previous ones are transcribed,
+# transcripts are still typed in order
+DEFAULT_PIPELINED_DICTATION = False
+MAX_PENDING_UTTERANCES = 3
+
+# Recordings waiting in the queue are transcribed together in one generate
+# call, up to BATCH_MAX_SIZE at once. The model service waits at most
+# BATCH_MAX_WAIT_MS for more to arrive, zero only takes what is queued
+BATCH_MAX_SIZE = 8
+BATCH_MAX_WAIT_MS = 0
+
+# Uploads longer than a model window are split into chunks of at most
+# SCHEDULER_CHUNK_S, cut at the quietest point of the last
+# SCHEDULER_SPLIT_SEARCH_S seconds, so dictation can be served between them.
+# Files longer than BULK_MIN_S are scheduled behind other uploads
+SCHEDULER_CHUNK_S = 25
+SCHEDULER_SPLIT_SEARCH_S = 5
+BULK_MIN_S = 120
+
+# Voice activity detection, trims silence and skips recordings without speech
+VAD_ENABLED = True
+VAD_FRAME_MS = 30
+VAD_MARGIN_DB = 10  # Above the noise floor of the recording
+VAD_MIN_DB = -55
+VAD_MAX_DB = -35
+VAD_ZCR_THRESHOLD = 0.25
+VAD_PAD_MS = 200
+VAD_MIN_SPEECH_MS = 150
+
+# Early abort of hallucinated transcriptions, following Whisper's rules.
+# Recordings more likely than NO_SPEECH_ABORT to be silence are not decoded.
+# Above NO_SPEECH_THRESHOLD decoding stops once the average log-probability
+# of the text falls below LOGPROB_THRESHOLD. Text compressing better than
+# COMPRESSION_RATIO_THRESHOLD is a repetition loop and decoding stops.
+# Checks start after GUARD_MIN_TOKENS and the text is compressed every
+# GUARD_CHECK_EVERY tokens
+NO_SPEECH_ABORT = 0.9
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+GUARD_MIN_TOKENS = 12
+GUARD_CHECK_EVERY = 4
+
+# Token budget of a transcription from the duration of the speech, talking
+# at SPEECH_WORDS_PER_S with TOKENS_PER_WORD times TOKEN_BUDGET_MARGIN.
+# Clipped between MIN_NEW_TOKENS and MAX_NEW_TOKENS, Whisper decodes at most
+# 448 tokens including the prompt
+SPEECH_WORDS_PER_S = 3.0
+TOKENS_PER_WORD = 1.5
+TOKEN_BUDGET_MARGIN = 1.5
+MIN_NEW_TOKENS = 16
+MAX_NEW_TOKENS = 440
+
 # Words to ignore when you haven't said anything
 IGNORE = ["you know.", "you're not."]
 
@@ -67,6 +189,12 @@ CHAINLIT_PORT = "8000"
 CONNECTION_TIMEOUT = 10
 READER_TIMEOUT = 30
 
+# Seconds the web UI waits for an upload to be accepted by the transcription
+# service, then for the transcription or the progress of the next chunk,
+# long files are transcribed a chunk at a time between dictations
+TRANSCRIPTION_ACK_TIMEOUT = 10
+TRANSCRIPTION_TIMEOUT = 600
+
 # -----------------------------------
 
 
@@ -111,6 +239,12 @@ def save_to_config(filename="config.json"):
         "Default Agent Model": AGENT_MODELS[DEFAULT_AGENT_IDX],
         "Date Created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "Translate Speech": translate_speech,
+        "Speech Language": DEFAULT_SPEECH_LANGUAGE,
+        "Dictation Mode": DICTATION_MODES[DEFAULT_DICTATION_MODE],
+        "Always-On Microphone": DEFAULT_ALWAYS_ON_MIC,
+        "Pipelined Dictation": DEFAULT_PIPELINED_DICTATION,
+        "CPU Engines": {},
+        "ASR Backend": DEFAULT_ASR_BACKEND,
         "Tools Enabled": tools_enabled,
         "User Models List": [],
     }
@@ -145,6 +279,29 @@ def update_config(key: str, value, filename="config.json"):
         json.dump(config, file, indent=4)
 
 
+def get_cpu_engine(model_id: str) -> str:
+    """
+    Gets the CPU engine chosen for a model
+
+    Args:
+        model_id (str): The HuggingFace id of the model
+
+    Returns:
+        engine (str): One of CPU_ENGINES
+    """
+    engines = get_from_config("CPU Engines") or {}
+
+    return engines.get(model_id, DEFAULT_CPU_ENGINE)
+
+
+def set_cpu_engine(model_id: str, engine: str):
+    """Saves the CPU engine chosen for a model"""
+    engines = get_from_config("CPU Engines") or {}
+    engines[model_id] = engine
+
+    update_config("CPU Engines", engines)
+
+
 # Choosing default model
 model_id_idx = get_from_config("Default Model Index")
 MODEL_ID = SPEECH_MODELS[model_id_idx]
@@ -153,4 +310,15 @@ MODEL_ID = SPEECH_MODELS[model_id_idx]
 translate_speech = get_from_config("Translate Speech")
 TASK = TASKS[translate_speech]
 
+# Language of the speech, older config files do not have it
+SPEECH_LANGUAGE = get_from_config("Speech Language") or DEFAULT_SPEECH_LANGUAGE
+
 DEFAULT_AGENT = get_from_config("Default Agent Model")
+
+# ASR backend, older config files do not have it
+ASR_BACKEND = get_from_config("ASR Backend") or DEFAULT_ASR_BACKEND
+
+# Dictation mode, older config files do not have it
+DICTATION_MODE = (
+    get_from_config("Dictation Mode") or DICTATION_MODES[DEFAULT_DICTATION_MODE]
+)
@@ -6,9 +6,9 @@ NOTE if you every want to make this into .exe,
 """
 
 import os
-from time import sleep
 import logging
-from multiprocessing import Event, Queue, Process, Pipe, Value
+from multiprocessing import Condition, Queue, Process, Pipe, Value
+from queue import Queue as ThreadQueue
 from threading import Thread
 from tkinter import (
     Menu,
@@ -36,10 +36,13 @@ from customtkinter import (
 from src import LOAD_MODEL_SIGNAL, UNLOAD_MODEL_SIGNAL, TERMINATE_SIGNAL
 from src.speech.processing import change_agent
 from src.speech.asr import audio_processing_service
+from src.speech.scheduler import forward_requests
 from src.assistant.assistant_ui import run_ui
 from src.utils.funcs import run_listener
+from src.utils.synchronization import SynchEvent, CancelEvent, PendingCounter, join_all
 from src.utils.voice_capturing import main_loop
 from src.config import get_from_config, update_config
+from src.config import get_cpu_engine, set_cpu_engine
 from src.config import (
     WRITE,
     SAVE_AUDIO,
@@ -50,6 +53,13 @@ from src.config import (
     MODEL_ID,
     AGENT_MODELS,
     DEFAULT_AGENT,
+    DICTATION_MODES,
+    DICTATION_MODE,
+    ASR_BACKENDS,
+    ASR_BACKEND,
+    CPU_ENGINES,
+    MAX_PENDING_UTTERANCES,
+    SHUTDOWN_TIMEOUT_S,
 )
 
 # Setting logger
@@ -65,13 +75,24 @@ class SpeechDetectionGUI:
         self.parent_thread = None
 
         ## Concurrency variables
-        # Events for synchronization
-        self.start_event = Event()
-        self.model_event = Event()
-        self.terminate_event = Event()
+        # Events for synchronization, notifying waiters when set and cleared
+        self.synch_condition = Condition()
+        self.start_event = SynchEvent(self.synch_condition)
+        self.model_event = SynchEvent(self.synch_condition)
+        self.terminate_event = SynchEvent(self.synch_condition)
+        # Stops the running inference between decoding steps
+        self.cancel_event = CancelEvent(self.synch_condition)
+        # Utterances recorded but not typed yet, bounded for pipelined dictation
+        self.pending_utterances = PendingCounter(
+            MAX_PENDING_UTTERANCES, self.synch_condition
+        )
 
-        # Queue for audio data
-        self.sound_data_queue = Queue()
+        # Queue for audio data, recordings are passed by reference between threads
+        self.sound_data_queue = ThreadQueue()
+        # Files uploaded to the web UI, moved to the queue for audio data
+        self.upload_queue = Queue()
+        # Transcriptions of the files uploaded to the web UI
+        self.transcription_queue = Queue()
 
         # Pipes for communication (not used yet)
         self.parent_pipe, self.child_pipe = Pipe()
@@ -81,10 +102,17 @@ class SpeechDetectionGUI:
         self.task_bool_value = Value("b", TASKS.index(TASK))
         # Choosing if agent should be used or not
         self.agent_bool_value = Value("b", DEFAULT_AGENT != "None")
+        # Choosing between push-to-talk and streaming dictation
+        self.dictation_mode_value = Value("i", DICTATION_MODES.index(DICTATION_MODE))
+        # Choosing the backend running the speech model
+        self.backend_index_value = Value("i", ASR_BACKENDS.index(ASR_BACKEND))
+        # Choosing the CPU engine of the selected model
+        self.cpu_engine_value = Value("i", CPU_ENGINES.index(get_cpu_engine(MODEL_ID)))
 
         # Dictionary for synchronization to pass in process
         self.synch_dict = {
             "Audio Queue": self.sound_data_queue,
+            "Transcription Queue": self.transcription_queue,
             "Model-GUI Pipe": self.child_pipe,
             "Start Event": self.start_event,
             "Model Event": self.model_event,
@@ -92,6 +120,11 @@ class SpeechDetectionGUI:
             "Model Index": self.model_index_value,
             "Task Bool": self.task_bool_value,
             "Agent Bool": self.agent_bool_value,
+            "Dictation Mode": self.dictation_mode_value,
+            "Backend Index": self.backend_index_value,
+            "CPU Engine Index": self.cpu_engine_value,
+            "Pending Utterances": self.pending_utterances,
+            "Cancel Event": self.cancel_event,
         }
 
         ## GUI ##
@@ -187,10 +220,32 @@ class SpeechDetectionGUI:
         # Keeping this as a process to terminate it later on
         self.webui_process = Process(
             target=run_ui,
-            args=(self.sound_data_queue,),
+            args=(self.upload_queue, self.transcription_queue),
             name="chainlit_webui",
         )
         self.webui_process.start()
+        Thread(
+            target=forward_requests,
+            args=(self.upload_queue, self.sound_data_queue, self.accept_upload),
+            name="SA-Uploads",
+            daemon=True,
+        ).start()
+
+    def accept_upload(self, message) -> bool:
+        """Tells the web UI whether its upload is queued or the service is stopped"""
+        running = (
+            self.model_thread is not None
+            and self.model_thread.is_alive()
+            and not self.terminate_event.is_set()
+        )
+        self.transcription_queue.put(
+            {
+                "request_id": message.get("request_id", None),
+                "status": "queued" if running else "stopped",
+            }
+        )
+
+        return running
 
     def start_model_service(self):
         """Loads the ASR model and starts the model service."""
@@ -202,6 +257,8 @@ class SpeechDetectionGUI:
                 WRITE,
             ),
             name="WhisperModel",
+            # Not keeping the program open if it does not end in time
+            daemon=True,
         )
         self.model_thread.start()
 
@@ -209,7 +266,7 @@ class SpeechDetectionGUI:
         print(f"Waiting for model to load\n\nModel message: ", end="")
         while self.model_event.is_set():
             self.force_update()
-            sleep(0.1)
+            self.model_event.wait_clear(timeout=0.1)
         self.model_event.clear()
 
     def init_system(self):
@@ -222,6 +279,7 @@ class SpeechDetectionGUI:
         self.model_event.clear()
         self.start_event.clear()
         self.terminate_event.clear()
+        self.pending_utterances.reset()
 
         ## Loading model depending on the case
         if not self.model_thread:
@@ -239,6 +297,7 @@ class SpeechDetectionGUI:
                 self.terminate_event,
             ),
             name="SA-KeyListener",
+            daemon=True,
         )
         self.key_listener_thread.start()
 
@@ -255,8 +314,13 @@ class SpeechDetectionGUI:
                 self.model_event,
                 self.terminate_event,
                 self.sound_data_queue,
+                self.dictation_mode_value,
+                self.pending_utterances,
+                self.child_pipe,
+                self.cancel_event,
             ),
             name="SA-Parent",
+            daemon=True,
         )
         self.parent_thread.start()
 
@@ -273,7 +337,7 @@ class SpeechDetectionGUI:
         # Button state change when model is loaded
         while self.model_event.is_set():
             self.force_update()
-            sleep(0.1)
+            self.model_event.wait_clear(timeout=0.1)
         self.stop_button.configure(state=NORMAL)
 
     def stop_detection(self):
@@ -282,6 +346,9 @@ class SpeechDetectionGUI:
         telling the model to unload and terminating
         parent and key listener processes.
         """
+        # Not waiting for the running inference to finish
+        self.cancel_event.set()
+
         # For model to unload from memory
         self.sound_data_queue.put({"message": UNLOAD_MODEL_SIGNAL})
 
@@ -289,22 +356,17 @@ class SpeechDetectionGUI:
         self.terminate_event.set()
         self.start_event.set()
 
-        # Making sure processes are joined
-        self.parent_thread.join(timeout=10)
-        self.key_listener_thread.join(timeout=10)
+        # Making sure processes are joined, every blocking call is woken up
+        alive = join_all(
+            [self.parent_thread, self.key_listener_thread], SHUTDOWN_TIMEOUT_S
+        )
         # Checking if processes are still running
-        processes_alive = [
-            self.parent_thread.is_alive(),
-            self.key_listener_thread.is_alive(),
-        ]
-        if self.parent_thread.is_alive() or self.key_listener_thread.is_alive():
+        if alive:
             self.text_info.configure(
                 text="Processes not ended, please restart program!"
             )
-            if processes_alive[0]:
-                logger.info("ERROR: Parent process not ended")
-            if processes_alive[1]:
-                logger.info("ERROR: Key listener process not ended")
+            for thread in alive:
+                logger.info(f"ERROR: {thread.name} not ended")
 
         # Button state change
         self.start_button.configure(state=NORMAL)
@@ -317,6 +379,7 @@ class SpeechDetectionGUI:
         """Terminates all processes before closing"""
 
         # To tell model process to terminate
+        self.cancel_event.set()
         self.sound_data_queue.put({"message": TERMINATE_SIGNAL})
 
         # For parent process to terminate
@@ -324,17 +387,17 @@ class SpeechDetectionGUI:
         self.start_event.set()
 
         # Terminate processes and joining threads
+        self.upload_queue.put(None)
         if self.webui_process:
             self.webui_process.terminate()
-            self.webui_process.join()
-        if self.model_thread:
-            # self.model_process.terminate()
-            self.model_thread.join()
-        if self.parent_thread:
-            # self.parent_process.terminate()
-            self.parent_thread.join()
-        if self.key_listener_thread:
-            self.key_listener_thread.join()
+            self.webui_process.join(timeout=SHUTDOWN_TIMEOUT_S)
+        alive = join_all(
+            [self.model_thread, self.parent_thread, self.key_listener_thread],
+            SHUTDOWN_TIMEOUT_S,
+        )
+        # Daemon threads do not keep the program open
+        for thread in alive:
+            logger.info(f"ERROR: {thread.name} not ended, closing anyway")
 
         # Destroys all GUIs
         if self.option_window_open:
@@ -352,9 +415,9 @@ class SpeechDetectionGUI:
         while self.is_running:
             self.root.update()
 
-            # Updates text
+            # Updates text, waking up as soon as a message arrives
             self.force_update()
-            sleep(0.1)
+            self.parent_pipe.poll(0.1)
 
     def force_update(self):
         """Updates GUI when frozen"""
@@ -424,11 +487,21 @@ class SpeechDetectionGUI:
 
         def on_model_select(event):
             selected_model = speech_model_combobox.get()
+            # Engine first, the model service reads both to pick the model
+            self.cpu_engine_value.value = CPU_ENGINES.index(
+                get_cpu_engine(selected_model)
+            )
             self.model_index_value.value = SPEECH_MODELS.index(selected_model)
 
             update_config("Default Model Index", self.model_index_value.value)
             print(f"\nASR model changed to {selected_model}\n")
 
+            # Showing the CPU engine of the selected model
+            if CPU_ENGINES[self.cpu_engine_value.value] == "int8":
+                int8_check.select()
+            else:
+                int8_check.deselect()
+
         speech_model_combobox = CTkComboBox(
             self.options_window,
             values=SPEECH_MODELS,
@@ -441,6 +514,52 @@ class SpeechDetectionGUI:
         speech_model_combobox.set(SPEECH_MODELS[self.model_index_value.value])
         speech_model_combobox.pack(pady=5)
 
+        ## Backend selection for Speech-to-Text
+        backend_label = CTkLabel(self.options_window, text="Speech-To-Text Backend:")
+        backend_label.pack(pady=(10, 0))
+
+        def on_backend_select(event):
+            selected_backend = backend_combobox.get()
+            self.backend_index_value.value = ASR_BACKENDS.index(selected_backend)
+
+            update_config("ASR Backend", selected_backend)
+            print(f"\nASR backend changed to {selected_backend}\n")
+
+        backend_combobox = CTkComboBox(
+            self.options_window,
+            values=ASR_BACKENDS,
+            width=250,
+            command=on_backend_select,
+            justify="center",
+            hover=True,
+            state="readonly",
+        )
+        backend_combobox.set(ASR_BACKENDS[self.backend_index_value.value])
+        backend_combobox.pack(pady=5)
+
+        ## Dictation mode selection
+        dictation_mode_label = CTkLabel(self.options_window, text="Dictation Mode:")
+        dictation_mode_label.pack(pady=(10, 0))
+
+        def on_dictation_mode_select(event):
+            selected_mode = dictation_mode_combobox.get()
+            self.dictation_mode_value.value = DICTATION_MODES.index(selected_mode)
+
+            update_config("Dictation Mode", selected_mode)
+            print(f"\nDictation mode changed to {selected_mode}\n")
+
+        dictation_mode_combobox = CTkComboBox(
+            self.options_window,
+            values=DICTATION_MODES,
+            width=250,
+            command=on_dictation_mode_select,
+            justify="center",
+            hover=True,
+            state="readonly",
+        )
+        dictation_mode_combobox.set(DICTATION_MODES[self.dictation_mode_value.value])
+        dictation_mode_combobox.pack(pady=5)
+
         ## Model selection Combobox
         model_label = CTkLabel(self.options_window, text="Select Assistant Model:")
         model_label.pack(pady=(10, 0))
@@ -505,9 +624,55 @@ class SpeechDetectionGUI:
 
         # TODO add a check for using local_files_only
 
-        info_label = CTkLabel(self.options_window, text="(applicable to Whisper-Large)")
+        info_label = CTkLabel(
+            self.options_window, text="(multilingual models, from the next recording)"
+        )
         info_label.pack()
 
+        ## CPU engine Checkbox, saved for the selected model
+        def on_cpu_engine_check():
+            model_id = SPEECH_MODELS[self.model_index_value.value]
+            engine = "int8" if int8_check.get() else "float32"
+
+            set_cpu_engine(model_id, engine)
+            self.cpu_engine_value.value = CPU_ENGINES.index(engine)
+            print(f"\nCPU engine of {model_id} changed to {engine}\n")
+
+        int8_check = CTkCheckBox(
+            self.options_window,
+            text="Quantize to int8 on CPU",
+            command=on_cpu_engine_check,
+        )
+        if CPU_ENGINES[self.cpu_engine_value.value] == "int8":
+            int8_check.select()
+        int8_check.pack(pady=(20, 0))
+
+        ## Always-on microphone Checkbox, applied on the next start
+        def on_always_on_check():
+            update_config("Always-On Microphone", bool(always_on_check.get()))
+
+        always_on_check = CTkCheckBox(
+            self.options_window,
+            text="Keep microphone open (no clipped start)",
+            command=on_always_on_check,
+        )
+        if get_from_config("Always-On Microphone"):
+            always_on_check.select()
+        always_on_check.pack(pady=(20, 0))
+
+        ## Pipelined dictation Checkbox, applied on the next start
+        def on_pipelined_check():
+            update_config("Pipelined Dictation", bool(pipelined_check.get()))
+
+        pipelined_check = CTkCheckBox(
+            self.options_window,
+            text="Record while transcribing",
+            command=on_pipelined_check,
+        )
+        if get_from_config("Pipelined Dictation"):
+            pipelined_check.select()
+        pipelined_check.pack(pady=(20, 0))
+
         self.options_window.protocol("WM_DELETE_WINDOW", self.close_options)
 
     def close_options(self):
@@ -0,0 +1,74 @@
+from platform import system
+from time import perf_counter
+
+from src.config import HOTKEY, KEY_LISTENER_BACKEND, KEY_LISTENER_BACKENDS
+
+
+class ListenerBackend:
+    """
+    Interface of the key listeners.
+
+    A backend watches the keyboard from `run`, sets `start_event` once when
+    it is ready and then while the hotkey is held, and returns when
+    `terminate_event` is set. Hotkey transitions go through `press_hotkey`
+    and `release_hotkey`, which keep the time of the last ones so the
+    latency of the capture path can be measured on any backend.
+    """
+
+    name = "base"
+
+    def __init__(self, pipe, start_event, model_event, terminate_event):
+        self.pipe = pipe
+        self.start_event = start_event
+        self.model_event = model_event
+        self.terminate_event = terminate_event
+        self.hotkey = HOTKEY
+        self.hotkey_held = False
+
+        # perf_counter of the last hotkey press and release
+        self.pressed_at = 0.0
+        self.released_at = 0.0
+
+    def press_hotkey(self):
+        """Tells the capture loop to start recording"""
+        self.pressed_at = perf_counter()
+        self.start_event.set()
+        self.hotkey_held = True
+
+    def release_hotkey(self):
+        """Tells the capture loop to stop recording"""
+        self.released_at = perf_counter()
+        self.hotkey_held = False
+        self.start_event.clear()
+
+    def run(self):
+        raise NotImplementedError
+
+
+def listener_class(backend: str = KEY_LISTENER_BACKEND):
+    """
+    Finds the listener of a backend, importing only its dependencies.
+
+    Args:
+        backend (str): One of KEY_LISTENER_BACKENDS, "auto" picks it from the OS
+
+    Returns:
+        type: The ListenerBackend subclass
+    """
+    if backend not in KEY_LISTENER_BACKENDS:
+        raise ValueError(
+            f"Unknown key listener backend {backend}, expected one of {KEY_LISTENER_BACKENDS}"
+        )
+
+    # Differentiate between windows and linux
+    if backend == "auto":
+        backend = "windows" if system() == "Windows" else "x11"
+
+    if backend == "windows":
+        from src.key_listener.key_listener_win import Listener
+    elif backend == "x11":
+        from src.key_listener.key_listener import Listener
+    else:
+        from src.key_listener.trace_listener import TraceListener as Listener
+
+    return Listener
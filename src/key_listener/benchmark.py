@@ -0,0 +1,315 @@
+"""
+Measures the cost of handling key events in the X11 key listener.
+
+A synthetic typing trace, with the mouse moving in between, is encoded as
+the raw replies XRecord delivers and replayed through the handlers: the XK
+scan of the first listener, the table listener parsing every event with
+Xlib, and the fast mode that only records keys and reads them from the
+bytes. The keyboard mapping of the X server is used when a display is
+available.
+
+    python -m src.key_listener.benchmark
+"""
+
+from contextlib import redirect_stdout
+from io import StringIO
+from os import environ, makedirs
+from threading import Event
+from time import perf_counter
+from types import SimpleNamespace
+from typing import List
+import argparse
+import random
+import struct
+
+from Xlib import X, XK
+from Xlib.ext import record
+from Xlib.protocol import event as xevent, rq
+
+from src.key_listener.key_listener import Listener, build_keysym_names
+
+# Keycodes of a common evdev layout, used without an X display
+FAKE_KEYMAP = {
+    50: ["Shift_L"] * 4,
+    62: ["Shift_R"] * 4,
+    64: ["Alt_L", "Meta_L", "Alt_L", "Meta_L"],
+    133: ["Super_L"] * 4,
+    65: ["space"] * 4,
+    36: ["Return"] * 4,
+    22: ["BackSpace"] * 4,
+}
+FAKE_KEYMAP.update(
+    {
+        24 + i: [c, c.upper(), c, c.upper()]
+        for i, c in enumerate("qwertyuiop")
+    }
+)
+FAKE_KEYMAP.update(
+    {
+        38 + i: [c, c.upper(), c, c.upper()]
+        for i, c in enumerate("asdfghjkl")
+    }
+)
+FAKE_KEYMAP.update(
+    {
+        52 + i: [c, c.upper(), c, c.upper()]
+        for i, c in enumerate("zxcvbnm")
+    }
+)
+
+
+class FakeDisplay:
+    """Keyboard mapping of FAKE_KEYMAP, standing in for an X display"""
+
+    def __init__(self):
+        # Enough of a display for Xlib to parse events
+        self.display = SimpleNamespace(
+            info=SimpleNamespace(min_keycode=8, max_keycode=255),
+            event_classes=xevent.event_class,
+            get_resource_class=lambda name, default=None: default,
+        )
+
+    def keycode_to_keysym(self, keycode, index):
+        names = FAKE_KEYMAP.get(keycode, None)
+        return XK.string_to_keysym(names[index]) if names else 0
+
+    def close(self):
+        pass
+
+
+def open_display():
+    """Opens the X display, or the fake keymap when there is none"""
+    if environ.get("DISPLAY"):
+        from Xlib.display import Display
+
+        return Display()
+
+    return FakeDisplay()
+
+
+def key_event(event_type: int, keycode: int, state: int = 0):
+    return SimpleNamespace(type=event_type, detail=keycode, state=state)
+
+
+def typing_trace(
+    n_keys: int, hotkey_every: int = 200, motion_per_key: int = 0, seed: int = 0
+) -> List:
+    """
+    Builds a trace of key presses and releases of someone typing.
+
+    Args:
+        n_keys (int): Number of keys typed
+        hotkey_every (int): Keys typed between presses of Super + Shift
+        motion_per_key (int): Mouse motion events between keys
+        seed (int): Seed of the random keys
+
+    Returns:
+        events (list): Events with type, detail and state
+    """
+    rng = random.Random(seed)
+    letters = [code for code in FAKE_KEYMAP if code >= 24 and code < 62 and code != 36]
+
+    events = []
+    for i in range(n_keys):
+        if i % hotkey_every == hotkey_every - 1:
+            # The default hotkey, Super then Shift
+            events += [
+                key_event(X.KeyPress, 133),
+                key_event(X.KeyPress, 50, X.Mod4Mask),
+                key_event(X.KeyRelease, 50, X.Mod4Mask | X.ShiftMask),
+                key_event(X.KeyRelease, 133, X.Mod4Mask),
+            ]
+            continue
+
+        keycode = rng.choice(letters)
+        state = X.ShiftMask if rng.random() < 0.05 else 0
+        events += [
+            key_event(X.KeyPress, keycode, state),
+            key_event(X.KeyRelease, keycode, state),
+        ]
+        events += [key_event(X.MotionNotify, 0) for _ in range(motion_per_key)]
+
+    return events
+
+
+# Wire format of the core input events
+EVENT_FORMAT = struct.Struct("=BBHLLLLhhhhHB1x")
+
+
+def encode_replies(events: List, types=None) -> List:
+    """
+    Encodes events as XRecord replies, one event each.
+
+    Args:
+        events (list): Events with type, detail and state
+        types (tuple, optional): First and last event type recorded
+
+    Returns:
+        replies (list): Replies with the category and raw data
+    """
+    replies = []
+    for i, event in enumerate(events):
+        if types and not types[0] <= event.type <= types[1]:
+            continue
+
+        data = EVENT_FORMAT.pack(
+            event.type, event.detail, i & 0xFFFF, i, 1, 1, 0,
+            10, 10, 10, 10, event.state, 1,
+        )
+        replies.append(SimpleNamespace(category=record.FromServer, data=data))
+
+    return replies
+
+
+class ParsingHandler:
+    """Parses each recorded event with Xlib before handling it"""
+
+    def __init__(self, handler, disp):
+        self.handler = handler
+        self.disp = disp
+
+    def handle_reply(self, reply):
+        data = reply.data
+        while data:
+            event, data = rq.EventField(None).parse_binary_value(
+                data, self.disp.display, None, None
+            )
+            self.handler.handle_event(event)
+
+
+class LegacyHandler:
+    """The previous handler, naming each event by scanning the XK module"""
+
+    def __init__(self, disp, hotkey):
+        self.disp = disp
+        self.hotkey = hotkey
+        self.keys_down = set()
+        self.hotkey_held = False
+        self.presses = 0
+
+    def keycode_to_string(self, keycode, state):
+        i = 0
+        if state & X.ShiftMask:
+            i += 1
+        if state & X.Mod1Mask:
+            i += 2
+        key = self.disp.keycode_to_keysym(keycode, i)
+
+        keys = []
+        for name in dir(XK):
+            if name.startswith("XK_") and getattr(XK, name) == key:
+                keys.append(name.lstrip("XK_").replace("_L", "").replace("_R", ""))
+        if keys:
+            return " or ".join(keys)
+        return "[%d]" % key
+
+    def handle_event(self, event):
+        if event.type == X.KeyPress:
+            self.keys_down.add(self.keycode_to_string(event.detail, event.state))
+            if self.hotkey.issubset(self.keys_down) and not self.hotkey_held:
+                self.hotkey_held = True
+                self.presses += 1
+
+        elif event.type == X.KeyRelease:
+            key = self.keycode_to_string(event.detail, event.state)
+            if key in self.keys_down:
+                self.keys_down.remove(key)
+            elif key == "[0]" and "Shift" in self.keys_down:
+                self.keys_down.remove("Shift")
+
+            if not self.hotkey.issubset(self.keys_down) and self.hotkey_held:
+                self.hotkey_held = False
+                self.keys_down.clear()
+
+
+class FastHandler:
+    """Handles replies with the fast mode of the listener"""
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def handle_reply(self, reply):
+        self.listener.fast_event_handler(reply)
+
+
+class CountingEvent:
+    """Start event counting the hotkey presses"""
+
+    def __init__(self):
+        self.presses = 0
+
+    def set(self):
+        self.presses += 1
+
+    def clear(self):
+        pass
+
+    def is_set(self):
+        return False
+
+
+def table_listener(disp) -> Listener:
+    """Listener with its tables built from the display, not recording"""
+    makedirs("logs", exist_ok=True)
+    listener = Listener(None, CountingEvent(), Event(), Event())
+    listener.disp = disp
+    listener.query_disp = disp
+    listener.keysym_names = build_keysym_names()
+    listener.build_tables()
+    return listener
+
+
+def time_handler(handler, replies: List, runs: int = 3) -> float:
+    """Best time of handling the replies in milliseconds"""
+    best = float("inf")
+    for _ in range(runs):
+        # Hotkey presses are printed by the listener
+        with redirect_stdout(StringIO()):
+            t0 = perf_counter()
+            for reply in replies:
+                handler.handle_reply(reply)
+            best = min(best, perf_counter() - t0)
+
+    return best * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--keys", type=int, default=2000, help="Keys typed in the trace"
+    )
+    parser.add_argument(
+        "--motion", type=int, default=4, help="Mouse motion events between keys"
+    )
+    args = parser.parse_args()
+
+    disp = open_display()
+    events = typing_trace(args.keys, motion_per_key=args.motion)
+
+    t0 = perf_counter()
+    listener = table_listener(disp)
+    print(f"Tables built in {(perf_counter() - t0) * 1000:.1f}ms")
+
+    # Each handler sees what its record range delivers
+    broad = encode_replies(events, (X.KeyReleaseMask, X.ButtonReleaseMask))
+    keys_only = encode_replies(events, (X.KeyPress, X.KeyRelease))
+
+    legacy = LegacyHandler(disp, listener.hotkey)
+    results = [
+        ("XK scan", len(broad), time_handler(ParsingHandler(legacy, disp), broad, 1)),
+        ("tables", len(broad), time_handler(ParsingHandler(listener, disp), broad)),
+        ("fast", len(keys_only), time_handler(FastHandler(listener), keys_only)),
+    ]
+
+    print(f"{args.keys} keys typed, {len(events)} events in the trace")
+    for name, n_replies, total_ms in results:
+        print(
+            f"  {name:<8} {n_replies:6} replies {total_ms:9.2f}ms "
+            + f"{total_ms * 1000 / n_replies:8.2f}us per event "
+            + f"{total_ms * 1000 / args.keys:8.2f}us per key"
+        )
+    print(
+        f"Hotkey presses: XK scan {legacy.presses}, "
+        + f"tables and fast {listener.start_event.presses // 6}"
+    )
+    disp.close()
@@ -6,28 +6,87 @@
 # Requires python-xlib
 import logging
 from os.path import join
+from struct import Struct
+from threading import Event
+from typing import Dict
 
 from Xlib.display import Display
 from Xlib import X, XK
 from Xlib.ext import record
 from Xlib.protocol import rq
 
-from src.config import HOTKEY
+from src.config import X11_FAST_EVENTS
+from src.key_listener.backend import ListenerBackend
+from src.utils.synchronization import Wakeup
 
+# Keysym levels picked from the Shift and Alt modifiers of an event
+LEVELS = 4
+
+# Recorded core events are 32 bytes, in the byte order of the client
+EVENT_SIZE = 32
+EVENT_STATE = Struct("=H")
+STATE_OFFSET = 28
+
+# Disabling the record context is retried until the recording loop returns
+STOP_ATTEMPTS = 10
+STOP_RETRY_S = 0.1
+
+MOUSE_BUTTONS = {
+    X.Button1: "Button1",
+    X.Button2: "Button2",
+    X.Button3: "Button3",
+    X.Button4: "Button4",
+    X.Button5: "Button5",
+}
+
+
+def build_keysym_names() -> Dict[int, str]:
+    """
+    Names every keysym once, instead of scanning the XK module on each event.
+    Keysyms with several names get them joined with "or".
+
+    Returns:
+        names (dict): Name of each keysym, like "Super" for Super_L
+    """
+    names: Dict[int, list] = {}
+    for name in dir(XK):
+        if name.startswith("XK_"):
+            names.setdefault(getattr(XK, name), []).append(
+                name.lstrip("XK_").replace("_L", "").replace("_R", "")
+            )
+
+    return {keysym: " or ".join(key_names) for keysym, key_names in names.items()}
+
+
+class Listener(ListenerBackend):
+    name = "x11"
 
-class Listener:
     def __init__(self, pipe, start_event, model_event, terminate_event):
+        super().__init__(pipe, start_event, model_event, terminate_event)
         self.disp = None
-        self.keys_down = set()
-        self.pipe = pipe
-        self.start_event = start_event
-        self.model_event = model_event
-        self.terminate_event = terminate_event
-        self.hotkey_held = False
+        # Requests can not be made on the recording connection
+        self.query_disp = None
+        # Set once record_enable_context returned
+        self.recording_ended = Event()
 
-        # -- Hotkey --
-        self.hotkey = HOTKEY
-        # ------------
+        # Each key of the hotkey is a bit, it is held when all bits are set
+        self.hotkey_bits = {name: 1 << i for i, name in enumerate(sorted(self.hotkey))}
+        self.hotkey_mask = (1 << len(self.hotkey)) - 1
+        self.button_bits = {
+            button: self.hotkey_bits.get(name, 0) for button, name in MOUSE_BUTTONS.items()
+        }
+        self.uses_buttons = any(self.button_bits.values())
+
+        # Lookup tables indexed by keycode * LEVELS + level, built on start
+        self.keysym_names: Dict[int, str] = {}
+        self.keycode_names: list = []
+        self.keycode_bits: list = []
+        # Non zero for keycodes that are part of the hotkey at any level
+        self.hotkey_keycodes = bytearray()
+
+        # Hotkey bit of each key or button held down, buttons are negative
+        self.pressed: Dict[int, int] = {}
+        self.held_mask = 0
 
         # Configure the logging settings
         logging.basicConfig(
@@ -39,59 +98,100 @@ class Listener:
         self.logger = logging.getLogger(__name__)
         self.logger.info("Key listener for Linux started")
 
-    def keycode_to_key(self, keycode, state):
-        i = 0
-        if state & X.ShiftMask:
-            i += 1
-        if state & X.Mod1Mask:
-            i += 2
-        return self.disp.keycode_to_keysym(keycode, i)
-
-    def key_to_string(self, key):
-        keys = []
-        for name in dir(XK):
-            if name.startswith("XK_") and getattr(XK, name) == key:
-                keys.append(name.lstrip("XK_").replace("_L", "").replace("_R", ""))
-        if keys:
-            return " or ".join(keys)
-        return "[%d]" % key
+    def build_tables(self):
+        """
+        Resolves the name and hotkey bit of every keycode at every level.
+        Called on start and again when the keyboard mapping changes.
+        """
+        info = self.query_disp.display.info
+        size = (info.max_keycode + 1) * LEVELS
+
+        self.keycode_names = [""] * size
+        self.keycode_bits = [0] * size
+        self.hotkey_keycodes = bytearray(256)
+        for keycode in range(info.min_keycode, info.max_keycode + 1):
+            for level in range(LEVELS):
+                keysym = self.query_disp.keycode_to_keysym(keycode, level)
+                name = self.keysym_names.get(keysym, "[%d]" % keysym)
+
+                self.keycode_names[keycode * LEVELS + level] = name
+                self.keycode_bits[keycode * LEVELS + level] = self.hotkey_bits.get(name, 0)
+                if name in self.hotkey_bits:
+                    self.hotkey_keycodes[keycode] = 1
+
+        self.logger.info(f"Keycode tables built for keycodes up to {info.max_keycode}")
+
+    def refresh_tables(self, event):
+        """Rebuilds the tables after a change of the keyboard mapping"""
+        self.query_disp.refresh_keyboard_mapping(event)
+        self.build_tables()
+
+    @staticmethod
+    def level(state: int) -> int:
+        """Keysym level of the modifiers, 1 for Shift plus 2 for Alt"""
+        return (state & X.ShiftMask) | ((state & X.Mod1Mask) >> 2)
 
     def keycode_to_string(self, keycode, state):
-        return self.key_to_string(self.keycode_to_key(keycode, state))
+        index = keycode * LEVELS + self.level(state)
+        if index < len(self.keycode_names):
+            return self.keycode_names[index]
+        return "[%d]" % keycode
 
     def mouse_to_string(self, code):
-        if code == X.Button1:
-            return "Button1"
-        elif code == X.Button2:
-            return "Button2"
-        elif code == X.Button3:
-            return "Button3"
-        elif code == X.Button4:
-            return "Button4"
-        elif code == X.Button5:
-            return "Button5"
-        else:
-            return "{%d}" % code
+        return MOUSE_BUTTONS.get(code, "{%d}" % code)
 
-    def down(self, key):
-        # print(f"Key added: {key}")
-        self.keys_down.add(key)
-        # self.print_keys()
+    def down(self, code: int, bit: int):
+        """Marks a key or button as held, only hotkey keys have a bit"""
+        if bit:
+            self.pressed[code] = bit
+            self.held_mask |= bit
 
-    def up(self, key):
-        if key in self.keys_down:
-            self.keys_down.remove(key)
-            # self.print_keys()
-
-        # Removing shift key on up
-        elif key == "[0]" and "Shift" in self.keys_down:
-            self.keys_down.remove("Shift")
-            # self.print_keys()
+    def up(self, code: int):
+        if self.pressed.pop(code, 0):
+            held_mask = 0
+            for bit in self.pressed.values():
+                held_mask |= bit
+            self.held_mask = held_mask
 
     def print_keys(self):
-        keys = list(self.keys_down)
+        keys = [self.mouse_to_string(-code) if code < 0 else str(code) for code in self.pressed]
         print("Currently pressed:", ", ".join(keys))
 
+    def handle_event(self, event):
+        """Handles an event parsed by Xlib"""
+        if event.type == X.MappingNotify:
+            # Rebuilt right away, the next key is matched with the new layout
+            if event.request != X.MappingPointer:
+                self.refresh_tables(event)
+            return
+
+        self.handle(event.type, event.detail, event.state)
+
+    def handle(self, event_type: int, detail: int, state: int):
+        """Updates the held keys, matching the hotkey by integer comparison"""
+        if event_type == X.KeyPress:
+            index = detail * LEVELS + self.level(state)
+            if index < len(self.keycode_bits):
+                self.down(detail, self.keycode_bits[index])
+        elif event_type == X.KeyRelease:
+            self.up(detail)
+        elif event_type == X.ButtonPress:
+            self.down(-detail, self.button_bits.get(detail, 0))
+        elif event_type == X.ButtonRelease:
+            self.up(-detail)
+
+        ## Hotkey
+        if self.held_mask == self.hotkey_mask:
+            if not self.hotkey_held:
+                print(f"\nHOTKEY PRESSED")
+                self.press_hotkey()
+
+        elif self.hotkey_held:
+            self.release_hotkey()
+            # To remove sticky keys to not interfere with hotkey
+            self.pressed.clear()
+            self.held_mask = 0
+
     def event_handler(self, reply):
         # To terminate the process or thread
         if self.terminate_event.is_set():
@@ -102,66 +202,119 @@ class Listener:
             event, data = rq.EventField(None).parse_binary_value(
                 data, self.disp.display, None, None
             )
+            self.handle_event(event)
+
+    def fast_event_handler(self, reply):
+        """
+        Reads the type, keycode and state straight from the recorded bytes.
+        Keys that are not part of the hotkey are skipped before anything is
+        decoded, only mapping changes go through the Xlib parser.
+        """
+        # To terminate the process or thread
+        if self.terminate_event.is_set():
+            raise KeyboardInterrupt
 
-            if event.type == X.KeyPress:
-                self.down(self.keycode_to_string(event.detail, event.state))
+        if reply.category != record.FromServer:
+            return
 
-                ## Hotkey
-                if self.hotkey.issubset(self.keys_down) and not self.hotkey_held:
-                    print(f"\nHOTKEY PRESSED")
-                    self.start_event.set()
-                    self.hotkey_held = True
+        data = reply.data
+        hotkey_keycodes = self.hotkey_keycodes
+        pressed = self.pressed
 
-            elif event.type == X.KeyRelease:
-                self.up(self.keycode_to_string(event.detail, event.state))
+        for offset in range(0, len(data) - EVENT_SIZE + 1, EVENT_SIZE):
+            event_type = data[offset] & 0x7F
+            detail = data[offset + 1]
 
-                if (
-                    self.hotkey.issubset(self.keys_down) == False
-                    and self.hotkey_held == True
-                ):
-                    self.hotkey_held = False
-                    self.start_event.clear()
-                    # To remove sticky keys to not interfere with hotkey
-                    self.keys_down.clear()
+            if event_type == X.KeyPress:
+                if not hotkey_keycodes[detail]:
+                    continue
+            elif event_type == X.KeyRelease:
+                if detail not in pressed:
+                    continue
+            elif event_type == X.MappingNotify:
+                event, _ = rq.EventField(None).parse_binary_value(
+                    data[offset : offset + EVENT_SIZE], self.disp.display, None, None
+                )
+                self.handle_event(event)
+                hotkey_keycodes = self.hotkey_keycodes
+                continue
+            elif event_type == X.ButtonPress or event_type == X.ButtonRelease:
+                if not self.uses_buttons:
+                    continue
 
-            elif event.type == X.ButtonPress:
-                self.down(self.mouse_to_string(event.detail))
-            elif event.type == X.ButtonRelease:
-                self.up(self.mouse_to_string(event.detail))
+            state = EVENT_STATE.unpack_from(data, offset + STATE_OFFSET)[0]
+            self.handle(event_type, detail, state)
+
+    def record_range(self) -> dict:
+        """Events recorded from all clients, only keys in the fast mode"""
+        if X11_FAST_EVENTS:
+            last = X.ButtonRelease if self.uses_buttons else X.KeyRelease
+            device_events = (X.KeyPress, last)
+        else:
+            device_events = (X.KeyReleaseMask, X.ButtonReleaseMask)
+
+        return {
+            "core_requests": (0, 0),
+            "core_replies": (0, 0),
+            "ext_requests": (0, 0, 0, 0),
+            "ext_replies": (0, 0, 0, 0),
+            "delivered_events": (X.MappingNotify, X.MappingNotify),
+            "device_events": device_events,
+            "errors": (0, 0),
+            "client_started": False,
+            "client_died": False,
+        }
+
+    def stop_recording(self, ctx):
+        """
+        Disables the record context from the query connection, so
+        record_enable_context returns without waiting for a key event.
+        Repeated in case it was sent before the context was enabled.
+        """
+        for _ in range(STOP_ATTEMPTS):
+            try:
+                self.query_disp.record_disable_context(ctx)
+                self.query_disp.flush()
+            except Exception as e:
+                self.logger.error(f"Could not stop recording: {e}")
+                return
+
+            if self.recording_ended.wait(STOP_RETRY_S):
+                return
 
     def run(self):
         try:
             self.disp = Display()
+            self.query_disp = Display()
             XK.load_keysym_group("xf86")
-            root = self.disp.screen().root
+
+            # Names and hotkey bits resolved once, not on every key event
+            self.keysym_names = build_keysym_names()
+            self.build_tables()
 
             print(f"Hotkey assigned: {' + '.join(self.hotkey)}")
             # To signal to parent that it is ready
             self.start_event.set()
 
             ctx = self.disp.record_create_context(
-                0,
-                [record.AllClients],
-                [
-                    {
-                        "core_requests": (0, 0),
-                        "core_replies": (0, 0),
-                        "ext_requests": (0, 0, 0, 0),
-                        "ext_replies": (0, 0, 0, 0),
-                        "delivered_events": (0, 0),
-                        "device_events": (X.KeyReleaseMask, X.ButtonReleaseMask),
-                        "errors": (0, 0),
-                        "client_started": False,
-                        "client_died": False,
-                    }
-                ],
+                0, [record.AllClients], [self.record_range()]
             )
-            self.disp.record_enable_context(
-                ctx, lambda reply: self.event_handler(reply)
+            handler = self.fast_event_handler if X11_FAST_EVENTS else self.event_handler
+
+            # Blocks until the context is disabled when the terminate event is set
+            wakeup = Wakeup(
+                self.terminate_event,
+                lambda: self.stop_recording(ctx),
+                name="SA-KeyListenerWakeup",
             )
+            self.disp.record_enable_context(ctx, handler)
+            self.recording_ended.set()
+            wakeup.cancel()
             self.disp.record_free_context(ctx)
-            while True:
-                event = root.display.next_event()
+            self.logger.info("Terminate event is set on key_listener.py")
+            print(
+                "\n\033[92m\033[4mkey_listener.py\033[0m \033[92mprocess ended\033[0m"
+            )
         except KeyboardInterrupt:
             self.logger.info("Keyboard Interrupt")
             print(
@@ -173,7 +326,10 @@ class Listener:
                 "\n\033[91m\033[4mkey_listener.py\033[0m \033[91mprocess ended\033[0m"
             )
         finally:
+            self.recording_ended.set()
             self.disp.close()
+            if self.query_disp:
+                self.query_disp.close()
 
 
 if __name__ == "__main__":
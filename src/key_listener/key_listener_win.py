@@ -1,22 +1,19 @@
 from os.path import join
-from time import sleep
 import logging
 
-from keyboard import wait, is_pressed
+from keyboard import is_pressed, add_hotkey, remove_hotkey, on_release, unhook
 
-from src.config import HOTKEY
+from src.key_listener.backend import ListenerBackend
 
 
-class Listener:
+class Listener(ListenerBackend):
+    name = "windows"
+
     def __init__(self, pipe, start_event, model_event, terminate_event):
-        self.pipe = pipe
-        self.start_event = start_event
-        self.model_event = model_event
-        self.terminate_event = terminate_event
-        self.hotkey_held = False
+        super().__init__(pipe, start_event, model_event, terminate_event)
 
         # -- Hotkey --
-        self.hotkey = " + ".join(HOTKEY)
+        self.hotkey = " + ".join(self.hotkey)
         self.hotkey = self.hotkey.replace("Super", "left windows")
         # ------------
 
@@ -31,51 +28,33 @@ class Listener:
         self.logger.info("Key listener started")
 
     def down(self):
+        # Pressing during inference cancels it, handled by the capture loop
+        if self.model_event.is_set():
+            self.logger.info("Hotkey pressed while loading or inference is happening")
+
         if not self.hotkey_held and not self.start_event.is_set():
             print(f"{self.hotkey} is held")
-            self.start_event.set()
-            self.hotkey_held = True
+            self.press_hotkey()
 
     def up(self, e=None):
-        if self.hotkey_held and self.start_event.is_set():
+        # Released once any key of the hotkey is not pressed anymore
+        if self.hotkey_held and not is_pressed(self.hotkey):
             print(f"{self.hotkey} is released")
-            self.start_event.clear()
-            self.hotkey_held = False
+            self.release_hotkey()
 
     def run(self):
         # This is to start program once listener is set
         print(f"Hotkey assigned: {self.hotkey}")
         self.start_event.set()
 
+        # Hooks are called by the keyboard thread, no polling of the key state
+        hotkey_hook = add_hotkey(self.hotkey, self.down)
+        release_hook = on_release(self.up)
+
         try:
-            while 1:
-
-                # Wait until hotkey is pressed
-                while not is_pressed(self.hotkey):
-                    # Check for termination
-                    if self.terminate_event.is_set():
-                        self.logger.info(
-                            "Terminate event is set on key_listener_win.py"
-                        )
-                        raise KeyboardInterrupt
-                    sleep(0.05)
-
-                # So model can finish its inference first before continuing
-                if self.model_event.is_set():
-                    self.logger.warn("Hotkey pressed while loading or inference is happening!")
-                    sleep(0.5)
-                    continue
-
-                self.down()
-                # Wait until it is not pressed anymore
-                while is_pressed(self.hotkey):
-                    # If pass is here instead, then this while loop will run slower
-                    sleep(0.05)
-                self.up()
-
-                # To make sure inference happens first
-                sleep(1)
-        except KeyboardInterrupt:
+            # Waiting for termination
+            self.terminate_event.wait()
+            self.logger.info("Terminate event is set on key_listener_win.py")
             print(
                 "\n\033[92m\033[4mkey_listener_win.py\033[0m \033[92mprocess ended\033[0m"
             )
@@ -85,7 +64,8 @@ class Listener:
                 "\n\033[91m\033[4mkey_listener_win.py\033[0m \033[91mprocess ended\033[0m"
             )
         finally:
-            pass
+            remove_hotkey(hotkey_hook)
+            unhook(release_hook)
 
 
 if __name__ == "__main__":
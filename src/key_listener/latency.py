@@ -0,0 +1,443 @@
+"""
+Measures the latency of the capture path on each key listener backend.
+
+The same hotkey trace is fed to every backend while the capture code of
+voice_capturing records from a synthetic microphone delivering chunks in
+real time. For each press it measures the hotkey press to start_event,
+start_event to the first captured chunk, and the release to the recording
+being put on the queue. The X11 listener is fed raw XRecord replies, the
+Windows listener its hook callbacks, and the trace backend replays itself.
+
+    python -m src.key_listener.latency
+
+With --shutdown it checks instead that Stop ends the listener and capture
+threads within SHUTDOWN_TIMEOUT_S, idle and in the middle of a recording,
+and exits with an error otherwise.
+"""
+
+from multiprocessing import Condition
+from os import environ
+from threading import Event, Thread
+from time import perf_counter, sleep
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+
+from Xlib import X
+
+from src.config import HOTKEY, SHUTDOWN_TIMEOUT_S
+from src.key_listener.trace_listener import TraceListener, hotkey_trace
+from src.utils import voice_capturing
+from src.utils.audio_buffer import Recorder
+from src.utils.funcs import CHUNK, RATE
+from src.utils.synchronization import SynchEvent, join_all, wait_any
+
+BACKENDS = ["trace", "x11", "windows"]
+
+STEPS = [
+    "press to start_event",
+    "start_event to capture",
+    "capture to first chunk",
+    "release to queue",
+]
+
+
+class SyntheticStream:
+    """Input stream writing a chunk of silence every CHUNK frames"""
+
+    def __init__(self, write):
+        self.write = write
+        self.active = Event()
+        self.closed = False
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def start_stream(self):
+        self.active.set()
+
+    def stop_stream(self):
+        self.active.clear()
+
+    def is_active(self) -> bool:
+        return self.active.is_set()
+
+    def close(self):
+        self.closed = True
+        self.active.set()
+
+    def run(self):
+        chunk = bytes(2 * CHUNK)
+        period = CHUNK / RATE
+        while True:
+            self.active.wait()
+            if self.closed:
+                return
+
+            # A device hands over its first buffer once it is full
+            next_at = perf_counter() + period
+            while self.active.is_set() and not self.closed:
+                delay = next_at - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                if self.active.is_set():
+                    self.write(chunk)
+                next_at += period
+
+
+class TimedRecorder(Recorder):
+    """Recorder keeping the time of the first chunk of each recording"""
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.first_chunk_at: Optional[float] = None
+
+    def start(self):
+        self.first_chunk_at = None
+        super().start()
+
+    def write(self, pcm):
+        super().write(pcm)
+        if self.recording and self.first_chunk_at is None:
+            self.first_chunk_at = perf_counter()
+
+
+class TimedQueue:
+    """Queue of the model service keeping the time each recording was put"""
+
+    def __init__(self):
+        self.put_times: List[float] = []
+
+    def put(self, message):
+        if not message.get("partial", False):
+            self.put_times.append(perf_counter())
+
+
+class SilentCues:
+    def play(self, name):
+        pass
+
+    def close(self):
+        pass
+
+
+def hotkey_transitions(trace: List[Dict], hotkey) -> List[Tuple[float, float]]:
+    """Times the hotkey becomes held and stops being held in a trace"""
+    held = set()
+    transitions = []
+    pressed_at = None
+    for event in trace:
+        if event["action"] == "press":
+            held.add(event["key"])
+        else:
+            held.discard(event["key"])
+
+        if pressed_at is None and hotkey.issubset(held):
+            pressed_at = event["t"]
+        elif pressed_at is not None and not hotkey.issubset(held):
+            transitions.append((pressed_at, event["t"]))
+            pressed_at = None
+
+    return transitions
+
+
+def replay(trace: List[Dict], feed: Callable, started_at: float, terminate_event):
+    """Feeds the events of a trace to a listener at their times"""
+    for event in trace:
+        delay = started_at + event["t"] - perf_counter()
+        if delay > 0 and terminate_event.wait(delay):
+            return
+        feed(event["key"], event["action"])
+
+
+def x11_feeder(listener):
+    """Feeds keys to the X11 listener as raw XRecord replies, without a display"""
+    from src.key_listener.benchmark import open_display, encode_replies, key_event
+    from src.key_listener.key_listener import LEVELS, build_keysym_names
+
+    listener.disp = listener.query_disp = open_display()
+    listener.keysym_names = build_keysym_names()
+    listener.build_tables()
+
+    keycodes = {}
+    for index, name in enumerate(listener.keycode_names):
+        if index % LEVELS == 0 and name:
+            keycodes.setdefault(name, index // LEVELS)
+
+    def feed(key, action):
+        event_type = X.KeyPress if action == "press" else X.KeyRelease
+        for reply in encode_replies([key_event(event_type, keycodes[key])]):
+            listener.fast_event_handler(reply)
+
+    return feed
+
+
+def windows_feeder(listener):
+    """Calls the hook callbacks of the Windows listener"""
+
+    def feed(key, action):
+        if action == "press":
+            listener.down()
+        else:
+            listener.up()
+
+    return feed
+
+
+def capture_loop(listener, start_event, model_event, terminate_event, queue, results):
+    """The pipelined capture loop of main_loop, timing each recording"""
+    while True:
+        wait_any(start_event, terminate_event)
+        if terminate_event.is_set():
+            return
+
+        woke_at = perf_counter()
+        set_at = listener.pressed_at
+        voice_capturing.start_recording(
+            start_event,
+            model_event,
+            queue,
+            pipelined=True,
+            terminate_event=terminate_event,
+        )
+        results.append(
+            {
+                "set_at": set_at,
+                "woke_at": woke_at,
+                "first_chunk_at": voice_capturing.recorder.first_chunk_at,
+                "put_at": queue.put_times[-1] if queue.put_times else None,
+            }
+        )
+        start_event.clear()
+
+
+def start_path(backend: str, trace: List[Dict], live: bool = False):
+    """
+    Starts a listener of the backend and the capture loop.
+
+    Args:
+        backend (str): "trace", "x11" or "windows"
+        trace (List[Dict]): Hotkey presses to replay
+        live (bool): Runs the listener on the keyboard instead of feeding it the trace
+
+    Returns:
+        path (SimpleNamespace): The listener, events, threads and results
+    """
+    condition = Condition()
+    start_event = SynchEvent(condition)
+    model_event = SynchEvent(condition)
+    terminate_event = SynchEvent(condition)
+
+    if backend == "trace":
+        listener = TraceListener(None, start_event, model_event, terminate_event, trace)
+        target = listener.run
+    else:
+        if backend == "x11":
+            from src.key_listener.key_listener import Listener
+        else:
+            from src.key_listener.key_listener_win import Listener
+
+        listener = Listener(None, start_event, model_event, terminate_event)
+        if live:
+            target = listener.run
+        else:
+            feed = x11_feeder(listener) if backend == "x11" else windows_feeder(listener)
+
+            def target():
+                listener.started_at = perf_counter()
+                replay(trace, feed, listener.started_at, terminate_event)
+
+    # Globals of the capture code, normally set up by main_loop
+    voice_capturing.recorder = TimedRecorder(voice_capturing.CAPTURE_BUFFER_S * RATE)
+    voice_capturing.stream_input = SyntheticStream(voice_capturing.recorder.write)
+    voice_capturing.always_on = False
+    voice_capturing.cue_player = SilentCues()
+
+    path = SimpleNamespace(
+        listener=listener,
+        start_event=start_event,
+        terminate_event=terminate_event,
+        queue=TimedQueue(),
+        results=[],
+    )
+    path.capture = Thread(
+        target=capture_loop,
+        args=(
+            listener,
+            start_event,
+            model_event,
+            terminate_event,
+            path.queue,
+            path.results,
+        ),
+        daemon=True,
+    )
+    path.listener_thread = Thread(target=target, daemon=True)
+
+    # Listeners running on their own signal they are ready
+    if backend == "trace" or live:
+        path.listener_thread.start()
+        start_event.wait()
+        start_event.clear()
+        path.capture.start()
+    else:
+        path.capture.start()
+        path.listener_thread.start()
+
+    return path
+
+
+def stop_path(path) -> Tuple[float, List[Thread]]:
+    """
+    Stops the listener and the capture loop the way Stop does.
+
+    Returns:
+        seconds (float): Time for the threads to end
+        alive (list): Threads that did not end within SHUTDOWN_TIMEOUT_S
+    """
+    t0 = perf_counter()
+    path.terminate_event.set()
+    path.start_event.set()
+    alive = join_all([path.capture, path.listener_thread], SHUTDOWN_TIMEOUT_S)
+    seconds = perf_counter() - t0
+
+    voice_capturing.stream_input.close()
+    return seconds, alive
+
+
+def measure(backend: str, trace: List[Dict]) -> List[Dict[str, float]]:
+    """
+    Runs the capture path on a backend with the trace.
+
+    Args:
+        backend (str): "trace", "x11" or "windows"
+        trace (List[Dict]): Hotkey presses to replay
+
+    Returns:
+        latencies (list): Milliseconds of each step, for every press
+    """
+    path = start_path(backend, trace)
+
+    # Waiting for every press to be recorded
+    transitions = hotkey_transitions(trace, HOTKEY)
+    deadline = perf_counter() + trace[-1]["t"] + 2.0
+    while len(path.results) < len(transitions) and perf_counter() < deadline:
+        sleep(0.05)
+    stop_path(path)
+
+    started_at = path.listener.started_at
+    latencies = []
+    for (press_t, release_t), result in zip(transitions, path.results):
+        times = [
+            result["set_at"] - (started_at + press_t),
+            result["woke_at"] - result["set_at"],
+            result["first_chunk_at"] - result["woke_at"],
+            result["put_at"] - (started_at + release_t),
+        ]
+        latencies.append({step: t * 1000 for step, t in zip(STEPS, times)})
+
+    return latencies
+
+
+def measure_shutdown(backend: str, recording: bool) -> Tuple[float, List[Thread]]:
+    """
+    Times Stop on a running backend, idle or while the hotkey is held.
+    The X11 listener runs on the display, blocked reading key events.
+
+    Args:
+        backend (str): "trace", "x11" or "windows"
+        recording (bool): Stops in the middle of a recording
+
+    Returns:
+        seconds (float): Time for the threads to end
+        alive (list): Threads that did not end within SHUTDOWN_TIMEOUT_S
+    """
+    live = backend != "trace"
+    trace = hotkey_trace(sorted(HOTKEY), 1, hold_s=30.0, lead_s=0.2)
+    path = start_path(backend, trace if recording else [], live)
+
+    if recording and live:
+        # Nobody holds the hotkey of a live listener
+        path.listener.press_hotkey()
+    sleep(1.0)
+
+    return stop_path(path)
+
+
+def summarize(latencies: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Mean, p95 and max of each step in milliseconds"""
+    stats = {}
+    for step in STEPS + ["press to first chunk"]:
+        if step == "press to first chunk":
+            values = [sum(lat[s] for s in STEPS[:3]) for lat in latencies]
+        else:
+            values = [lat[step] for lat in latencies]
+        values.sort()
+        stats[step] = {
+            "mean": sum(values) / len(values),
+            "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+            "max": values[-1],
+        }
+
+    return stats
+
+
+def check_shutdown(backends: List[str]) -> bool:
+    """Checks that Stop ends every backend within SHUTDOWN_TIMEOUT_S"""
+    ok = True
+    for backend in backends:
+        # Without a display the X11 listener can not block on it
+        if backend == "x11" and not environ.get("DISPLAY"):
+            print(f"{backend}: skipped, no display")
+            continue
+
+        for recording in (False, True):
+            try:
+                seconds, alive = measure_shutdown(backend, recording)
+            except ImportError as e:
+                print(f"{backend}: skipped, {e}")
+                break
+
+            state = "recording" if recording else "idle"
+            result = "OK" if not alive else "NOT ENDED: " + ", ".join(
+                thread.name for thread in alive
+            )
+            print(f"{backend:<8} {state:<10} stopped in {seconds * 1000:7.1f}ms {result}")
+            ok = ok and not alive
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--presses", type=int, default=10)
+    parser.add_argument("--hold", type=float, default=0.3, help="Seconds held")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument(
+        "--shutdown",
+        action="store_true",
+        help=f"Checks that Stop ends the threads within {SHUTDOWN_TIMEOUT_S}s",
+    )
+    args = parser.parse_args()
+
+    if args.shutdown:
+        if not check_shutdown(args.backends):
+            raise SystemExit(f"Stop took longer than {SHUTDOWN_TIMEOUT_S}s")
+        raise SystemExit(0)
+
+    trace = hotkey_trace(sorted(HOTKEY), args.presses, hold_s=args.hold, gap_s=0.2)
+
+    for backend in args.backends:
+        try:
+            latencies = measure(backend, trace)
+        except ImportError as e:
+            print(f"{backend}: skipped, {e}")
+            continue
+
+        print(f"{backend}: {len(latencies)} of {args.presses} presses recorded")
+        if not latencies:
+            continue
+        for step, stat in summarize(latencies).items():
+            print(
+                f"  {step:<24} mean {stat['mean']:7.2f}ms "
+                + f"p95 {stat['p95']:7.2f}ms max {stat['max']:7.2f}ms"
+            )
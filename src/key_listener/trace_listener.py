@@ -0,0 +1,159 @@
+"""
+Key listener replaying a recorded timeline of key presses and releases.
+
+A trace is a JSON list of events, in order of time:
+
+    [
+        {"t": 0.50, "key": "Super", "action": "press"},
+        {"t": 0.55, "key": "Shift", "action": "press"},
+        {"t": 2.50, "key": "Shift", "action": "release"},
+        {"t": 2.52, "key": "Super", "action": "release"}
+    ]
+
+where "t" is seconds from the start of the listener and "key" uses the names
+of HOTKEY. Set KEY_LISTENER_BACKEND to "trace" to drive the program with it.
+"""
+
+from os.path import join
+from time import perf_counter
+from typing import Dict, Iterable, List
+import json
+import logging
+
+from src.config import KEY_TRACE_FILE
+from src.key_listener.backend import ListenerBackend
+
+ACTIONS = ("press", "release")
+
+
+def load_trace(filename: str = KEY_TRACE_FILE) -> List[Dict]:
+    """Reads a trace, checking that its events are in order of time"""
+    with open(filename, "r") as file:
+        trace = json.load(file)
+
+    last = 0.0
+    for event in trace:
+        if event["action"] not in ACTIONS:
+            raise ValueError(f"Unknown action {event['action']} in {filename}")
+        if event["t"] < last:
+            raise ValueError(f"Events of {filename} are not in order of time")
+        last = event["t"]
+
+    return trace
+
+
+def save_trace(trace: List[Dict], filename: str = KEY_TRACE_FILE):
+    with open(filename, "w") as file:
+        json.dump(trace, file, indent=4)
+
+
+def hotkey_trace(
+    hotkey: Iterable[str],
+    presses: int,
+    hold_s: float = 1.0,
+    gap_s: float = 0.5,
+    lead_s: float = 0.5,
+    key_gap_s: float = 0.02,
+) -> List[Dict]:
+    """
+    Builds the trace of someone pressing and holding the hotkey.
+
+    Args:
+        hotkey (Iterable[str]): Keys of the hotkey, pressed in this order
+        presses (int): Number of times the hotkey is pressed
+        hold_s (float): Seconds the hotkey is held
+        gap_s (float): Seconds between a release and the next press
+        lead_s (float): Seconds before the first press, for the program to start
+        key_gap_s (float): Seconds between the keys of the hotkey
+
+    Returns:
+        trace (list): Events with their time, key and action
+    """
+    keys = list(hotkey)
+    trace = []
+    t = lead_s
+    for _ in range(presses):
+        for key in keys:
+            trace.append({"t": round(t, 6), "key": key, "action": "press"})
+            t += key_gap_s
+        t += hold_s
+        for key in reversed(keys):
+            trace.append({"t": round(t, 6), "key": key, "action": "release"})
+            t += key_gap_s
+        t += gap_s
+
+    return trace
+
+
+class TraceListener(ListenerBackend):
+    """
+    Replays a trace in real time, matching the hotkey on the keys it holds.
+    Waits on the terminate event between events, so stopping does not wait
+    for the rest of the trace.
+
+    Args:
+        trace (List[Dict], optional): Events to replay, KEY_TRACE_FILE if not given
+    """
+
+    name = "trace"
+
+    def __init__(self, pipe, start_event, model_event, terminate_event, trace=None):
+        super().__init__(pipe, start_event, model_event, terminate_event)
+        self.trace = trace if trace is not None else load_trace()
+        self.held = set()
+
+        # perf_counter the replay started at, event times are relative to it
+        self.started_at = 0.0
+
+        # Configure the logging settings
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format="%(asctime)s - %(levelname)s - %(message)s",
+            filename=join("logs", "key_listener.log"),
+            filemode="w",
+        )
+        self.logger = logging.getLogger(__name__)
+        self.logger.info(f"Key listener replaying {len(self.trace)} events")
+
+    def handle(self, key: str, action: str):
+        if action == "press":
+            self.held.add(key)
+        else:
+            self.held.discard(key)
+
+        if self.hotkey.issubset(self.held):
+            if not self.hotkey_held:
+                print(f"\nHOTKEY PRESSED")
+                self.press_hotkey()
+        elif self.hotkey_held:
+            self.release_hotkey()
+
+    def run(self):
+        print(f"Hotkey assigned: {' + '.join(self.hotkey)} (replaying a trace)")
+        # To signal to parent that it is ready
+        self.start_event.set()
+
+        self.started_at = perf_counter()
+        try:
+            for event in self.trace:
+                delay = self.started_at + event["t"] - perf_counter()
+                if delay > 0 and self.terminate_event.wait(delay):
+                    break
+                self.handle(event["key"], event["action"])
+
+            # A trace ending with the hotkey held would never stop recording
+            if self.hotkey_held:
+                self.release_hotkey()
+            self.logger.info("Trace replayed")
+
+            # Waiting for termination
+            self.terminate_event.wait()
+            self.logger.info("Terminate event is set on trace_listener.py")
+            print(
+                "\n\033[92m\033[4mtrace_listener.py\033[0m \033[92mprocess ended\033[0m"
+            )
+        except Exception as e:
+            self.logger.error(f"Exception on trace_listener.py: {e}")
+            print(
+                "\n\033[91m\033[4mtrace_listener.py\033[0m \033[91mprocess ended\033[0m"
+            )
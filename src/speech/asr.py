@@ -1,21 +1,50 @@
 from sys import exit
-from os.path import join, basename, realpath
+from itertools import count
+from queue import Empty
+from os.path import join
 import gc
 from time import sleep, time
 import logging
 import traceback
 from typing import Any, Callable, Dict
 
-from src import LOAD_MODEL_SIGNAL, UNLOAD_MODEL_SIGNAL, TERMINATE_SIGNAL
-from src.config import SPEECH_MODELS, TASK, TASKS, MODEL_ID
-from src.utils.funcs import find_gpu_config
+from src import LOAD_MODEL_SIGNAL, UNLOAD_MODEL_SIGNAL, TERMINATE_SIGNAL, is_signal
+from src.config import SPEECH_MODELS, TASK, TASKS, MODEL_ID, MODEL_MEMORY_BUDGET_MB
+from src.config import SPEECH_LANGUAGE, CPU_TUNING
+from src.config import CPU_ENGINES, DEFAULT_CPU_ENGINE
+from src.config import ASR_BACKENDS, DEFAULT_ASR_BACKEND, ORT_NUM_THREADS
+from src.config import get_cpu_engine, set_cpu_engine, get_from_config, update_config
+from src.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, NEWER_AUDIO_CHECK_S
+from src.config import SCHEDULER_CHUNK_S, SCHEDULER_SPLIT_SEARCH_S, BULK_MIN_S
+from src.config import (
+    VAD_ENABLED,
+    VAD_FRAME_MS,
+    VAD_MARGIN_DB,
+    VAD_MIN_DB,
+    VAD_MAX_DB,
+    VAD_ZCR_THRESHOLD,
+    VAD_PAD_MS,
+    VAD_MIN_SPEECH_MS,
+)
+from src.utils.funcs import find_gpu_config, RATE
+from src.utils.synchronization import wait_for
 from src.speech.processing import perform_request, process_text
-
+from src.speech.streaming import LocalAgreement
+from src.speech.sequencer import Sequencer
+from src.speech.audio import prepare_audio, is_raw_audio, trim_silence, load_audio_file
+from src.speech.audio import split_points
+from src.speech.scheduler import Scheduler, classify, CONTROL, LIVE, BULK
+from src.speech.residency import ModelResidency
+from src.speech.model_cache import load_speech_model, load_quantized_model
+from src.speech.model_cache import load_onnx_model, onnx_path
+from src.speech.engines import TransformersEngine, ONNXEngine, CancelCriteria
+from src.speech.guards import token_budget
+from src.speech.tuning import tune_cpu_threads, pin_model_thread
+
+from transformers import StoppingCriteriaList
 from transformers.pipelines import pipeline
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor
 import torch
 
-# from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
 # from optimum.nvidia.pipelines import pipeline
 TIMEOUT = 10
 
@@ -28,59 +57,45 @@ def clear_mem():
         torch.cuda.empty_cache()
 
 
-def load_model(gui_pipe, model_event, model_index_value, task_value, logger):
-    """Loads the ASR model using HuggingFace's Transformers library.
+def build_engine(
+    model_id,
+    device,
+    device_name,
+    torch_dtype,
+    gui_pipe,
+    logger,
+    cpu_engine=DEFAULT_CPU_ENGINE,
+    backend=DEFAULT_ASR_BACKEND,
+):
+    """Builds the ASR engine of a model using HuggingFace's Transformers library.
 
     Args:
+        model_id (str): The HuggingFace id of the model to load.
+        device (torch.device): The device to load the model to.
+        device_name (str): The name of the device, empty for CPU.
+        torch_dtype (torch.dtype): The data type of the weights.
         gui_pipe (Pipe): A Pipe object for communicating with the GUI process.
-        model_event (threading.Event): An event to signal when the model is loaded.
-        model_id_value (int): The ID of the model to load.
+            None when there is no GUI.
         logger (logging.Logger): A logger to log information about the loading process.
+        cpu_engine (str, optional): The CPU engine, int8 quantizes the model on CPU.
+        backend (str, optional): The backend running the model, one of ASR_BACKENDS.
 
     Returns:
-        ModelPipeline: The ASR model as a Transformers pipeline.
+        ASREngine: The ASR model behind the engine interface.
     """
+    notify = gui_pipe.send if gui_pipe else None
 
-    # Checking for GPU
-    device, device_name, torch_dtype = find_gpu_config(logger)
-
-    # Setting cache dir
-    local_cache_dir = join(".", "model")
-
-    # Getting model id
-    model_id = SPEECH_MODELS[model_index_value.value]
-
-    # Downloading the model from HuggingFace Hub
-    gui_pipe.send(f"Downloading {basename(model_id)}...")
-    logger.info(
-        f"Downloading model {basename(model_id)} into {realpath(local_cache_dir)}"
-    )
-
-    model = AutoModelForSpeechSeq2Seq.from_pretrained(
-        model_id,
-        torch_dtype=torch_dtype,
-        low_cpu_mem_usage=True,
-        use_safetensors=True,
-        cache_dir=local_cache_dir,
-        # local_files_only=True,
-    )
-
-    # Loading the model to device
-    gui_pipe.send(
-        f"Loading {basename(model_id)} to {device_name if device_name else 'CPU'}..."
-    )
-    model.to(device)
-
-    # Making pipeline for inference
-    processor = AutoProcessor.from_pretrained(
-        model_id,
-        cache_dir=local_cache_dir,
-        # local_files_only=True
-    )
-
-    # Setting task
-    generate_kwargs = {"task": TASKS[task_value.value]} if "-large" in model_id else {}
-    logger.info(f"Setting task as {task_value.value}")
+    # Loading from the local manifest and pre-converted cache
+    if backend == "onnxruntime":
+        model, processor, timer = load_onnx_model(
+            model_id, device, ORT_NUM_THREADS, notify, logger
+        )
+    elif cpu_engine == "int8" and not device_name:
+        model, processor, timer = load_quantized_model(model_id, notify, logger)
+    else:
+        model, processor, timer = load_speech_model(
+            model_id, torch_dtype, device, device_name, notify, logger
+        )
 
     model_pipe = pipeline(
         "automatic-speech-recognition",
@@ -92,36 +107,150 @@ def load_model(gui_pipe, model_event, model_index_value, task_value, logger):
         batch_size=16,
         torch_dtype=torch_dtype,
         device=device,
-        generate_kwargs=generate_kwargs,
     )
 
+    # Task and language are given with each request
+    engine_kwargs = {"max_new_tokens": 128}
+    if backend == "onnxruntime":
+        engine = ONNXEngine(model_pipe, onnx_path(model_id), **engine_kwargs)
+    else:
+        engine = TransformersEngine(model_pipe, **engine_kwargs)
+
     # Checking if GPU or CPU used
     if device_name:
-        print(f"\n\n\033[1m{model_id}\033[0m loaded to {device_name}\n\n")
+        print(f"\n\n\033[1m{model_id}\033[0m loaded to {device_name} with {engine.name}\n\n")
     else:
         print(
-            f"\n\033[1m{model_id}\033[0m loaded to physical memory and CPU is used.\n"
+            f"\n\033[1m{model_id}\033[0m loaded to physical memory and CPU is used with {engine.name}.\n"
             + "WARNING: Unfortunatly these models are not optimal to be computed on CPU!\n\n"
         )
-    del device, torch_dtype, local_cache_dir, processor
+    print(timer.report(logger))
+    del processor
+
+    return engine
+
+
+def load_model(
+    gui_pipe,
+    model_event,
+    model_index_value,
+    logger,
+    residency=None,
+    backend_value=None,
+    cpu_engine_value=None,
+):
+    """Loads the ASR model, reusing it if it is already resident.
+
+    Args:
+        gui_pipe (Pipe): A Pipe object for communicating with the GUI process.
+        model_event (threading.Event): An event to signal when the model is loaded.
+            None when switching models between requests.
+        model_id_value (int): The ID of the model to load.
+        logger (logging.Logger): A logger to log information about the loading process.
+        residency (ModelResidency, optional): Keeps several models loaded at once.
+        backend_value (int, optional): The index of the backend, read from
+            the config when not given.
+        cpu_engine_value (int, optional): The index of the CPU engine, read
+            from the config when not given.
+
+    Returns:
+        ASREngine: The ASR model behind the engine interface.
+    """
+
+    # Checking for GPU
+    device, device_name, torch_dtype = find_gpu_config(logger)
+
+    # Getting model id, the task is set per request
+    model_id = SPEECH_MODELS[model_index_value.value]
+
+    # Quantized engine is only used on CPU with PyTorch
+    if backend_value is not None:
+        backend = ASR_BACKENDS[backend_value.value]
+    else:
+        backend = get_from_config("ASR Backend") or DEFAULT_ASR_BACKEND
+    if device_name:
+        cpu_engine = DEFAULT_CPU_ENGINE
+    elif cpu_engine_value is not None:
+        cpu_engine = CPU_ENGINES[cpu_engine_value.value]
+    else:
+        cpu_engine = get_cpu_engine(model_id)
+    if backend == "onnxruntime":
+        precision = "onnx"
+    else:
+        precision = "int8" if cpu_engine == "int8" else str(torch_dtype)
+
+    def loader():
+        return build_engine(
+            model_id,
+            device,
+            device_name,
+            torch_dtype,
+            gui_pipe,
+            logger,
+            cpu_engine,
+            backend,
+        )
+
+    if residency is not None:
+        engine = residency.get((model_id, precision), loader)
+    else:
+        engine = loader()
+
+    # Leaving CPU time to the GUI and key listener while decoding
+    if not device_name and CPU_TUNING:
+        tune_cpu_threads(engine, gui_pipe.send if gui_pipe else None, logger)
+
+    del device, torch_dtype
 
     # Telling parent that model is loaded
-    model_event.set()
+    if model_event is not None:
+        model_event.set()
 
-    return model_pipe
+    return engine
+
+
+def detect_speech(audio, sampling_rate, logger):
+    """Trims the silence around the speech, empty if there is no speech"""
+    n_samples = audio.shape[0]
+    audio = trim_silence(
+        audio,
+        sampling_rate,
+        frame_ms=VAD_FRAME_MS,
+        margin_db=VAD_MARGIN_DB,
+        min_db=VAD_MIN_DB,
+        max_db=VAD_MAX_DB,
+        zcr_threshold=VAD_ZCR_THRESHOLD,
+        pad_ms=VAD_PAD_MS,
+        min_speech_ms=VAD_MIN_SPEECH_MS,
+    )
+    logger.debug(
+        f"VAD kept {audio.shape[0] / sampling_rate:.2f}s "
+        + f"of {n_samples / sampling_rate:.2f}s"
+    )
 
+    return audio
 
-def run_model(synch_dict: Dict[str, Any], write_method: Callable, logger):
+
+def run_model(
+    synch_dict: Dict[str, Any],
+    write_method: Callable,
+    logger,
+    residency: ModelResidency = None,
+    scheduler: Scheduler = None,
+):
     """This is to run the model
 
     Args:
         synch_dict (dict): Dictionary containing all the synchronization variables
         write_method (str): Method to write the output of model
         logger (logging.Logger): Logger object to write logs
+        residency (ModelResidency, optional): Models kept loaded between switches
+        scheduler (Scheduler, optional): Serves the Audio Queue by priority
 
     """
     # Extracting synchronization variables from dictionary
     queue = synch_dict["Audio Queue"]
+    transcription_queue = synch_dict.get("Transcription Queue", None)
     gui_pipe = synch_dict["Model-GUI Pipe"]
     start_event = synch_dict["Start Event"]
     model_event = synch_dict["Model Event"]
@@ -129,11 +258,43 @@ def run_model(synch_dict: Dict[str, Any], write_method: Callable, logger):
     model_id_value = synch_dict["Model Index"]
     task_value = synch_dict["Task Bool"]
     use_agent_value = synch_dict["Agent Bool"]
+    backend_value = synch_dict.get("Backend Index", None)
+    cpu_engine_value = synch_dict.get("CPU Engine Index", None)
+    cancel_event = synch_dict.get("Cancel Event", None)
+    if scheduler is None:
+        scheduler = Scheduler(queue, logger)
+
+    def select_model(selection):
+        """Sets the options back to a model that loads, here and in the config"""
+        model_index, backend, cpu_engine = selection
+        if cpu_engine_value is not None and cpu_engine_value.value != cpu_engine:
+            cpu_engine_value.value = cpu_engine
+            set_cpu_engine(SPEECH_MODELS[model_index], CPU_ENGINES[cpu_engine])
+        if model_id_value.value != model_index:
+            model_id_value.value = model_index
+            update_config("Default Model Index", model_index)
+        if backend_value is not None and backend is not None and (
+            backend_value.value != backend
+        ):
+            backend_value.value = backend
+            update_config("ASR Backend", ASR_BACKENDS[backend])
+
+    def selected_model():
+        """Model, backend and CPU engine chosen in the options, part of the residency key"""
+        backend = backend_value.value if backend_value is not None else None
+        cpu_engine = cpu_engine_value.value if cpu_engine_value is not None else None
+        return (model_id_value.value, backend, cpu_engine)
 
     # Load the model
     try:
-        model_pipe = load_model(
-            gui_pipe, model_event, model_id_value, task_value, logger
+        engine = load_model(
+            gui_pipe,
+            model_event,
+            model_id_value,
+            logger,
+            residency,
+            backend_value,
+            cpu_engine_value,
         )
     except torch.cuda.OutOfMemoryError as e:
         # Logging
@@ -142,45 +303,189 @@ def run_model(synch_dict: Dict[str, Any], write_method: Callable, logger):
         print(f"\nDevice out of memory: {e}\n")
 
         # Clear memory and syncronize
+        if residency is not None:
+            residency.clear()
         clear_mem()
         model_event.set()
         return
+    except Exception as e:
+        # A backend that can not run here falls back to the default one
+        if backend_value is None or backend_value.value == ASR_BACKENDS.index(
+            DEFAULT_ASR_BACKEND
+        ):
+            raise
+        failed = ASR_BACKENDS[backend_value.value]
+        logger.error(f"Could not load the model with {failed}: {e}")
+        gui_pipe.send(f"ERROR: {failed} failed, using {DEFAULT_ASR_BACKEND}")
+        select_model(
+            (
+                model_id_value.value,
+                ASR_BACKENDS.index(DEFAULT_ASR_BACKEND),
+                cpu_engine_value.value if cpu_engine_value is not None else None,
+            )
+        )
+
+        engine = load_model(
+            gui_pipe,
+            model_event,
+            model_id_value,
+            logger,
+            residency,
+            backend_value,
+            cpu_engine_value,
+        )
 
     gui_pipe.send("Model loaded. Hold hotkey to start")
     previous_text = ""
+    loaded_model = selected_model()
 
-    while not terminate_event.is_set():
+    # Follows the stable words of streaming dictation and the audio they cover
+    agreement = LocalAgreement()
 
-        # Get audio bytes from queue
-        message: dict = queue.get(block=True)
-        audio_bytes = message.get("message", None)
-        do_action = message.get("do_action", True)
+    # Transcripts are typed in recording order, freeing a pending slot each
+    pending_utterances = synch_dict.get("Pending Utterances", None)
 
-        t0 = time()
+    def hotkey_released():
+        """Waits for the hotkey release, typed keys would combine with its modifiers"""
+        if start_event.is_set():
+            logger.debug("Waiting for the hotkey to be released to write")
+        wait_for(
+            start_event.condition,
+            lambda: not start_event.is_set() or terminate_event.is_set(),
+        )
 
-        ## Synchronization control ##
-        # This is for process to remove model from memory
-        if audio_bytes == UNLOAD_MODEL_SIGNAL:
-            break
-        # This is for process to terminate
-        elif audio_bytes == TERMINATE_SIGNAL:
-            raise KeyboardInterrupt
+    sequencer = Sequencer(
+        lambda sequence: pending_utterances.release() if pending_utterances else None,
+        before_action=hotkey_released,
+    )
 
-        ## Transcribing ##
-        try:
-            with torch.no_grad():
-                result = model_pipe(audio_bytes)
-            clear_mem()
-        except torch.cuda.OutOfMemoryError as e:
-            logger.error("Out of memory error")
-            gui_pipe.send("CUDA: Out of memory")
-            continue
+    def reply(message, text):
+        """Sends the transcription of a web UI request back on its own queue"""
+        if transcription_queue is not None:
+            transcription_queue.put(
+                {"transcription": text, "request_id": message.get("request_id", None)}
+            )
+
+    def report_progress(message):
+        """Tells the web UI a request is still being worked on"""
+        if transcription_queue is not None:
+            transcription_queue.put(
+                {"request_id": message.get("request_id", None), "status": "progress"}
+            )
+
+    def finish(message, action=None):
+        """Runs the action of a recording in order, web UI requests are not numbered"""
+        sequence = message.get("sequence", None)
+        if sequence is None:
+            if action is not None:
+                action()
+            # Dropped web UI requests are answered so the UI stops waiting
+            elif not message.get("do_action", True):
+                reply(message, "")
+        else:
+            sequencer.complete(sequence, action)
+
+    # Long uploads split into chunks, by job number
+    jobs: Dict[int, Dict[str, Any]] = {}
+    job_numbers = count()
+
+    def split_job(message, audio):
+        """Splits a long upload so live dictation can be served between its chunks"""
+        points = split_points(
+            audio, engine.sampling_rate, SCHEDULER_CHUNK_S, SCHEDULER_SPLIT_SEARCH_S
+        )
+        job = next(job_numbers)
+        jobs[job] = {"message": message, "texts": [None] * len(points), "t0": time()}
+
+        # Very long files are bulk work, behind shorter uploads
+        duration = audio.shape[0] / engine.sampling_rate
+        priority = BULK if duration > BULK_MIN_S else message["priority"]
+
+        ends = points[1:] + [audio.shape[0]]
+        for chunk, (start, end) in enumerate(zip(points, ends)):
+            scheduler.put(
+                {"audio": audio[start:end], "job": job, "chunk": chunk},
+                priority,
+            )
+        logger.info(f"Split {duration:.1f}s upload into {len(points)} chunks")
+
+    def drop(batch):
+        """Gives up on requests, freeing their place in the typing order"""
+        for message, _ in batch:
+            if "job" in message:
+                job = jobs.pop(message["job"], None)
+                if job is not None:
+                    finish(job["message"])
+            elif not message.get("partial", False):
+                finish(message)
+        model_event.clear()
 
-        logger.info(f"Time for inference: {time() - t0:.4f} seconds")
+    def cancelled_since(since):
+        """Time of the last request to cancel if it was made after `since`, else None"""
+        if cancel_event is not None and cancel_event.is_set():
+            if cancel_event.requested_at >= since:
+                return cancel_event.requested_at
+
+        return None
+
+    newer_checked_at = 0.0
+
+    def cancel_requested(partial, since):
+        """Time cancelling the running inference was requested, None if it was not"""
+        nonlocal newer_checked_at
+
+        requested_at = cancelled_since(since)
+        if requested_at is not None:
+            return requested_at
+
+        # A newer recording supersedes the partial transcript being decoded
+        if partial and time() - newer_checked_at >= NEWER_AUDIO_CHECK_S:
+            newer_checked_at = time()
+            newer = scheduler.first_pending(LIVE)
+            if newer is not None:
+                return newer["queued_at"]
+
+        return None
+
+    def deliver(message, result, t0):
+        """Routes a transcription back to the originator of the request"""
+        nonlocal previous_text
+
+        # Chunks of an upload are joined once all of them are transcribed
+        if "job" in message:
+            job = jobs.get(message["job"], None)
+            if job is None:
+                return
+            job["texts"][message["chunk"]] = result["text"].strip()
+            report_progress(job["message"])
+            if None not in job["texts"]:
+                del jobs[message["job"]]
+                deliver(job["message"], {"text": " ".join(job["texts"])}, job["t0"])
+            return
+
+        ## Streaming dictation ##
+        # Nothing is typed while the hotkey is held, it would add its modifiers
+        if message.get("partial", False):
+            hypothesis = result["text"].strip()
+            committed = agreement.insert(hypothesis)
+            if committed:
+                logger.debug(f"Committed: {committed}")
+
+            # Stable segments are not decoded again
+            trimmed = agreement.advance(result.get("segments", []))
+            if trimmed:
+                logger.debug(f"Trimmed {trimmed:.2f}s of committed audio")
+            gui_pipe.send(" ".join(agreement.done + agreement.previous))
+            return
+
+        # Words of the audio trimmed while streaming come first
+        text = result["text"]
+        if message.get("streaming", False):
+            text = agreement.finalize(text)
 
         # Process text
         processed_text = process_text(
-            result["text"],
+            text,
             start_event,
             previous_text,
         )
@@ -189,27 +494,278 @@ def run_model(synch_dict: Dict[str, Any], write_method: Callable, logger):
         # Action report
         speech_to_text_time = time() - t0
         print(
-            f"\nTranscription: {result['text']}\nSpeech-to-text time: {speech_to_text_time:.3f}s\n"
+            f"\nTranscription: {text}\nSpeech-to-text time: {speech_to_text_time:.3f}s\n"
         )
-        previous_text = result["text"]
+        previous_text = text
 
-        if do_action:
+        action = None
+        if message.get("do_action", True):
             # LLM inference and actions taken
-            perform_request(processed_text, write_method, use_agent_value.value)
+            action = lambda: perform_request(
+                processed_text, write_method, use_agent_value.value
+            )
         else:
             # Send text to queue for web ui
-            queue.put({"transcription": processed_text})
+            action = lambda: reply(message, processed_text)
+        finish(message, action)
 
         # Resetting
         logger.debug(f"Result: {result}")
         model_event.clear()
 
+    def prepare(message):
+        """Converts the audio of a message, None if there is nothing to transcribe"""
+        audio = message.get("message", None)
+
+        # Captured audio is converted in-process
+        if is_raw_audio(audio):
+            t0 = time()
+            audio = prepare_audio(
+                audio,
+                message.get("sampling_rate", RATE),
+                engine.sampling_rate,
+            )
+            logger.debug(f"Time for audio conversion: {time() - t0:.4f} seconds")
+
+            # Audio of the words committed while streaming is not decoded again
+            partial = message.get("partial", False)
+            if partial or message.get("streaming", False):
+                audio = audio[int(agreement.trimmed_s * engine.sampling_rate) :]
+
+            if VAD_ENABLED:
+                speech = detect_speech(audio, engine.sampling_rate, logger)
+                # Segment timestamps of partial decodes count from the start of the buffer
+                audio = audio if partial and speech.shape[0] else speech
+
+            # Nothing said, the model is not invoked
+            if audio.shape[0] == 0:
+                logger.info("No speech detected, skipping inference")
+                if partial:
+                    return None
+                # Words committed before the silence are still written
+                if message.get("streaming", False) and agreement.done:
+                    deliver(message, {"text": ""}, t0)
+                    return None
+                agreement.reset()
+                gui_pipe.send("")
+                finish(message)
+                model_event.clear()
+                return None
+
+        # Uploaded files are decoded here so they can join a batch
+        elif isinstance(audio, str):
+            audio = load_audio_file(audio, engine.sampling_rate)
+
+        return audio
+
+    def is_batchable(message) -> bool:
+        """
+        Only finished recordings, uploads and chunks are batched, never signals.
+        Streaming recordings depend on the state of their partial decodes.
+        """
+        if message.get("partial", False) or message.get("streaming", False):
+            return False
+        if classify(message) == CONTROL:
+            return False
+        return "job" in message or is_raw_audio(message.get("message", None)) or (
+            isinstance(message.get("message", None), str)
+        )
+
+    def collect_batch(batch):
+        """Adds the requests of the same class waiting in the queue to the batch"""
+        deadline = time() + BATCH_MAX_WAIT_MS / 1000
+        while len(batch) < BATCH_MAX_SIZE:
+            try:
+                remaining = deadline - time()
+                message = scheduler.get(
+                    block=remaining > 0,
+                    timeout=max(remaining, 0),
+                    max_priority=batch[0][0]["priority"],
+                )
+            except Empty:
+                break
+
+            # Handled on their own after the batch, keeping their place in line
+            if not is_batchable(message):
+                scheduler.put(message)
+                break
+
+            # Chunk of a cancelled upload
+            if "job" in message and message["job"] not in jobs:
+                continue
+
+            audio = message.pop("audio", None)
+            if audio is None:
+                audio = prepare(message)
+            if audio is None:
+                continue
+            if not engine.fits_single_window(audio):
+                message["audio"] = audio
+                scheduler.put(message)
+                break
+            batch.append((message, audio))
+
+    while not terminate_event.is_set():
+
+        # Most urgent request, audio is already prepared for chunks of uploads
+        message = scheduler.get(block=True)
+        audio_bytes = message.pop("audio", None)
+        partial = message.get("partial", False)
+        t0 = time()
+
+        ## Synchronization control ##
+        # This is for process to remove model from memory
+        if is_signal(message.get("message", None), UNLOAD_MODEL_SIGNAL):
+            break
+        # This is for process to terminate
+        elif is_signal(message.get("message", None), TERMINATE_SIGNAL):
+            raise KeyboardInterrupt
+
+        # Chunk of a cancelled upload
+        if "job" in message and message["job"] not in jobs:
+            continue
+
+        # Dictation recorded before a request to cancel is not transcribed
+        cancelled_at = cancelled_since(message["queued_at"])
+        if message["priority"] == LIVE and cancelled_at is not None:
+            logger.info("Skipping a recording queued before cancelling")
+            if not partial:
+                agreement.reset()
+            drop([(message, None)])
+            continue
+
+        # Stale partial, newer audio is already waiting in the queue
+        if partial and scheduler.pending(LIVE):
+            logger.debug("Skipping stale partial decode")
+            continue
+
+        # Switching model if changed in options, no reload when it is resident
+        if selected_model() != loaded_model:
+            try:
+                engine = load_model(
+                    gui_pipe,
+                    None,
+                    model_id_value,
+                    logger,
+                    residency,
+                    backend_value,
+                    cpu_engine_value,
+                )
+                loaded_model = selected_model()
+            except torch.cuda.OutOfMemoryError as e:
+                logger.error(f"Device out of memory on model switch: {e}")
+                gui_pipe.send("CUDA: Out of memory")
+                if not partial:
+                    finish(message)
+                model_event.clear()
+                continue
+            # Missing dependencies or a broken cache, the previous engine is kept
+            except Exception:
+                logger.error(f"Could not switch model: {traceback.format_exc()}")
+                gui_pipe.send("ERROR: Could not load the model, keeping the previous one")
+                select_model(loaded_model)
+
+        if audio_bytes is None:
+            audio_bytes = prepare(message)
+            if audio_bytes is None:
+                continue
+
+        # Long uploads are transcribed a chunk at a time, also when they were
+        # decoded while collecting a batch
+        if isinstance(message.get("message", None), str) and (
+            not engine.fits_single_window(audio_bytes)
+        ):
+            split_job(message, audio_bytes)
+            continue
+
+        # Requests that arrived together share one generate call
+        batch = [(message, audio_bytes)]
+        if (
+            is_batchable(message)
+            and engine.supports_batching
+            and engine.fits_single_window(audio_bytes)
+        ):
+            collect_batch(batch)
+
+        ## Transcribing ##
+        # A request to cancel applies to the dictation queued before it and
+        # to the other requests once their inference started
+        if message["priority"] == LIVE:
+            since = max(queued["queued_at"] for queued, _ in batch)
+        else:
+            since = t0
+
+        # Checked between decoding steps, from the GUI, the hotkey or newer audio
+        criteria = CancelCriteria(lambda: cancel_requested(partial, since))
+        generate_kwargs = {"stopping_criteria": StoppingCriteriaList([criteria])}
+
+        # Task of the options window, switching it needs no reload
+        generate_kwargs.update(
+            engine.prompt_kwargs(TASKS[task_value.value], SPEECH_LANGUAGE)
+        )
+
+        # Segment ends of a partial decode tell which audio its stable words cover
+        if partial and engine.fits_single_window(audio_bytes):
+            generate_kwargs["return_timestamps"] = True
+
+        # Token budget from the longest speech, each generate call sees one window
+        duration = max(audio.shape[0] for _, audio in batch) / engine.sampling_rate
+        window = engine.feature_extractor.n_samples / engine.sampling_rate
+        generate_kwargs["max_new_tokens"] = token_budget(min(duration, window))
+        try:
+            with torch.no_grad():
+                if len(batch) > 1:
+                    results = engine.transcribe_batch(
+                        [audio for _, audio in batch], generate_kwargs=generate_kwargs
+                    )
+                else:
+                    results = [
+                        engine.transcribe(audio_bytes, generate_kwargs=generate_kwargs)
+                    ]
+            clear_mem()
+        except torch.cuda.OutOfMemoryError as e:
+            logger.error("Out of memory error")
+            gui_pipe.send("CUDA: Out of memory")
+            drop(batch)
+            continue
+
+        if criteria.cancelled:
+            logger.info(
+                f"Inference of {len(batch)} requests cancelled, stopped "
+                + f"{(time() - criteria.requested_at) * 1000:.1f}ms after the request"
+            )
+            if not partial:
+                agreement.reset()
+                gui_pipe.send("Transcription cancelled")
+            drop(batch)
+            continue
+
+        logger.info(
+            f"Time for inference: {time() - t0:.4f} seconds, batch of {len(batch)}"
+        )
+
+        for (message, _), result in zip(batch, results):
+            if result.get("aborted", None):
+                logger.info(
+                    f"Decoding stopped early, {result['aborted']}: "
+                    + f"no-speech probability {result['no_speech_prob']:.2f}"
+                )
+            elif result.get("truncated", False):
+                logger.warning(
+                    f"Transcription truncated at {generate_kwargs['max_new_tokens']} "
+                    + f"tokens for {duration:.1f}s of speech"
+                )
+            deliver(message, result, t0)
+
     ## Finally
     model_event.clear()
+    logger.info(scheduler.report())
 
     # Clearing model from memory
     logger.info("Removing model from memory")
-    del model_pipe
+    del engine
+    if residency is not None:
+        residency.clear()
 
     clear_mem()
 
@@ -228,6 +784,15 @@ def audio_processing_service(synch_dict, write_method):
     # Extracting synchronization variables
     queue = synch_dict["Audio Queue"]
 
+    # Models kept loaded while switching between them
+    residency = ModelResidency(MODEL_MEMORY_BUDGET_MB, on_evict=clear_mem, logger=logger)
+
+    # Live dictation is served before uploads waiting in the queue
+    scheduler = Scheduler(queue, logger)
+
+    # Before the first torch op, so the worker threads inherit the affinity
+    pin_model_thread(logger)
+
     try:
         while True:
 
@@ -236,16 +801,18 @@ def audio_processing_service(synch_dict, write_method):
                 synch_dict,
                 write_method,
                 logger,
+                residency,
+                scheduler,
             )
 
             # Signal to load model or terminate thread after stop
             run_model_signal = False
             while run_model_signal is False:
-                message = queue.get(block=True)
-                run_model_signal = message.get("message", None) == LOAD_MODEL_SIGNAL
+                message = scheduler.get(block=True)
+                run_model_signal = is_signal(message.get("message", None), LOAD_MODEL_SIGNAL)
                 
                 # Terminate the model thread
-                if message.get("message", None) == TERMINATE_SIGNAL:
+                if is_signal(message.get("message", None), TERMINATE_SIGNAL):
                     raise KeyboardInterrupt
 
     except KeyboardInterrupt:
@@ -0,0 +1,216 @@
+import numpy as np
+
+# Scale for converting 16-bit PCM to [-1.0, 1.0) floats
+PCM16_SCALE = 1.0 / 32768.0
+
+
+def pcm_to_float32(pcm) -> np.ndarray:
+    """
+    Converts 16-bit PCM from pyaudio into float32 samples without
+    an intermediate copy of the raw buffer.
+
+    Args:
+        pcm (bytes | np.ndarray): Mono int16 PCM bytes or samples
+
+    Returns:
+        samples (np.ndarray): float32 samples in [-1.0, 1.0)
+    """
+    if isinstance(pcm, np.ndarray) and pcm.dtype == np.float32:
+        return pcm
+
+    # View of the buffer, no copy is made here
+    if isinstance(pcm, np.ndarray):
+        samples = pcm.view(np.int16)
+    else:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+
+    # Single allocation for the converted samples
+    return np.multiply(samples, PCM16_SCALE, dtype=np.float32)
+
+
+def resample(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """
+    Resamples audio in the frequency domain. Truncating the spectrum
+    acts as an ideal low-pass filter so no aliasing is introduced
+    when downsampling from the microphone rate to the model rate.
+
+    Args:
+        audio (np.ndarray): float32 mono samples
+        orig_sr (int): Sampling rate of the audio
+        target_sr (int): Sampling rate expected by the model
+
+    Returns:
+        audio (np.ndarray): float32 samples at target_sr
+    """
+    if orig_sr == target_sr or audio.shape[0] == 0:
+        return audio
+
+    n_in = audio.shape[0]
+    n_out = int(round(n_in * target_sr / orig_sr))
+
+    # Keeping only the bins representable at the new rate
+    spectrum = np.fft.rfft(audio)
+    spectrum = spectrum[: n_out // 2 + 1]
+    resampled = np.fft.irfft(spectrum, n_out)
+
+    # Rescaling for the change in transform length
+    resampled *= n_out / n_in
+
+    return resampled.astype(np.float32, copy=False)
+
+
+def prepare_audio(audio, orig_sr: int, target_sr: int) -> np.ndarray:
+    """
+    Converts captured PCM into the float32 array at the feature
+    extractor's sampling rate, ready to be passed to the pipeline.
+
+    Args:
+        audio (bytes | np.ndarray): Captured int16 PCM or float32 samples
+        orig_sr (int): Sampling rate of the captured audio
+        target_sr (int): Sampling rate of the feature extractor
+
+    Returns:
+        audio (np.ndarray): float32 samples at target_sr
+    """
+    return resample(pcm_to_float32(audio), orig_sr, target_sr)
+
+
+def load_audio_file(path: str, sampling_rate: int) -> np.ndarray:
+    """
+    Decodes an audio file with ffmpeg, as the pipeline would do.
+
+    Args:
+        path (str): Path of the uploaded file
+        sampling_rate (int): Sampling rate of the feature extractor
+
+    Returns:
+        audio (np.ndarray): float32 mono samples at sampling_rate
+    """
+    from transformers.pipelines.audio_utils import ffmpeg_read
+
+    with open(path, "rb") as f:
+        return ffmpeg_read(f.read(), sampling_rate)
+
+
+def is_raw_audio(message) -> bool:
+    """Checks if a queue message holds captured audio rather than a file path or signal"""
+    return isinstance(message, (bytes, bytearray, memoryview, np.ndarray))
+
+
+def frame_features(audio: np.ndarray, frame_length: int):
+    """
+    Computes the energy and zero-crossing rate of non-overlapping frames.
+
+    Args:
+        audio (np.ndarray): float32 mono samples
+        frame_length (int): Number of samples per frame
+
+    Returns:
+        energy_db (np.ndarray): Frame energy in dBFS
+        zcr (np.ndarray): Fraction of sign changes in each frame
+    """
+    n_frames = audio.shape[0] // frame_length
+    frames = audio[: n_frames * frame_length].reshape(n_frames, frame_length)
+
+    energy_db = 10.0 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_length
+
+    return energy_db, zcr
+
+
+def trim_silence(
+    audio: np.ndarray,
+    sampling_rate: int,
+    frame_ms: float = 30,
+    margin_db: float = 10,
+    min_db: float = -55,
+    max_db: float = -35,
+    zcr_threshold: float = 0.25,
+    pad_ms: float = 200,
+    min_speech_ms: float = 150,
+) -> np.ndarray:
+    """
+    Trims leading and trailing silence with an energy and zero-crossing
+    voice activity detector. The threshold adapts to the noise floor of the
+    recording, clipped between min_db and max_db. Voiced frames are loud,
+    unvoiced consonants are quieter but cross zero often.
+
+    Args:
+        audio (np.ndarray): float32 mono samples
+        sampling_rate (int): Sampling rate of the audio
+        frame_ms (float): Frame length in milliseconds
+        margin_db (float): Level above the noise floor for voiced frames
+        min_db (float): Lowest threshold for voiced frames in dBFS
+        max_db (float): Highest threshold for voiced frames in dBFS
+        zcr_threshold (float): Zero-crossing rate of unvoiced frames
+        pad_ms (float): Audio kept around the detected speech in milliseconds
+        min_speech_ms (float): Voiced audio needed to consider it speech
+
+    Returns:
+        audio (np.ndarray): View of the speech region, empty if there is no speech
+    """
+    frame_length = max(int(sampling_rate * frame_ms / 1000), 1)
+    if audio.shape[0] < frame_length:
+        return audio[:0]
+
+    energy_db, zcr = frame_features(audio, frame_length)
+
+    # Adaptive threshold from the quietest frames
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = np.clip(noise_floor + margin_db, min_db, max_db)
+
+    voiced = energy_db > threshold
+    unvoiced = (zcr > zcr_threshold) & (energy_db > threshold - margin_db / 2)
+
+    # Dropping recordings without speech before the model is invoked
+    if np.count_nonzero(voiced) * frame_ms < min_speech_ms:
+        return audio[:0]
+
+    speech = np.flatnonzero(voiced | unvoiced)
+    pad = int(sampling_rate * pad_ms / 1000)
+    start = max(speech[0] * frame_length - pad, 0)
+    end = min((speech[-1] + 1) * frame_length + pad, audio.shape[0])
+
+    return audio[start:end]
+
+
+def split_points(
+    audio: np.ndarray,
+    sampling_rate: int,
+    max_s: float,
+    search_s: float,
+    frame_ms: float = 30,
+):
+    """
+    Finds where to cut long audio into chunks of at most max_s seconds.
+    Each cut is placed at the quietest frame of the last search_s seconds
+    before the limit, so words are rarely split between chunks.
+
+    Args:
+        audio (np.ndarray): float32 mono samples
+        sampling_rate (int): Sampling rate of the audio
+        max_s (float): Longest chunk in seconds
+        search_s (float): Seconds before the limit searched for a pause
+        frame_ms (float): Frame length in milliseconds
+
+    Returns:
+        points (list): Sample indices where the chunks start, beginning with 0
+    """
+    max_length = int(max_s * sampling_rate)
+    search_length = int(search_s * sampling_rate)
+    frame_length = max(int(sampling_rate * frame_ms / 1000), 1)
+
+    points = [0]
+    while audio.shape[0] - points[-1] > max_length:
+        end = points[-1] + max_length
+        window = audio[end - search_length : end]
+
+        # Cutting at the start of the quietest frame
+        energy_db, _ = frame_features(window, frame_length)
+        if energy_db.shape[0] == 0:
+            points.append(end)
+        else:
+            points.append(end - search_length + int(np.argmin(energy_db)) * frame_length)
+
+    return points
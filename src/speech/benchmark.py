@@ -0,0 +1,148 @@
+"""
+Benchmarks for the ASR models.
+
+Compares the latency and word error rate of the CPU engines and backends
+against float32 PyTorch for each model:
+
+    python -m src.speech.benchmark recording.wav "the reference transcription"
+"""
+
+from time import perf_counter
+from typing import Dict, List, Optional
+import argparse
+import logging
+import re
+
+import torch
+
+from src.config import SPEECH_MODELS
+
+# (CPU engine, backend) compared, the first one is the baseline
+CPU_VARIANTS = [
+    ("float32", "transformers"),
+    ("int8", "transformers"),
+    ("float32", "onnxruntime"),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_words(text: str) -> List[str]:
+    """Lowercases and removes punctuation before comparing transcriptions"""
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    Computes the word error rate with the edit distance between word sequences.
+
+    Args:
+        reference (str): The correct transcription
+        hypothesis (str): The transcription of the model
+
+    Returns:
+        wer (float): Substitutions, deletions and insertions over reference words
+    """
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+
+    # Edit distance, one row at a time
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+
+    return previous[-1] / max(len(ref), 1)
+
+
+def time_engine(engine, audio, runs: int = 3):
+    """
+    Times an ASR engine on the audio after a warm-up run.
+
+    Returns:
+        latency (float): Median latency in seconds
+        text (str): The transcription
+    """
+    with torch.no_grad():
+        result = engine.transcribe(audio)
+
+        latencies = []
+        for _ in range(runs):
+            t0 = perf_counter()
+            result = engine.transcribe(audio)
+            latencies.append(perf_counter() - t0)
+
+    return sorted(latencies)[len(latencies) // 2], result["text"]
+
+
+def compare_cpu_engines(
+    audio,
+    reference: str,
+    models: Optional[List[str]] = None,
+    runs: int = 3,
+) -> List[Dict]:
+    """
+    Compares the latency and WER of each CPU variant against float32 for each model.
+
+    Args:
+        audio (str | np.ndarray): Path of a recording or 16 kHz float32 samples
+        reference (str): The correct transcription of the recording
+        models (list, optional): Model ids to compare, defaults to SPEECH_MODELS
+        runs (int): Number of timed runs per engine
+
+    Returns:
+        rows (list): One row per model and variant
+    """
+    from src.speech.asr import build_engine, clear_mem
+
+    rows = []
+    for model_id in models or SPEECH_MODELS:
+        baseline = None
+        for cpu_engine, backend in CPU_VARIANTS:
+            engine = build_engine(
+                model_id,
+                torch.device("cpu"),
+                "",
+                torch.float32,
+                None,
+                logger,
+                cpu_engine,
+                backend,
+            )
+            latency, text = time_engine(engine, audio, runs)
+            del engine
+            clear_mem()
+
+            baseline = baseline or latency
+            rows.append(
+                {
+                    "model": model_id,
+                    "engine": cpu_engine,
+                    "backend": backend,
+                    "latency": latency,
+                    "speedup": baseline / latency,
+                    "wer": word_error_rate(reference, text),
+                }
+            )
+            print(
+                f"{model_id:<35} {cpu_engine:<8} {backend:<13} {latency:7.3f}s "
+                + f"x{baseline / latency:4.2f} WER {rows[-1]['wer']:.3f}"
+            )
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare CPU engines and backends of the ASR models")
+    parser.add_argument("audio", help="Recording to transcribe")
+    parser.add_argument("reference", help="Correct transcription of the recording")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    compare_cpu_engines(args.audio, args.reference, runs=args.runs)
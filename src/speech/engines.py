@@ -0,0 +1,368 @@
+from os.path import getsize, join
+from os import walk
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from transformers import LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from transformers.modeling_outputs import BaseModelOutput
+
+from src.config import NO_SPEECH_ABORT
+
+from src.speech.residency import resident_size
+from src.speech.guards import HallucinationGuard, compression_ratio, no_speech_token_id
+
+# Seconds between two timestamp tokens of Whisper
+TIMESTAMP_S = 0.02
+
+
+class CancelCriteria(StoppingCriteria):
+    """
+    Stops generation between decoding steps once cancellation is requested.
+    It keeps stopping every following generate call, so the remaining chunks
+    of a long recording are skipped as well.
+
+    Args:
+        requested (Callable): Returns the time cancellation was requested,
+            None while the inference should go on
+    """
+
+    def __init__(self, requested: Callable[[], Optional[float]]):
+        self.requested = requested
+        self.requested_at: Optional[float] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.requested_at is not None
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.requested_at is None:
+            self.requested_at = self.requested()
+
+        return self.cancelled
+
+
+class ASREngine:
+    """
+    Interface of the ASR backends used by the model service.
+
+    An engine takes float32 audio at `sampling_rate` (or a file path) and
+    returns a result with at least a "text" key. The capability flags tell
+    the service which features the backend can be used with.
+    """
+
+    name = "base"
+
+    # Capability flags
+    supports_gpu = False
+    supports_int8 = False
+    supports_translate = False
+    supports_batching = False
+
+    def transcribe(self, audio, **kwargs) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @property
+    def sampling_rate(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def resident_size(self) -> int:
+        """Memory taken by the engine in bytes"""
+        raise NotImplementedError
+
+    def transcribe_batch(self, audios: List, **kwargs) -> List[Dict[str, Any]]:
+        """Transcribes several inputs, backends without batching run them in turn"""
+        return [self.transcribe(audio, **kwargs) for audio in audios]
+
+    def __call__(self, audio, **kwargs) -> Dict[str, Any]:
+        return self.transcribe(audio, **kwargs)
+
+
+class TransformersEngine(ASREngine):
+    """Runs a HuggingFace Transformers pipeline with PyTorch."""
+
+    name = "transformers"
+
+    supports_gpu = True
+    supports_int8 = True
+    supports_translate = True
+    supports_batching = True
+
+    def __init__(
+        self,
+        model_pipe,
+        generate_kwargs: Optional[Dict[str, Any]] = None,
+        max_new_tokens: int = 128,
+    ):
+        self.model_pipe = model_pipe
+        self.generate_kwargs = generate_kwargs or {}
+        self.max_new_tokens = max_new_tokens
+        self.no_speech_id = no_speech_token_id(model_pipe.tokenizer)
+        # Generate arguments of each task and language, resolved once
+        self.prompts: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+
+    @property
+    def model(self):
+        return self.model_pipe.model
+
+    @property
+    def tokenizer(self):
+        return self.model_pipe.tokenizer
+
+    @property
+    def feature_extractor(self):
+        return self.model_pipe.feature_extractor
+
+    @property
+    def sampling_rate(self) -> int:
+        return self.feature_extractor.sampling_rate
+
+    @property
+    def resident_size(self) -> int:
+        return resident_size(self.model)
+
+    @property
+    def is_multilingual(self) -> bool:
+        """English-only models reject a task or language, their tokenizers still have the tokens"""
+        return getattr(self.model.generation_config, "is_multilingual", False)
+
+    def prompt_kwargs(self, task: str, language: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate arguments setting the task and language of the decoder prompt,
+        so they can change between requests without reloading the model.
+
+        Args:
+            task (str): transcribe or translate
+            language (str, optional): Language of the speech, None detects it
+
+        Returns:
+            generate_kwargs (dict): Arguments to pass to generate
+        """
+        key = (task, language)
+        if key not in self.prompts:
+            if not self.is_multilingual:
+                self.prompts[key] = {}
+            elif language is None:
+                self.prompts[key] = {"task": task}
+            else:
+                self.prompts[key] = {"task": task, "language": language}
+
+        return self.prompts[key]
+
+    def fits_single_window(self, audio) -> bool:
+        """Checks if the audio fits in one 30 s window of the model"""
+        return (
+            isinstance(audio, np.ndarray)
+            and audio.shape[0] <= self.feature_extractor.n_samples
+        )
+
+    def transcribe(self, audio, **kwargs) -> Dict[str, Any]:
+        # Most dictations are short, they skip the chunking and batch collation
+        if self.fits_single_window(audio):
+            return self.transcribe_short(audio, **kwargs)
+
+        # Arguments of the call replace the ones of the pipeline, keeping the task
+        if "generate_kwargs" in kwargs:
+            generate_kwargs = {**self.generate_kwargs, **kwargs["generate_kwargs"]}
+            kwargs = {**kwargs, "generate_kwargs": generate_kwargs}
+
+            # The pipeline takes the token budget as its own argument
+            if "max_new_tokens" in generate_kwargs:
+                kwargs["max_new_tokens"] = generate_kwargs.pop("max_new_tokens")
+
+        return self.model_pipe(audio, **kwargs)
+
+    def transcribe_short(self, audio: np.ndarray, **kwargs) -> Dict[str, Any]:
+        """
+        Transcribes audio that fits in a single window by calling generate
+        directly on one padded feature tensor.
+
+        Args:
+            audio (np.ndarray): float32 samples at the sampling rate of the model
+
+        Returns:
+            result (dict): The transcription under "text"
+        """
+        return self.generate([audio], **kwargs)[0]
+
+    def transcribe_batch(self, audios: List, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Transcribes several utterances with one generate call. Each window is
+        padded to 30 s by the feature extractor, so they stack without masks.
+
+        Args:
+            audios (list): float32 samples that fit in a single window each
+
+        Returns:
+            results (list): The transcription of each input under "text"
+        """
+        if len(audios) > 1 and all(self.fits_single_window(a) for a in audios):
+            return self.generate(audios, **kwargs)
+
+        return super().transcribe_batch(audios, **kwargs)
+
+    def no_speech_probs(self, encoder_outputs, batch_size: int) -> List[float]:
+        """Probability of each input being silence, from the first decoder step"""
+        if self.no_speech_id is None:
+            return [0.0] * batch_size
+
+        start_token_id = self.model.generation_config.decoder_start_token_id
+        decoder_input_ids = torch.full(
+            (batch_size, 1), start_token_id, dtype=torch.long, device=self.model.device
+        )
+        logits = self.model(
+            encoder_outputs=encoder_outputs, decoder_input_ids=decoder_input_ids
+        ).logits[:, -1]
+
+        return logits.float().softmax(dim=-1)[:, self.no_speech_id].tolist()
+
+    @property
+    def timestamp_begin(self) -> int:
+        """First timestamp token, the ones after it are 20 ms apart"""
+        return self.model.generation_config.no_timestamps_token_id + 1
+
+    def segments(self, tokens) -> List[Dict[str, Any]]:
+        """
+        Splits the output of a decode with timestamps into its segments.
+
+        Args:
+            tokens (torch.Tensor): Output tokens of one input
+
+        Returns:
+            segments (list): Text of each segment closed by a timestamp and
+                its end in seconds, the unfinished last one is left out
+        """
+        segments = []
+        text_ids: List[int] = []
+        for token in tokens.tolist():
+            if token < self.timestamp_begin:
+                text_ids.append(token)
+                continue
+
+            text = self.tokenizer.decode(text_ids, skip_special_tokens=True).strip()
+            if text:
+                end = (token - self.timestamp_begin) * TIMESTAMP_S
+                segments.append({"text": text, "end": end})
+            text_ids = []
+
+        return segments
+
+    def generate(self, audios: List[np.ndarray], **kwargs) -> List[Dict[str, Any]]:
+        """
+        Runs generate on a batch of single window inputs. Inputs that are
+        clearly silence are not decoded, and decoding stops early when the
+        output is made up or looping.
+
+        Args:
+            audios (list): float32 samples that fit in a single window each
+
+        Returns:
+            results (list): The transcription under "text", the no-speech
+                probability, average log-probability, compression ratio and
+                the reason decoding was aborted, if it was. With
+                return_timestamps, the segments of the text under "segments"
+        """
+        features = self.feature_extractor(
+            audios, sampling_rate=self.sampling_rate, return_tensors="pt"
+        ).input_features
+        features = features.to(
+            self.model.device, dtype=getattr(self.model, "dtype", torch.float32)
+        )
+
+        # Encoding once, for the no-speech probability and for decoding
+        encoder_outputs = self.model.get_encoder()(features)
+        no_speech_probs = self.no_speech_probs(encoder_outputs, features.shape[0])
+
+        results: List[Dict[str, Any]] = [
+            {"text": "", "no_speech_prob": p, "aborted": "no speech"}
+            for p in no_speech_probs
+        ]
+        decoded = [i for i, p in enumerate(no_speech_probs) if p <= NO_SPEECH_ABORT]
+        if not decoded:
+            return results
+
+        generate_kwargs = {
+            "max_new_tokens": self.max_new_tokens,
+            **self.generate_kwargs,
+            **kwargs.get("generate_kwargs", {}),
+        }
+        guard = HallucinationGuard(
+            self.tokenizer,
+            [no_speech_probs[i] for i in decoded],
+            self.model.generation_config.eos_token_id,
+        )
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [*generate_kwargs.get("stopping_criteria", []), guard]
+        )
+        # Last processor, so the guard sees the scores the token is picked from
+        generate_kwargs["logits_processor"] = LogitsProcessorList(
+            [*generate_kwargs.get("logits_processor", []), guard.step_scores]
+        )
+
+        if len(decoded) < len(audios):
+            features = features[decoded]
+            encoder_outputs = BaseModelOutput(
+                last_hidden_state=encoder_outputs.last_hidden_state[decoded]
+            )
+        tokens = self.model.generate(
+            features, encoder_outputs=encoder_outputs, **generate_kwargs
+        )
+
+        timestamps = generate_kwargs.get("return_timestamps", False)
+        for row, i in enumerate(decoded):
+            length = guard.lengths[row]
+            output = tokens[row] if length is None else tokens[row, :length]
+            if timestamps:
+                segments = self.segments(output)
+                output = output[output < self.timestamp_begin]
+            text = self.tokenizer.decode(output, skip_special_tokens=True)
+            # Made up text is dropped, a loop keeps what was said before it
+            if guard.aborted[row] == "no speech":
+                text = ""
+
+            # Running out of the token budget before the end of text
+            truncated = (
+                guard.aborted[row] is None
+                and not guard.finished[row]
+                and self.model.generation_config.eos_token_id not in tokens[row]
+            )
+
+            results[i] = {
+                "text": text,
+                "no_speech_prob": no_speech_probs[i],
+                "avg_logprob": guard.avg_logprob(row),
+                "compression_ratio": compression_ratio(text),
+                "aborted": guard.aborted[row],
+                "truncated": truncated,
+            }
+            if timestamps:
+                results[i]["segments"] = [] if guard.aborted[row] else segments
+
+        return results
+
+
+class ONNXEngine(TransformersEngine):
+    """
+    Runs the pipeline on an ONNX Runtime model exported with optimum.
+    The ONNX graph is optimized by ORT and its threads are controlled
+    by the session options, which is faster than eager PyTorch on CPU.
+    """
+
+    name = "onnxruntime"
+
+    supports_int8 = False
+
+    def __init__(self, model_pipe, model_path: str, **kwargs):
+        super().__init__(model_pipe, **kwargs)
+        self.model_path = model_path
+
+    @property
+    def resident_size(self) -> int:
+        # Sessions hold the weights of the exported graphs
+        return sum(
+            getsize(join(root, name))
+            for root, _, names in walk(self.model_path)
+            for name in names
+            if name.endswith((".onnx", ".onnx_data"))
+        )
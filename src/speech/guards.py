@@ -0,0 +1,156 @@
+from math import ceil
+from typing import List, Optional
+import zlib
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+from src.config import (
+    NO_SPEECH_THRESHOLD,
+    LOGPROB_THRESHOLD,
+    COMPRESSION_RATIO_THRESHOLD,
+    GUARD_MIN_TOKENS,
+    GUARD_CHECK_EVERY,
+    SPEECH_WORDS_PER_S,
+    TOKENS_PER_WORD,
+    TOKEN_BUDGET_MARGIN,
+    MIN_NEW_TOKENS,
+    MAX_NEW_TOKENS,
+)
+
+# Tokens Whisper predicts after <|startoftranscript|> for silence, by version
+NO_SPEECH_TOKENS = ["<|nospeech|>", "<|nocaptions|>"]
+
+
+def token_budget(duration_s: float) -> int:
+    """
+    Estimates the tokens needed to transcribe speech of a given length, so
+    short commands cannot loop for long and long dictations are not cut.
+
+    Args:
+        duration_s (float): Duration of the speech in seconds
+
+    Returns:
+        max_new_tokens (int): Token budget of the transcription
+    """
+    tokens = duration_s * SPEECH_WORDS_PER_S * TOKENS_PER_WORD * TOKEN_BUDGET_MARGIN
+
+    return min(max(int(ceil(tokens)), MIN_NEW_TOKENS), MAX_NEW_TOKENS)
+
+
+def compression_ratio(text: str) -> float:
+    """Ratio of the text size to its zlib compressed size, high when it repeats"""
+    data = text.encode("utf-8")
+    if not data:
+        return 0.0
+
+    return len(data) / len(zlib.compress(data))
+
+
+def no_speech_token_id(tokenizer) -> Optional[int]:
+    """Finds the no-speech token of the tokenizer, None if it has none"""
+    for token in NO_SPEECH_TOKENS:
+        token_id = tokenizer.convert_tokens_to_ids(token)
+        if token_id is not None and token_id != tokenizer.unk_token_id:
+            return token_id
+
+    return None
+
+
+class StepScores(LogitsProcessor):
+    """
+    Keeps the scores of the current decoding step. Stopping criteria only
+    receive them when generate returns the scores of every step, so they
+    are read from here instead. The scores are returned unchanged.
+    """
+
+    def __init__(self):
+        self.scores = None
+
+    def __call__(self, input_ids, scores):
+        self.scores = scores
+        return scores
+
+
+class HallucinationGuard(StoppingCriteria):
+    """
+    Stops generation early when the output is clearly not speech or is looping.
+
+    The average log-probability of the text tokens is tracked at every step.
+    When the no-speech probability of the recording is above the threshold,
+    a low average means Whisper is making up text and decoding is stopped.
+    The compression ratio of the decoded text is checked every few tokens
+    to catch repetition loops before they reach max_new_tokens. The scores
+    come from `step_scores`, which must be passed to generate as a logits
+    processor.
+
+    Args:
+        tokenizer: Tokenizer of the model, to decode the text so far
+        no_speech_probs (List[float]): No-speech probability of each input
+        eos_token_id (int): End of text token, special tokens come after it
+    """
+
+    def __init__(self, tokenizer, no_speech_probs: List[float], eos_token_id: int):
+        self.tokenizer = tokenizer
+        self.no_speech_probs = no_speech_probs
+        self.eos_token_id = eos_token_id
+        self.step_scores = StepScores()
+
+        n = len(no_speech_probs)
+        self.logprob_sums = [0.0] * n
+        self.token_counts = [0] * n
+        self.aborted: List[Optional[str]] = [None] * n
+        self.finished = [False] * n
+        # Length of the output when it was aborted, the batch may go on
+        self.lengths: List[Optional[int]] = [None] * n
+
+    def avg_logprob(self, index: int) -> float:
+        return self.logprob_sums[index] / max(self.token_counts[index], 1)
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        # Scores of the step that chose the last token of input_ids
+        if self.step_scores.scores is None:
+            return False
+        logprobs = torch.log_softmax(self.step_scores.scores.float(), dim=-1)
+
+        for i in range(input_ids.shape[0]):
+            if self.aborted[i] or self.finished[i]:
+                continue
+
+            token = int(input_ids[i, -1])
+            if token == self.eos_token_id:
+                self.finished[i] = True
+                continue
+            # Forced prompt and timestamp tokens are not text
+            if token > self.eos_token_id:
+                continue
+
+            self.logprob_sums[i] += float(logprobs[i, token])
+            self.token_counts[i] += 1
+
+            count = self.token_counts[i]
+            if count < GUARD_MIN_TOKENS:
+                continue
+
+            # Not speech, the text is made up
+            if (
+                self.no_speech_probs[i] > NO_SPEECH_THRESHOLD
+                and self.avg_logprob(i) < LOGPROB_THRESHOLD
+            ):
+                self.aborted[i] = "no speech"
+                self.lengths[i] = input_ids.shape[1]
+
+            # Repeating the same words
+            elif count % GUARD_CHECK_EVERY == 0:
+                text = self.tokenizer.decode(
+                    input_ids[i], skip_special_tokens=True
+                )
+                if compression_ratio(text) > COMPRESSION_RATIO_THRESHOLD:
+                    self.aborted[i] = "looping"
+                    self.lengths[i] = input_ids.shape[1]
+
+        # Generation of a batch stops once every input is done or aborted
+        return all(
+            aborted is not None or finished
+            for aborted, finished in zip(self.aborted, self.finished)
+        )
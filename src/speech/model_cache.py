@@ -0,0 +1,409 @@
+from os import makedirs
+from os.path import join, exists, basename, dirname
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Optional
+import json
+import logging
+
+import torch
+import transformers
+from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor
+
+logger = logging.getLogger(__name__)
+
+# Local model cache
+MODEL_CACHE_DIR = join(".", "model")
+MANIFEST_FILE = join(MODEL_CACHE_DIR, "manifest.json")
+CONVERTED_DIR = join(MODEL_CACHE_DIR, "converted")
+ONNX_DIR = join(MODEL_CACHE_DIR, "onnx")
+
+# Files needed from a snapshot to build the pipeline
+SNAPSHOT_PATTERNS = ["*.json", "*.safetensors", "*.txt"]
+
+
+class LoadTimer:
+    """Records how long each phase of loading a model takes."""
+
+    PHASES = ["resolve", "read", "convert", "to-device"]
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.phases: Dict[str, float] = {phase: 0.0 for phase in self.PHASES}
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - t0
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def report(self, logger: logging.Logger = logger) -> str:
+        """Logs and returns the startup timing report"""
+        lines = [f"Startup timing for {self.model_id}:"]
+        lines += [f"  {name:<10} {seconds:8.3f}s" for name, seconds in self.phases.items()]
+        lines.append(f"  {'total':<10} {self.total:8.3f}s")
+        report = "\n".join(lines)
+
+        logger.info(report)
+        return report
+
+
+def dtype_name(torch_dtype) -> str:
+    """Returns the short name of a torch dtype, e.g. float16"""
+    return str(torch_dtype).replace("torch.", "")
+
+
+def read_manifest(filename: str = MANIFEST_FILE) -> dict:
+    """Reads the local model manifest, empty if it does not exist yet"""
+    if not exists(filename):
+        return {}
+
+    with open(filename, "r") as file:
+        return json.load(file)
+
+
+def update_manifest(model_id: str, key: str, value, filename: str = MANIFEST_FILE):
+    """
+    Updates an entry of the model in the manifest
+
+    Args:
+        model_id (str): The HuggingFace id of the model
+        key (str): The key to be updated
+        value : The new value for the key
+        filename (str, optional): The manifest file
+    """
+    manifest = read_manifest(filename)
+    manifest.setdefault(model_id, {})[key] = value
+
+    makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    with open(filename, "w") as file:
+        json.dump(manifest, file, indent=4)
+
+
+def resolve_snapshot(model_id: str, cache_dir: str = MODEL_CACHE_DIR) -> str:
+    """
+    Resolves the local snapshot path of a model. The manifest is used first so
+    no hub lookups are made, then the local cache, and only then the hub.
+
+    Args:
+        model_id (str): The HuggingFace id of the model
+        cache_dir (str): The local cache directory
+
+    Returns:
+        path (str): Path of the snapshot directory
+    """
+    from huggingface_hub import snapshot_download
+
+    entry = read_manifest().get(model_id, {})
+    snapshot = entry.get("snapshot")
+    if snapshot and exists(snapshot):
+        return snapshot
+
+    try:
+        snapshot = snapshot_download(
+            model_id,
+            cache_dir=cache_dir,
+            allow_patterns=SNAPSHOT_PATTERNS,
+            local_files_only=True,
+        )
+    except Exception:
+        logger.info(f"{model_id} not in local cache, downloading from the hub")
+        snapshot = snapshot_download(
+            model_id, cache_dir=cache_dir, allow_patterns=SNAPSHOT_PATTERNS
+        )
+    logger.info(f"Resolved {model_id} to {snapshot}")
+
+    update_manifest(model_id, "snapshot", snapshot)
+
+    return snapshot
+
+
+def snapshot_dtype(snapshot: str) -> Optional[str]:
+    """Returns the name of the dtype the snapshot weights are stored in, if known"""
+    filename = join(snapshot, "config.json")
+    if not exists(filename):
+        return None
+
+    with open(filename, "r") as file:
+        torch_dtype = json.load(file).get("torch_dtype", None)
+
+    return dtype_name(torch_dtype) if torch_dtype else None
+
+
+def converted_path(model_id: str, torch_dtype) -> str:
+    """Returns the directory of the model pre-converted to the dtype"""
+    name = f"{model_id.replace('/', '--')}-{dtype_name(torch_dtype)}"
+
+    return join(CONVERTED_DIR, name)
+
+
+def quantized_path(model_id: str) -> str:
+    """Returns the file of the model with int8 dynamically quantized weights"""
+    return join(CONVERTED_DIR, f"{model_id.replace('/', '--')}-int8", "model.pt")
+
+
+def quantize_int8(model):
+    """
+    Applies dynamic int8 quantization to the linear layers of the model.
+    Weights are stored as int8 and activations are quantized on the fly,
+    which is where most of the CPU time of Whisper is spent.
+
+    Args:
+        model (AutoModelForSpeechSeq2Seq): The float32 model on CPU
+
+    Returns:
+        model (AutoModelForSpeechSeq2Seq): The quantized model
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def load_quantized_model(
+    model_id: str,
+    notify: Optional[Callable[[str], None]] = None,
+    logger: logging.Logger = logger,
+):
+    """
+    Loads the int8 model for CPU inference. The quantized model is cached on
+    disk so later starts skip the conversion. The cache is only valid for the
+    torch and transformers versions it was made with.
+
+    Args:
+        model_id (str): The HuggingFace id of the model
+        notify (Callable, optional): Sends progress messages to the GUI
+        logger (logging.Logger): Logger to write loading information
+
+    Returns:
+        model (AutoModelForSpeechSeq2Seq): The quantized model on CPU
+        processor (AutoProcessor): The processor of the model
+        timer (LoadTimer): The timing of each loading phase
+    """
+    notify = notify or (lambda message: None)
+    versions = {"torch": torch.__version__, "transformers": transformers.__version__}
+
+    timer = LoadTimer(model_id)
+    with timer.phase("resolve"):
+        cached = read_manifest().get(model_id, {}).get("int8")
+        valid = (
+            isinstance(cached, dict)
+            and exists(cached.get("path", ""))
+            and all(cached.get(name) == version for name, version in versions.items())
+        )
+
+    if valid:
+        logger.info(f"Loading {model_id} from {cached['path']}")
+        with timer.phase("read"):
+            try:
+                model = torch.load(cached["path"], mmap=True, weights_only=False)
+            # Older torch versions can not memory-map
+            except TypeError:
+                model = torch.load(cached["path"])
+            processor = AutoProcessor.from_pretrained(
+                dirname(cached["path"]), local_files_only=True
+            )
+        model.eval()
+
+        return model, processor, timer
+
+    # Quantizing once from the float32 weights, converted ones are reused if cached
+    model, processor, base_timer = load_speech_model(
+        model_id,
+        torch.float32,
+        torch.device("cpu"),
+        notify=notify,
+        logger=logger,
+        save_converted=False,
+    )
+    for phase, seconds in base_timer.phases.items():
+        timer.phases[phase] += seconds
+
+    with timer.phase("convert"):
+        notify(f"Quantizing {basename(model_id)}...")
+        model = quantize_int8(model)
+
+        path = quantized_path(model_id)
+        makedirs(dirname(path), exist_ok=True)
+        torch.save(model, path)
+        processor.save_pretrained(dirname(path))
+        update_manifest(model_id, "int8", {"path": path, **versions})
+
+    return model, processor, timer
+
+
+def onnx_path(model_id: str) -> str:
+    """Returns the directory of the model exported to ONNX"""
+    return join(ONNX_DIR, model_id.replace("/", "--"))
+
+
+def load_onnx_model(
+    model_id: str,
+    device,
+    num_threads: int = 0,
+    notify: Optional[Callable[[str], None]] = None,
+    logger: logging.Logger = logger,
+):
+    """
+    Loads the model with ONNX Runtime. The model is exported once with optimum
+    and cached next to the HuggingFace weights.
+
+    Args:
+        model_id (str): The HuggingFace id of the model
+        device (torch.device): The device, CUDA uses the CUDA execution provider
+        num_threads (int): Intra-op threads of the sessions, 0 lets ORT decide
+        notify (Callable, optional): Sends progress messages to the GUI
+        logger (logging.Logger): Logger to write loading information
+
+    Returns:
+        model (ORTModelForSpeechSeq2Seq): The ONNX Runtime model
+        processor (AutoProcessor): The processor of the model
+        timer (LoadTimer): The timing of each loading phase
+    """
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+
+    notify = notify or (lambda message: None)
+
+    # Graph optimizations and thread control
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = (
+        onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    )
+    session_options.intra_op_num_threads = num_threads
+    provider = (
+        "CUDAExecutionProvider"
+        if getattr(device, "type", "cpu") == "cuda"
+        else "CPUExecutionProvider"
+    )
+
+    timer = LoadTimer(model_id)
+    with timer.phase("resolve"):
+        exported = read_manifest().get(model_id, {}).get("onnx")
+        if not (exported and exists(exported)):
+            notify(f"Downloading {basename(model_id)}...")
+            snapshot = resolve_snapshot(model_id)
+            exported = None
+
+    if exported:
+        logger.info(f"Loading {model_id} from {exported}")
+        with timer.phase("read"):
+            model = ORTModelForSpeechSeq2Seq.from_pretrained(
+                exported,
+                provider=provider,
+                session_options=session_options,
+                local_files_only=True,
+            )
+            processor = AutoProcessor.from_pretrained(exported, local_files_only=True)
+
+    # Exporting once and saving for the next starts
+    else:
+        with timer.phase("convert"):
+            notify(f"Exporting {basename(model_id)} to ONNX...")
+            model = ORTModelForSpeechSeq2Seq.from_pretrained(
+                snapshot,
+                export=True,
+                provider=provider,
+                session_options=session_options,
+                local_files_only=True,
+            )
+            processor = AutoProcessor.from_pretrained(snapshot, local_files_only=True)
+
+            path = onnx_path(model_id)
+            model.save_pretrained(path)
+            processor.save_pretrained(path)
+            update_manifest(model_id, "onnx", path)
+
+    return model, processor, timer
+
+
+def load_speech_model(
+    model_id: str,
+    torch_dtype,
+    device,
+    device_name: str = "",
+    notify: Optional[Callable[[str], None]] = None,
+    logger: logging.Logger = logger,
+    save_converted: bool = True,
+):
+    """
+    Loads a speech model and its processor from the local cache.
+
+    The first load converts the weights to the target dtype and saves them as
+    safetensors, so later loads memory-map weights that need no conversion.
+    Snapshots stored in the target dtype are used as they are.
+
+    Args:
+        model_id (str): The HuggingFace id of the model
+        torch_dtype (torch.dtype): The data type of the weights
+        device (torch.device): The device to load the model to
+        device_name (str, optional): The name of the device, empty for CPU
+        notify (Callable, optional): Sends progress messages to the GUI
+        logger (logging.Logger): Logger to write loading information
+        save_converted (bool): Saves the converted weights on the first load,
+            off when the model is only converted further
+
+    Returns:
+        model (AutoModelForSpeechSeq2Seq): The model on the device
+        processor (AutoProcessor): The processor of the model
+        timer (LoadTimer): The timing of each loading phase
+    """
+    notify = notify or (lambda message: None)
+    timer = LoadTimer(model_id)
+
+    with timer.phase("resolve"):
+        converted = read_manifest().get(model_id, {}).get(dtype_name(torch_dtype))
+        if not (converted and exists(converted)):
+            notify(f"Downloading {basename(model_id)}...")
+            snapshot = resolve_snapshot(model_id)
+            converted = None
+
+    logger.info(f"Loading {model_id} from {converted or snapshot}")
+
+    # Weights already in the target dtype are memory-mapped as is
+    if converted:
+        with timer.phase("read"):
+            model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                converted,
+                torch_dtype=torch_dtype,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                local_files_only=True,
+            )
+            processor = AutoProcessor.from_pretrained(converted, local_files_only=True)
+
+    # First load, converting once and saving for the next starts
+    else:
+        with timer.phase("read"):
+            model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                snapshot,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                local_files_only=True,
+            )
+            processor = AutoProcessor.from_pretrained(snapshot, local_files_only=True)
+
+        with timer.phase("convert"):
+            notify(f"Converting {basename(model_id)}...")
+            model.to(torch_dtype)
+
+            # Snapshots already stored in the dtype are not copied, only recorded
+            if snapshot_dtype(snapshot) == dtype_name(torch_dtype):
+                update_manifest(model_id, dtype_name(torch_dtype), snapshot)
+            elif save_converted:
+                path = converted_path(model_id, torch_dtype)
+                model.save_pretrained(path, safe_serialization=True)
+                processor.save_pretrained(path)
+                update_manifest(model_id, dtype_name(torch_dtype), path)
+
+    # Loading the model to device
+    notify(f"Loading {basename(model_id)} to {device_name if device_name else 'CPU'}...")
+    with timer.phase("to-device"):
+        model.to(device)
+
+    return model, processor, timer
@@ -3,7 +3,7 @@ import os
 import requests
 from typing import Optional, Callable
 
-from src.utils.funcs import copy_writing
+from src.utils.funcs import copy_writing, type_writing
 from src.config import (
     CHAINLIT_HOST,
     CHAINLIT_PORT,
@@ -33,15 +33,20 @@ def perform_request(text: str, write_method: Callable, use_agent: bool):
         invoke_agent(text, "SESSION_IDS[-1]")
 
     else:
-        # If the text is not English, then copy it
-        if notAscii(text):
-            write_method = copy_writing
-
-        write_method(text)
+        write_text(text, write_method)
 
     return text
 
 
+def write_text(text: str, write_method: Callable):
+    """Writes the text with the write method, copying it instead if it can not be typed."""
+    # Typing only writes English characters, the other write methods choose themselves
+    if write_method is type_writing and notAscii(text):
+        write_method = copy_writing
+
+    write_method(text)
+
+
 def process_text(text: str, start_event, prev_text) -> str:
     """
     Processes the text to not type dictation
@@ -0,0 +1,151 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+MiB = 2**20
+
+
+def resident_size(model) -> int:
+    """
+    Computes the memory taken by the weights and buffers of a model.
+    Quantized layers keep their weights in packed parameters, which
+    are only visible through the state dict.
+
+    Args:
+        model (torch.nn.Module): The model loaded in memory
+
+    Returns:
+        size (int): Size in bytes
+    """
+    seen = set()
+    size = 0
+    for value in model.state_dict(keep_vars=True).values():
+        tensors = value if isinstance(value, tuple) else (value,)
+
+        for tensor in tensors:
+            if not hasattr(tensor, "element_size"):
+                continue
+
+            # Tied weights are only counted once
+            key = (tensor.data_ptr(), tensor.numel())
+            if key in seen:
+                continue
+            seen.add(key)
+
+            size += tensor.numel() * tensor.element_size()
+
+    return size
+
+
+class ModelResidency:
+    """
+    Keeps several ASR engines loaded at once, keyed by (model id, precision).
+    The precision is "onnx" for the ONNX Runtime backend, "int8" for the
+    quantized CPU engine and the torch dtype otherwise, so there is one
+    engine per model, backend and CPU engine chosen. The task is given with
+    each request and is not part of the key.
+
+    When the total size of the resident models goes over the memory budget,
+    the least recently used ones are evicted. The most recently requested
+    model is never evicted, even if it is bigger than the budget by itself.
+    """
+
+    def __init__(
+        self,
+        budget_mb: float,
+        on_evict: Optional[Callable] = None,
+        logger: logging.Logger = logger,
+    ):
+        self.budget = budget_mb * MiB
+        self.on_evict = on_evict
+        self.logger = logger
+
+        # key -> (engine, size in bytes), ordered from least to most recently used
+        self.models: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # Sizes of models seen before, used to make room before loading them again
+        self.known_sizes: Dict[Hashable, int] = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self.models
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    @property
+    def total_size(self) -> int:
+        return sum(size for _, size in self.models.values())
+
+    def get(self, key: Hashable, loader: Callable[[], Any]):
+        """
+        Returns the resident engine for the key, loading it if needed.
+
+        Args:
+            key (Hashable): (model id, precision) of the engine
+            loader (Callable): Function that loads and returns the engine
+
+        Returns:
+            engine (ASREngine): The ASR engine
+        """
+        if key in self.models:
+            self.models.move_to_end(key)
+            self.logger.info(f"Model {key} already resident")
+            return self.models[key][0]
+
+        # Making room first when the size is known from a previous load
+        if key in self.known_sizes:
+            self._evict(self.budget - self.known_sizes[key])
+
+        engine = loader()
+        size = engine.resident_size
+        self.models[key] = (engine, size)
+        self.known_sizes[key] = size
+        self.logger.info(f"Model {key} resident with {size / MiB:.1f} MiB")
+
+        self._evict(self.budget, keep=key)
+        self.report()
+
+        return engine
+
+    def evict(self, key: Hashable):
+        """Removes the engine of the key from memory"""
+        if key not in self.models:
+            return
+
+        engine, size = self.models.pop(key)
+        del engine
+        self.logger.info(f"Evicted model {key}, freed {size / MiB:.1f} MiB")
+
+        if self.on_evict:
+            self.on_evict()
+
+    def clear(self):
+        """Removes all engines from memory"""
+        for key in list(self.models):
+            self.evict(key)
+
+    def report(self) -> Dict[Hashable, float]:
+        """
+        Reports the resident size of each model.
+
+        Returns:
+            sizes (dict): Resident size in MiB for each key
+        """
+        sizes = {key: size / MiB for key, (_, size) in self.models.items()}
+        for key, size_mb in sizes.items():
+            self.logger.info(f"Resident: {key} {size_mb:.1f} MiB")
+        self.logger.info(
+            f"Total resident: {self.total_size / MiB:.1f} MiB "
+            + f"of {self.budget / MiB:.0f} MiB budget"
+        )
+
+        return sizes
+
+    def _evict(self, budget: float, keep: Optional[Hashable] = None):
+        """Evicts least recently used models until the total size fits the budget"""
+        while self.models and self.total_size > budget:
+            key = next(iter(self.models))
+            if key == keep:
+                break
+            self.evict(key)
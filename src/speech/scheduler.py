@@ -0,0 +1,202 @@
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+from queue import Empty
+from time import time
+from typing import Any, Dict, List, Optional
+
+from src import LOAD_MODEL_SIGNAL, UNLOAD_MODEL_SIGNAL, TERMINATE_SIGNAL
+from src.speech.audio import is_raw_audio
+
+# Priority classes, served from the first to the last
+PRIORITY_CLASSES = ["control", "live", "interactive", "bulk"]
+CONTROL, LIVE, INTERACTIVE, BULK = range(len(PRIORITY_CLASSES))
+
+SIGNALS = (LOAD_MODEL_SIGNAL, UNLOAD_MODEL_SIGNAL, TERMINATE_SIGNAL)
+
+# Scheduling delays kept per class for the metrics
+DELAY_HISTORY = 200
+
+
+def classify(message: Dict[str, Any]) -> int:
+    """
+    Finds the priority class of a queue message.
+
+    Args:
+        message (dict): Message from the Audio Queue
+
+    Returns:
+        priority (int): Index in PRIORITY_CLASSES
+    """
+    priority = message.get("priority", None)
+    if isinstance(priority, str):
+        return PRIORITY_CLASSES.index(priority)
+    if priority is not None:
+        return priority
+
+    audio = message.get("message", None)
+    if isinstance(audio, str) and audio in SIGNALS:
+        return CONTROL
+
+    # Captured by the hotkey, someone is waiting for the text
+    if is_raw_audio(audio):
+        return LIVE
+
+    return INTERACTIVE
+
+
+def forward_requests(source, destination, accept=None):
+    """
+    Moves the requests of another process to the queue of the model service,
+    until None is received. Captured audio is put on that queue directly, so
+    it is passed by reference instead of being pickled.
+
+    Args:
+        source (multiprocessing.Queue): Requests of the web UI
+        destination (queue.Queue): Queue of the model service
+        accept (Callable, optional): Answers the request right away, returns
+            False if it can not be served
+    """
+    for message in iter(source.get, None):
+        if accept is None or accept(message):
+            destination.put(message)
+
+
+class Scheduler:
+    """
+    Serves the Audio Queue by priority class instead of arrival order.
+
+    Waiting messages are moved from the queue into a heap
+    ordered by class and then by arrival, so control signals go first, then
+    live dictation, uploads and finally bulk chunks of long files. The delay
+    between a message being queued and served is recorded for each class.
+    """
+
+    def __init__(self, queue, logger=None):
+        self.queue = queue
+        self.logger = logger
+        self.heap: List = []
+        self.order = count()
+        self.delays = {name: deque(maxlen=DELAY_HISTORY) for name in PRIORITY_CLASSES}
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def put(self, message: Dict[str, Any], priority: Optional[int] = None):
+        """
+        Schedules a message, messages put back keep their place in line.
+
+        Args:
+            message (dict): Message from the queue or a chunk of a job
+            priority (int, optional): Class of the message, classified if not given
+        """
+        if priority is not None:
+            message["priority"] = priority
+        message["priority"] = classify(message)
+        message.setdefault("queued_at", time())
+        message.setdefault("order", next(self.order))
+
+        heappush(self.heap, (message["priority"], message["order"], message))
+
+    def poll(self):
+        """Moves the messages waiting in the queue to the heap without blocking"""
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except Empty:
+                break
+            self.put(message)
+
+    def pending(self, priority: int = BULK) -> int:
+        """Counts the scheduled messages of the class or more urgent"""
+        self.poll()
+        return sum(1 for entry in self.heap if entry[0] <= priority)
+
+    def first_pending(self, priority: int = BULK) -> Optional[Dict[str, Any]]:
+        """Returns the next message if it is of the class or more urgent"""
+        self.poll()
+        if self.heap and self.heap[0][0] <= priority:
+            return self.heap[0][2]
+
+        return None
+
+    def get(
+        self,
+        block: bool = True,
+        timeout: Optional[float] = None,
+        max_priority: int = BULK,
+    ) -> Dict[str, Any]:
+        """
+        Takes the most urgent message, waiting for one if none is scheduled.
+
+        Args:
+            block (bool): Waits for a message if there is none
+            timeout (float, optional): Seconds to wait, None waits forever
+            max_priority (int): Least urgent class that can be returned
+
+        Returns:
+            message (dict): The message to serve
+
+        Raises:
+            queue.Empty: No message of the classes before the timeout
+        """
+        deadline = None if timeout is None else time() + timeout
+
+        while True:
+            self.poll()
+
+            if self.heap and self.heap[0][0] <= max_priority:
+                return self.serve(heappop(self.heap)[2])
+
+            remaining = None if deadline is None else deadline - time()
+            if not block or (remaining is not None and remaining <= 0):
+                raise Empty
+
+            # Sleeping in the queue until anything new arrives
+            self.put(self.queue.get(block=True, timeout=remaining))
+
+    def serve(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Records the scheduling delay the first time a message is served"""
+        if not message.get("served", False):
+            message["served"] = True
+            name = PRIORITY_CLASSES[message["priority"]]
+            delay = time() - message["queued_at"]
+            self.delays[name].append(delay)
+
+            if self.logger:
+                self.logger.debug(f"Scheduling delay of {name}: {delay * 1000:.1f}ms")
+
+        return message
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Summarizes the recent scheduling delays of each class.
+
+        Returns:
+            stats (dict): Count, mean, p95 and max delay in milliseconds per class
+        """
+        stats = {}
+        for name, delays in self.delays.items():
+            if not delays:
+                continue
+
+            delays_ms = sorted(delay * 1000 for delay in delays)
+            stats[name] = {
+                "count": len(delays_ms),
+                "mean": sum(delays_ms) / len(delays_ms),
+                "p95": delays_ms[min(int(len(delays_ms) * 0.95), len(delays_ms) - 1)],
+                "max": delays_ms[-1],
+            }
+
+        return stats
+
+    def report(self) -> str:
+        """Formats the scheduling delays for the log"""
+        lines = ["Scheduling delay by class:"]
+        for name, stat in self.stats().items():
+            lines.append(
+                f"  {name:<12} n={stat['count']:<4} mean {stat['mean']:8.1f}ms "
+                + f"p95 {stat['p95']:8.1f}ms max {stat['max']:8.1f}ms"
+            )
+
+        return "\n".join(lines)
@@ -0,0 +1,53 @@
+from typing import Callable, Dict, Optional
+
+
+class Sequencer:
+    """
+    Delivers the results of utterances in the order they were recorded.
+
+    Utterances are numbered by the capture loop from zero. A result that
+    completes early is held until every utterance recorded before it is
+    delivered. Dropped utterances are completed with no action so they do
+    not hold back the ones after them.
+
+    Args:
+        on_deliver (Callable, optional): Called with the number of each
+            utterance once it is delivered
+        before_action (Callable, optional): Called before running an action,
+            blocks until writing is safe
+    """
+
+    def __init__(
+        self,
+        on_deliver: Optional[Callable[[int], None]] = None,
+        before_action: Optional[Callable[[], None]] = None,
+    ):
+        self.next_sequence = 0
+        self.pending: Dict[int, Optional[Callable]] = {}
+        self.on_deliver = on_deliver
+        self.before_action = before_action
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def complete(self, sequence: int, action: Optional[Callable] = None):
+        """
+        Marks an utterance as done, running the actions that are next in order.
+
+        Args:
+            sequence (int): Number of the utterance
+            action (Callable, optional): Writes the transcript, None if dropped
+        """
+        self.pending[sequence] = action
+
+        while self.next_sequence in self.pending:
+            action = self.pending.pop(self.next_sequence)
+            try:
+                if action is not None:
+                    if self.before_action:
+                        self.before_action()
+                    action()
+            finally:
+                if self.on_deliver:
+                    self.on_deliver(self.next_sequence)
+                self.next_sequence += 1
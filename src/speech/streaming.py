@@ -0,0 +1,104 @@
+from typing import Any, Dict, List
+
+
+class LocalAgreement:
+    """
+    Local agreement policy for streaming dictation.
+
+    Each partial decode of the buffer gives a hypothesis. Words are only
+    committed once two consecutive hypotheses agree on them. Once the words
+    of a whole segment are committed, its audio is trimmed from the buffer
+    with `advance`, so partial decodes and the final one only cover the
+    audio after it. The text is written once the hotkey is released.
+    """
+
+    def __init__(self):
+        self.committed: List[str] = []
+        self.previous: List[str] = []
+        # Words of the audio trimmed from the buffer, and its duration
+        self.done: List[str] = []
+        self.trimmed_s = 0.0
+
+    def reset(self):
+        self.committed = []
+        self.previous = []
+        self.done = []
+        self.trimmed_s = 0.0
+
+    def insert(self, hypothesis: str) -> str:
+        """
+        Adds a partial hypothesis and commits what it agrees on with the previous one.
+
+        Args:
+            hypothesis (str): Transcription of the buffer so far
+
+        Returns:
+            text (str): Newly committed text, empty if nothing is stable yet
+        """
+        words = hypothesis.split()
+        n_committed = len(self.committed)
+
+        # Hypothesis must still start with what was already committed
+        if words[:n_committed] != self.committed:
+            self.previous = words
+            return ""
+
+        # Longest common prefix past the committed words
+        agreed = n_committed
+        for current, previous in zip(words[n_committed:], self.previous[n_committed:]):
+            if current != previous:
+                break
+            agreed += 1
+
+        self.previous = words
+        new_words = words[n_committed:agreed]
+        self.committed.extend(new_words)
+
+        return " ".join(new_words)
+
+    def advance(self, segments: List[Dict[str, Any]]) -> float:
+        """
+        Trims the leading segments whose words are all committed.
+
+        Args:
+            segments (list): Segments of the last hypothesis closed by a
+                timestamp, with their "text" and "end" in seconds
+
+        Returns:
+            seconds (float): Audio to trim from the start of the buffer
+        """
+        n_words = 0
+        end = 0.0
+        # The last segment is kept, the next decode needs some context
+        for segment in segments[:-1]:
+            words = len(segment["text"].split())
+            if n_words + words > len(self.committed):
+                break
+            n_words += words
+            end = segment["end"]
+
+        if n_words == 0:
+            return 0.0
+
+        # Hypotheses start with the committed words, so these are the words of the segments
+        self.done.extend(self.committed[:n_words])
+        self.committed = self.committed[n_words:]
+        self.previous = self.previous[n_words:]
+        self.trimmed_s += end
+
+        return end
+
+    def finalize(self, hypothesis: str) -> str:
+        """
+        Returns the text of the whole recording and starts over.
+
+        Args:
+            hypothesis (str): Transcription of the buffer after the trimmed audio
+
+        Returns:
+            text (str): Words of the trimmed audio followed by the hypothesis
+        """
+        text = " ".join(self.done + hypothesis.split())
+        self.reset()
+
+        return text
@@ -0,0 +1,285 @@
+"""
+Tunes the CPU threads of ASR inference for this machine.
+
+A fixed utterance is decoded with each candidate thread count while a
+probe thread measures how late it wakes up, which is what makes the GUI
+stutter. The fastest configuration that keeps the probe responsive is
+cached per machine and applied when a model is loaded.
+
+Pinning to cores is not tuned. Worker threads of the intra-op pool take
+the affinity of the thread creating them and keep it, so the model service
+thread is pinned once with `pin_model_thread` before its first torch op.
+
+Tune again and print the measurements with:
+
+    python -m src.speech.tuning
+"""
+
+from os import cpu_count, makedirs
+from os.path import join, exists
+from threading import Event, Thread
+from time import perf_counter, sleep
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import logging
+import os
+import platform
+
+import numpy as np
+import torch
+
+from src.config import (
+    CPU_RESERVED_CORES,
+    CPU_PINNING,
+    CPU_INTEROP_THREADS,
+    CPU_TUNING_MAX_JITTER_MS,
+)
+from src.speech.model_cache import MODEL_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+TUNING_FILE = join(MODEL_CACHE_DIR, "cpu_tuning.json")
+
+# Fixed workload, seconds of audio and tokens decoded for every candidate
+TUNING_AUDIO_S = 5
+TUNING_TOKENS = 16
+TUNING_RUNS = 2
+
+# Sleep of the probe standing in for the GUI loop
+PROBE_INTERVAL_S = 0.005
+
+
+def machine_key() -> str:
+    """Identifies the machine, tuned settings do not carry over to other CPUs"""
+    return "-".join(
+        [platform.node(), platform.machine(), platform.processor(), str(cpu_count())]
+    )
+
+
+def can_pin() -> bool:
+    return CPU_PINNING and hasattr(os, "sched_setaffinity")
+
+
+def pin_model_thread(logger: logging.Logger = logger) -> Optional[List[int]]:
+    """
+    Pins the calling thread to all but the reserved cores, Linux only.
+    Must run before the first torch op of the thread: only the worker
+    threads created afterwards inherit the affinity, the ones already
+    running stay on every core.
+
+    Returns:
+        cores (list): The cores pinned to, None if not pinned
+    """
+    if not can_pin():
+        return None
+
+    allowed = sorted(os.sched_getaffinity(0))
+    cores = allowed[CPU_RESERVED_CORES:] or allowed
+    os.sched_setaffinity(0, cores)
+    logger.info(f"Model service pinned to cores {cores}")
+
+    return cores
+
+
+def read_tuning(filename: str = TUNING_FILE) -> dict:
+    """Reads the tuned configurations, empty if none was saved yet"""
+    if not exists(filename):
+        return {}
+
+    with open(filename, "r") as file:
+        return json.load(file)
+
+
+def save_tuning(config: Dict[str, Any], filename: str = TUNING_FILE):
+    """Saves the tuned configuration of this machine"""
+    tuning = read_tuning(filename)
+    tuning[machine_key()] = config
+
+    makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    with open(filename, "w") as file:
+        json.dump(tuning, file, indent=4)
+
+
+def set_interop_threads(logger: logging.Logger = logger):
+    """Sets the inter-op threads, only possible before any parallel work"""
+    if torch.get_num_interop_threads() == CPU_INTEROP_THREADS:
+        return
+
+    try:
+        torch.set_num_interop_threads(CPU_INTEROP_THREADS)
+    except RuntimeError:
+        logger.debug("Inter-op threads already started, keeping their count")
+
+
+def candidate_configs() -> List[Dict[str, Any]]:
+    """
+    Lists the thread counts worth measuring, from all but the reserved
+    cores down to a few threads, with the default of PyTorch as baseline.
+
+    Returns:
+        configs (list): Dicts with the intra-op threads
+    """
+    cores = cpu_count() or 1
+    available = max(cores - CPU_RESERVED_CORES, 1)
+    threads = {
+        torch.get_num_threads(),
+        available,
+        max(available // 2, 1),
+        min(4, available),
+    }
+
+    return [{"intra_op": n} for n in sorted(threads, reverse=True)]
+
+
+def apply_config(config: Dict[str, Any]):
+    """Applies a thread configuration to the calling thread, the model service"""
+    torch.set_num_threads(config["intra_op"])
+
+
+def measure(model, features, runs: int = TUNING_RUNS) -> Dict[str, float]:
+    """
+    Times the fixed workload while a probe thread measures its wake-up delay.
+
+    Args:
+        model: Speech model with generate
+        features (torch.Tensor): Input features of the utterance
+        runs (int): Timed runs after one warm up
+
+    Returns:
+        stats (dict): Median latency in seconds and p95 probe lateness in ms
+    """
+
+    def workload():
+        with torch.no_grad():
+            model.generate(
+                features, max_new_tokens=TUNING_TOKENS, min_new_tokens=TUNING_TOKENS
+            )
+
+    workload()
+
+    stop = Event()
+    lateness = []
+
+    def probe():
+        while not stop.is_set():
+            t0 = perf_counter()
+            sleep(PROBE_INTERVAL_S)
+            lateness.append(perf_counter() - t0 - PROBE_INTERVAL_S)
+
+    thread = Thread(target=probe, daemon=True)
+    thread.start()
+
+    latencies = []
+    for _ in range(runs):
+        t0 = perf_counter()
+        workload()
+        latencies.append(perf_counter() - t0)
+
+    stop.set()
+    thread.join()
+
+    lateness_ms = sorted(delay * 1000 for delay in lateness) or [0.0]
+    return {
+        "latency": sorted(latencies)[len(latencies) // 2],
+        "jitter": lateness_ms[min(int(len(lateness_ms) * 0.95), len(lateness_ms) - 1)],
+    }
+
+
+def tune(engine, logger: logging.Logger = logger) -> Dict[str, Any]:
+    """
+    Measures every candidate and picks the fastest that keeps the probe
+    within CPU_TUNING_MAX_JITTER_MS, or the smoothest if none does.
+
+    Args:
+        engine (TransformersEngine): Engine of the model used for the workload
+        logger (logging.Logger): Logger for the measurements
+
+    Returns:
+        config (dict): The chosen configuration with its measurements
+    """
+    rng = np.random.default_rng(0)
+    audio = (0.01 * rng.standard_normal(TUNING_AUDIO_S * engine.sampling_rate)).astype(
+        np.float32
+    )
+    features = engine.feature_extractor(
+        audio, sampling_rate=engine.sampling_rate, return_tensors="pt"
+    ).input_features.to(engine.model.device, dtype=engine.model.dtype)
+
+    results = []
+    for config in candidate_configs():
+        apply_config(config)
+        config.update(measure(engine.model, features))
+        results.append(config)
+
+        logger.info(
+            f"CPU tuning: {config['intra_op']:>3} threads "
+            + f"latency {config['latency']:.3f}s jitter {config['jitter']:.1f}ms"
+        )
+
+    smooth = [c for c in results if c["jitter"] <= CPU_TUNING_MAX_JITTER_MS]
+    if smooth:
+        best = min(smooth, key=lambda c: c["latency"])
+    else:
+        best = min(results, key=lambda c: c["jitter"])
+    best["model"] = engine.model.name_or_path
+
+    apply_config(best)
+    return best
+
+
+def tune_cpu_threads(
+    engine,
+    notify: Optional[Callable[[str], Any]] = None,
+    logger: logging.Logger = logger,
+) -> Optional[Dict[str, Any]]:
+    """
+    Applies the tuned threads of this machine, tuning them on first run.
+
+    Args:
+        engine (ASREngine): Engine of the loaded model
+        notify (Callable, optional): Sends status messages to the GUI
+        logger (logging.Logger): Logger for the chosen configuration
+
+    Returns:
+        config (dict): The applied configuration, None if not tuned
+    """
+    # ONNX Runtime sessions have their own thread settings
+    if engine.name == "onnxruntime":
+        return None
+
+    set_interop_threads(logger)
+
+    config = read_tuning().get(machine_key(), None)
+    if config is None:
+        if notify:
+            notify("Tuning CPU threads for this machine...")
+        config = tune(engine, logger)
+        save_tuning(config)
+    else:
+        apply_config(config)
+
+    logger.info(
+        f"CPU threads: {config['intra_op']} intra-op, "
+        + f"{torch.get_num_interop_threads()} inter-op"
+    )
+    return config
+
+
+if __name__ == "__main__":
+    from src.config import SPEECH_MODELS, MODEL_ID
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=MODEL_ID, choices=SPEECH_MODELS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from src.speech.asr import build_engine
+
+    pin_model_thread()
+    set_interop_threads()
+    engine = build_engine(args.model, torch.device("cpu"), "", torch.float32, None, logger)
+    config = tune(engine)
+    save_tuning(config)
+    print(f"\nSaved for {machine_key()}: {config}")
@@ -0,0 +1,172 @@
+from threading import Lock
+
+import numpy as np
+
+
+class CaptureBuffer:
+    """
+    Preallocated buffer that the PyAudio callback writes captured samples into.
+
+    The buffer grows geometrically for long dictations so a write never
+    allocates per chunk. Samples are only appended, so views taken while
+    recording stay valid, and `detach` hands the whole recording over
+    without a copy by starting the next recording in new storage.
+    """
+
+    def __init__(self, capacity: int, dtype=np.int16):
+        self.dtype = dtype
+        self.initial_capacity = capacity
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return self.data.shape[0]
+
+    def write(self, pcm):
+        """
+        Appends captured samples, this is called from the audio callback thread.
+
+        Args:
+            pcm (bytes | np.ndarray): int16 PCM from pyaudio
+        """
+        samples = np.frombuffer(pcm, dtype=self.dtype)
+        n = samples.shape[0]
+
+        with self.lock:
+            end = self.size + n
+
+            # Doubling the capacity, amortized over the recording
+            if end > self.capacity:
+                capacity = self.capacity
+                while capacity < end:
+                    capacity *= 2
+                data = np.empty(capacity, dtype=self.dtype)
+                data[: self.size] = self.data[: self.size]
+                self.data = data
+
+            self.data[self.size : end] = samples
+            self.size = end
+
+    def view(self) -> np.ndarray:
+        """Returns a view of the samples captured so far"""
+        with self.lock:
+            return self.data[: self.size]
+
+    def detach(self) -> np.ndarray:
+        """
+        Hands over the recording without copying and starts a new one.
+
+        Returns:
+            samples (np.ndarray): View of the recorded samples
+        """
+        with self.lock:
+            samples = self.data[: self.size]
+            self.data = np.empty(self.initial_capacity, dtype=self.dtype)
+            self.size = 0
+
+        return samples
+
+    def clear(self):
+        with self.lock:
+            self.size = 0
+
+
+class PreRollBuffer:
+    """
+    Circular buffer keeping the last few hundred milliseconds of audio while
+    the microphone is open but not recording, so speech started right at
+    the hotkey press is not clipped.
+    """
+
+    def __init__(self, capacity: int, dtype=np.int16):
+        self.dtype = dtype
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.position = 0
+        self.filled = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.data.shape[0]
+
+    def write(self, pcm):
+        """Writes samples over the oldest ones"""
+        samples = np.frombuffer(pcm, dtype=self.dtype)
+        n = samples.shape[0]
+
+        if n >= self.capacity:
+            self.data[:] = samples[-self.capacity :]
+            self.position = 0
+            self.filled = self.capacity
+            return
+
+        # Wrapping around the end of the buffer
+        first = min(n, self.capacity - self.position)
+        self.data[self.position : self.position + first] = samples[:first]
+        self.data[: n - first] = samples[first:]
+
+        self.position = (self.position + n) % self.capacity
+        self.filled = min(self.filled + n, self.capacity)
+
+    def snapshot(self) -> np.ndarray:
+        """Returns the buffered samples from oldest to newest"""
+        if self.filled < self.capacity:
+            return self.data[: self.filled].copy()
+
+        return np.concatenate((self.data[self.position :], self.data[: self.position]))
+
+    def clear(self):
+        self.position = 0
+        self.filled = 0
+
+
+class Recorder:
+    """
+    Routes the chunks of the stream callback. While recording they go to the
+    capture buffer, otherwise to the pre-roll buffer when the microphone is
+    kept open. The pre-roll is prepended when a recording starts.
+    """
+
+    def __init__(self, capacity: int, pre_roll: int = 0):
+        self.buffer = CaptureBuffer(capacity)
+        self.pre_roll = PreRollBuffer(pre_roll) if pre_roll > 0 else None
+        self.recording = False
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def write(self, pcm):
+        """Called from the audio callback thread with each captured chunk"""
+        with self.lock:
+            if self.recording:
+                self.buffer.write(pcm)
+            elif self.pre_roll is not None:
+                self.pre_roll.write(pcm)
+
+    def start(self):
+        """Starts a recording with the pre-roll audio"""
+        with self.lock:
+            self.buffer.clear()
+            if self.pre_roll is not None:
+                self.buffer.write(self.pre_roll.snapshot())
+                self.pre_roll.clear()
+            self.recording = True
+
+    def view(self) -> np.ndarray:
+        return self.buffer.view()
+
+    def stop(self) -> np.ndarray:
+        """
+        Stops the recording and hands it over without copying.
+
+        Returns:
+            samples (np.ndarray): View of the recorded samples
+        """
+        with self.lock:
+            self.recording = False
+            return self.buffer.detach()
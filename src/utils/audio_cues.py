@@ -0,0 +1,107 @@
+from os.path import join
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from typing import Dict
+import logging
+import wave
+
+logger = logging.getLogger(__name__)
+
+# Sound effects played at the start and end of a recording
+CUES = {
+    "start": join("effects", "button-high.wav"),
+    "end": join("effects", "button-low.wav"),
+}
+
+# Frames written to the output stream at a time
+CUE_CHUNK = 1024
+
+
+class Cue:
+    """Sound effect decoded once into raw frames"""
+
+    def __init__(self, file_name: str):
+        with wave.open(file_name, "rb") as wav:
+            self.channels = wav.getnchannels()
+            self.sample_width = wav.getsampwidth()
+            self.rate = wav.getframerate()
+            self.frames = wav.readframes(wav.getnframes())
+
+    @property
+    def format(self):
+        return (self.channels, self.sample_width, self.rate)
+
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+
+class CuePlayer:
+    """
+    Plays the recording cues through persistent PyAudio output streams.
+
+    The effects are decoded once at startup and written to the streams by a
+    player thread, so requesting a cue returns immediately and never blocks
+    the capture path. The cue-to-audio latency of each cue is logged.
+    """
+
+    def __init__(self, audio, cues: Dict[str, str] = CUES):
+        self.audio = audio
+        self.cues = {name: Cue(file_name) for name, file_name in cues.items()}
+        self.streams = {}
+
+        # Streams are opened up front so a cue does not wait for a device
+        for cue in self.cues.values():
+            self.stream_for(cue)
+
+        self.requests: Queue = Queue()
+        self.thread = Thread(target=self.run, name="SA-CuePlayer", daemon=True)
+        self.thread.start()
+
+    def stream_for(self, cue: Cue):
+        """Returns the output stream matching the format of the cue"""
+        if cue.format not in self.streams:
+            self.streams[cue.format] = self.audio.open(
+                format=self.audio.get_format_from_width(cue.sample_width),
+                channels=cue.channels,
+                rate=cue.rate,
+                output=True,
+                frames_per_buffer=CUE_CHUNK,
+            )
+
+        return self.streams[cue.format]
+
+    def play(self, name: str):
+        """Requests a cue to be played, returns without waiting"""
+        self.requests.put((name, perf_counter()))
+
+    def run(self):
+        while True:
+            name, requested = self.requests.get()
+
+            # Closing the player
+            if name is None:
+                break
+
+            cue = self.cues[name]
+            stream = self.stream_for(cue)
+            chunk_size = CUE_CHUNK * cue.frame_size
+
+            for start in range(0, len(cue.frames), chunk_size):
+                stream.write(cue.frames[start : start + chunk_size])
+
+                # First chunk is queued to the device
+                if start == 0:
+                    latency = perf_counter() - requested + stream.get_output_latency()
+                    logger.debug(f"Cue {name} to audio latency: {latency * 1000:.1f}ms")
+
+    def close(self):
+        """Stops the player thread and closes the streams"""
+        self.requests.put((None, perf_counter()))
+        self.thread.join(timeout=5)
+
+        for stream in self.streams.values():
+            stream.stop_stream()
+            stream.close()
+        self.streams = {}
@@ -1,15 +1,15 @@
-import io
 import wave
 import logging
-from platform import system
-import traceback
 
-from pyclip import copy
-from pyautogui import typewrite, hotkey
+from pyautogui import typewrite
 from pyaudio import PyAudio, paInt16
 
 logger = logging.getLogger(__name__)
 
+# Microphone capture settings
+RATE = 44100
+CHUNK = 1024
+
 
 def type_writing(text):
     """
@@ -30,6 +30,7 @@ def type_writing(text):
 def copy_writing(text):
     """
     Copies the text to the clipboard and writes it.
+    The clipboard is restored once the text is pasted.
 
     Args:
         text (str): The text to be copied and written
@@ -37,20 +38,49 @@ def copy_writing(text):
     Returns:
         None
     """
-    copy(text)
-    hotkey("ctrl", "v")
+    # The injectors read the config, which imports this module
+    from src.utils.text_injection import get_injector
+
+    get_injector("clipboard").write(text)
+
+
+def auto_writing(text):
+    """
+    Writes the text with the fastest injector for its length and characters,
+    typed in batches of key events or pasted through the clipboard.
+
+    Args:
+        text (str): The text to be written
+
+    Returns:
+        None
+    """
+    from src.utils.text_injection import inject_text
+
+    inject_text(text)
+
+
+def get_audio(stream_callback=None):
+    """
+    Creates the audio stream for recording audio from the microphone.
 
+    Args:
+        stream_callback (Callable, optional): Called by PyAudio with each
+            captured chunk, the stream is non-blocking when given
 
-def get_audio():
-    """Creates the audio stream for recording audio from the microphone."""
+    Returns:
+        audio (PyAudio): The PyAudio instance
+        stream_input (Stream): The input stream
+    """
 
     audio = PyAudio()
     stream_input = audio.open(
         format=paInt16,
         channels=1,
-        rate=44100,
+        rate=RATE,
         input=True,
-        frames_per_buffer=1024,
+        frames_per_buffer=CHUNK,
+        stream_callback=stream_callback,
     )
 
     return audio, stream_input
@@ -62,57 +92,30 @@ def create_sound_file(file_name="tmp.wav"):
     sound_file = wave.open(file_name, "wb")
     sound_file.setnchannels(1)
     sound_file.setsampwidth(2)  # 2 bytes = 16 bits p
-    sound_file.setframerate(44100)
+    sound_file.setframerate(RATE)
 
     return sound_file
 
 
-def pcm_to_wav(input_pcm):
-    """
-    Converts PCM bytes to WAV bytes so that the HuggingFace pipeline receives
-    bytes that ffmpeg could interpret.
-
-    Args:
-        input_pcm (bytes): PCM bytes from pyaudio
-
-    Returns:
-        wav_data (bytes): WAV bytes
-    """
-    with io.BytesIO() as wav_file:
-        wav_writer = wave.open(wav_file, "wb")
-
-        try:
-            wav_writer.setframerate(44100)
-            wav_writer.setsampwidth(2)
-            wav_writer.setnchannels(1)
-            wav_writer.writeframes(input_pcm)
-            wav_data = wav_file.getvalue()
-        except Exception:
-            logger.error(f"Exception on pcm_to_wav: {traceback.format_exc()}")
-        finally:
-            wav_writer.close()
-
-    return wav_data
-
-
-def run_listener(child_pipe, start_event, model_event, terminate_event):
+def run_listener(child_pipe, start_event, model_event, terminate_event, backend=None):
     """
-    Runs the key listener based on the OS.
+    Runs the key listener of the configured backend, by default based on the OS.
 
     Args:
         child_pipe (multiprocessing.Pipe): Pipe for communication with the child process
         start_event (multiprocessing.Event): Event to tell the child process that the model is loaded
         model_event (multiprocessing.Event): Event to tell the child process that the model is loaded
         terminate_event (multiprocessing.Event): Event to tell the child process to terminate
+        backend (str, optional): One of KEY_LISTENER_BACKENDS, KEY_LISTENER_BACKEND if not given
 
     Returns:
         None
     """
-    # Differentiate between windows and linux
-    if system() == "Windows":
-        from src.key_listener.key_listener_win import Listener
-    else:
-        from src.key_listener.key_listener import Listener
+    # The config imports this module
+    from src.config import KEY_LISTENER_BACKEND
+    from src.key_listener.backend import listener_class
+
+    Listener = listener_class(backend or KEY_LISTENER_BACKEND)
 
     a = Listener(child_pipe, start_event, model_event, terminate_event)
     a.run()
@@ -0,0 +1,240 @@
+"""
+Synchronization primitives shared by the capture, ASR and key listener threads.
+
+Events here notify waiters both when they are set and when they are cleared,
+so handshakes like "wait until inference is done" need no sleep polling.
+Events created with the same condition can be waited on together.
+
+Measure the handoff delay between threads with:
+
+    python -m src.utils.synchronization
+"""
+
+from multiprocessing import Condition, RawValue
+from threading import Thread
+from time import perf_counter, sleep, time
+from typing import Callable, List, Optional
+
+
+class SynchEvent:
+    """Event that can be waited on until it is set or until it is cleared."""
+
+    def __init__(self, condition=None):
+        self.condition = condition if condition is not None else Condition()
+        self.flag = RawValue("b", False)
+
+    def is_set(self) -> bool:
+        return bool(self.flag.value)
+
+    def set(self):
+        with self.condition:
+            self.flag.value = True
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.flag.value = False
+            self.condition.notify_all()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until the event is set, returns False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(self.is_set, timeout)
+
+    def wait_clear(self, timeout: Optional[float] = None) -> bool:
+        """Waits until the event is cleared, returns False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.is_set(), timeout)
+
+
+class CancelEvent(SynchEvent):
+    """Event that records when it was set, to measure how fast it is acted on."""
+
+    def __init__(self, condition=None):
+        super().__init__(condition)
+        self.requested = RawValue("d", 0.0)
+
+    @property
+    def requested_at(self) -> float:
+        """Wall clock time of the last request, comparable between processes"""
+        return self.requested.value
+
+    def set(self):
+        with self.condition:
+            self.requested.value = time()
+            super().set()
+
+
+class PendingCounter:
+    """
+    Bounded count of utterances recorded but not written yet. Recording a new
+    utterance takes a slot and writing its transcript gives it back, so fast
+    dictation is limited to a bounded queue depth.
+    """
+
+    def __init__(self, limit: int, condition=None):
+        self.limit = limit
+        self.condition = condition if condition is not None else Condition()
+        self.value = RawValue("i", 0)
+
+    @property
+    def count(self) -> int:
+        return self.value.value
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Takes a slot, returns False if none was free before the timeout"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.count < self.limit, timeout):
+                return False
+            self.value.value += 1
+            self.condition.notify_all()
+            return True
+
+    def release(self):
+        with self.condition:
+            self.value.value = max(self.value.value - 1, 0)
+            self.condition.notify_all()
+
+    def reset(self):
+        with self.condition:
+            self.value.value = 0
+            self.condition.notify_all()
+
+
+def wait_any(*events: SynchEvent, timeout: Optional[float] = None) -> bool:
+    """
+    Waits until any of the events is set. The events must share a condition.
+
+    Args:
+        events (SynchEvent): Events created with the same condition
+        timeout (float, optional): Seconds to wait, None waits forever
+
+    Returns:
+        bool: True if an event was set, False on timeout
+    """
+    condition = events[0].condition
+    with condition:
+        return condition.wait_for(lambda: any(e.is_set() for e in events), timeout)
+
+
+def wait_for(
+    condition, predicate: Callable[[], bool], timeout: Optional[float] = None
+) -> bool:
+    """
+    Waits on a shared condition until the predicate holds, for waits that
+    combine several events, like a release or the program stopping.
+
+    Args:
+        condition (Condition): Condition shared by the events of the predicate
+        predicate (Callable): Checks the events
+        timeout (float, optional): Seconds to wait, None waits forever
+
+    Returns:
+        bool: True if the predicate holds, False on timeout
+    """
+    with condition:
+        return condition.wait_for(predicate, timeout)
+
+
+class Wakeup:
+    """
+    Calls back from a daemon thread once an event is set, to wake up a call
+    blocking outside of the shared condition, like the XRecord loop reading
+    its socket. Cancel it once the blocking call returned by itself.
+
+    Args:
+        event (SynchEvent): Event to watch, usually the terminate event
+        callback (Callable): Makes the blocking call return
+        name (str): Name of the watching thread
+    """
+
+    def __init__(self, event: SynchEvent, callback: Callable[[], None], name: str):
+        self.event = event
+        self.callback = callback
+        self.cancelled = False
+        self.thread = Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with self.event.condition:
+            self.event.condition.wait_for(lambda: self.event.is_set() or self.cancelled)
+
+        if not self.cancelled:
+            self.callback()
+
+    def cancel(self):
+        with self.event.condition:
+            self.cancelled = True
+            self.event.condition.notify_all()
+
+
+def join_all(threads: List[Optional[Thread]], timeout: float) -> List[Thread]:
+    """
+    Joins the threads within one deadline, instead of a timeout for each.
+
+    Args:
+        threads (List[Thread]): Threads to join, None for the ones not started
+        timeout (float): Seconds to wait for all of them
+
+    Returns:
+        alive (List[Thread]): Threads that did not end in time
+    """
+    threads = [thread for thread in threads if thread is not None]
+    deadline = perf_counter() + timeout
+    for thread in threads:
+        thread.join(timeout=max(deadline - perf_counter(), 0))
+
+    return [thread for thread in threads if thread.is_alive()]
+
+
+def measure_handoff(runs: int = 200, poll_interval: Optional[float] = None) -> dict:
+    """
+    Measures the delay between setting an event in one thread and the waiting
+    thread waking up, with condition notification or with sleep polling.
+
+    Args:
+        runs (int): Number of handoffs measured
+        poll_interval (float, optional): Polls with this sleep instead of waiting
+
+    Returns:
+        stats (dict): Mean, median and max handoff delay in milliseconds
+    """
+    event = SynchEvent()
+    delays = []
+
+    def waiter(set_times):
+        for i in range(runs):
+            if poll_interval is None:
+                event.wait()
+            else:
+                while not event.is_set():
+                    sleep(poll_interval)
+            delays.append(perf_counter() - set_times[i])
+            event.clear()
+
+    set_times = [0.0] * runs
+    thread = Thread(target=waiter, args=(set_times,), daemon=True)
+    thread.start()
+
+    for i in range(runs):
+        event.wait_clear()
+        sleep(0.001)
+        set_times[i] = perf_counter()
+        event.set()
+    thread.join()
+
+    delays_ms = sorted(delay * 1000 for delay in delays)
+    return {
+        "mean": sum(delays_ms) / len(delays_ms),
+        "median": delays_ms[len(delays_ms) // 2],
+        "max": delays_ms[-1],
+    }
+
+
+if __name__ == "__main__":
+    for name, interval in [("condition", None), ("poll 10ms", 0.01), ("poll 100ms", 0.1)]:
+        stats = measure_handoff(runs=50, poll_interval=interval)
+        print(
+            f"{name:<12} mean {stats['mean']:7.3f}ms "
+            + f"median {stats['median']:7.3f}ms max {stats['max']:7.3f}ms"
+        )
@@ -0,0 +1,387 @@
+"""
+Writes the transcribed text at the keyboard cursor.
+
+Typing with pyautogui sends each character as its own key press and key
+release, and waits for the X server after every one of them, so long
+dictations visibly type out over seconds. The injectors here are picked
+for each text:
+
+- xtest: key events of the whole text sent through XTest, one round trip
+  per batch of XTEST_BATCH_CHARS characters. X11 only, for characters of
+  the keyboard layout.
+- clipboard: pastes the text with ctrl+v in constant time, restoring the
+  previous clipboard afterwards.
+- typewrite: typing with pyautogui, on Windows and as the fallback.
+
+Measure the characters per second and time to the last character received
+by a window with:
+
+    python -m src.utils.text_injection
+"""
+
+from os import environ
+from threading import Event, Lock, Thread, Timer
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+import argparse
+import logging
+
+from pyautogui import typewrite, hotkey
+from pyclip import copy, paste
+
+from src.config import (
+    TEXT_INJECTOR,
+    TEXT_INJECTORS,
+    CLIPBOARD_MIN_CHARS,
+    CLIPBOARD_RESTORE_S,
+    XTEST_BATCH_CHARS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def char_keysym(char: str) -> int:
+    """Keysym of a character, Latin-1 ones are their code point"""
+    from Xlib import XK
+
+    if char == "\n":
+        return XK.XK_Return
+    if char == "\t":
+        return XK.XK_Tab
+
+    code = ord(char)
+    if 0x20 <= code <= 0x7E or 0xA0 <= code <= 0xFF:
+        return code
+    # Other characters have Unicode keysyms
+    return 0x01000000 | code
+
+
+class TypewriteInjector:
+    """Types the text with pyautogui, one synchronous key event at a time"""
+
+    name = "typewrite"
+
+    def can_write(self, text: str) -> bool:
+        return text.isascii()
+
+    def write(self, text: str):
+        typewrite(text)
+
+
+class XTestInjector:
+    """
+    Types the text with XTest key events on a connection kept open.
+    Events of XTEST_BATCH_CHARS characters are sent before waiting for the
+    server, so the application receives them as fast as it can read them.
+    """
+
+    name = "xtest"
+
+    def __init__(self):
+        from Xlib import X, XK
+        from Xlib.display import Display
+        from Xlib.ext import xtest
+
+        self.X = X
+        self.fake_input = xtest.fake_input
+        self.display = Display()
+        if not self.display.has_extension("XTEST"):
+            self.display.close()
+            raise RuntimeError("The X server has no XTEST extension")
+
+        self.shift = self.display.keysym_to_keycode(XK.XK_Shift_L)
+        # Keycode of each character and whether it needs Shift, None if unmapped
+        self.keys: Dict[str, Optional[Tuple[int, bool]]] = {}
+
+    def refresh_mapping(self):
+        """Follows changes of the keyboard layout, every client is notified"""
+        while self.display.pending_events():
+            event = self.display.next_event()
+            if event.type == self.X.MappingNotify:
+                self.display.refresh_keyboard_mapping(event)
+                self.keys.clear()
+
+    def key_of(self, char: str) -> Optional[Tuple[int, bool]]:
+        if char not in self.keys:
+            self.keys[char] = None
+            for keycode, index in self.display.keysym_to_keycodes(char_keysym(char)):
+                # Levels without modifiers other than Shift
+                if index < 2:
+                    self.keys[char] = (keycode, index == 1)
+                    break
+
+        return self.keys[char]
+
+    def can_write(self, text: str) -> bool:
+        self.refresh_mapping()
+        return all(self.key_of(char) is not None for char in set(text))
+
+    def write(self, text: str):
+        X = self.X
+        for start in range(0, len(text), XTEST_BATCH_CHARS):
+            for char in text[start : start + XTEST_BATCH_CHARS]:
+                key = self.key_of(char)
+                if key is None:
+                    logger.warning(f"No key types {char!r} in this keyboard layout")
+                    continue
+
+                keycode, shifted = key
+                if shifted:
+                    self.fake_input(self.display, X.KeyPress, self.shift)
+                self.fake_input(self.display, X.KeyPress, keycode)
+                self.fake_input(self.display, X.KeyRelease, keycode)
+                if shifted:
+                    self.fake_input(self.display, X.KeyRelease, self.shift)
+
+            # One round trip per batch, the server handles it before the next
+            self.display.sync()
+
+
+class ClipboardInjector:
+    """
+    Pastes the text with ctrl+v. The clipboard of the user is restored
+    CLIPBOARD_RESTORE_S later, once the application has read the text,
+    unless something else was copied in the meantime.
+    """
+
+    name = "clipboard"
+
+    def __init__(self):
+        self.lock = Lock()
+        self.saved = None
+        self.pasted = None
+        self.restore_timer: Optional[Timer] = None
+
+    def can_write(self, text: str) -> bool:
+        return True
+
+    def write(self, text: str):
+        with self.lock:
+            # Pasting again before the restore, the saved clipboard is still the user's
+            if self.restore_timer is not None:
+                self.restore_timer.cancel()
+            else:
+                try:
+                    self.saved = paste()
+                except Exception as e:
+                    logger.warning(f"Could not read the clipboard: {e}")
+                    self.saved = None
+
+            copy(text)
+            self.pasted = text
+            hotkey("ctrl", "v")
+
+            self.restore_timer = Timer(CLIPBOARD_RESTORE_S, self.restore)
+            self.restore_timer.daemon = True
+            self.restore_timer.start()
+
+    def restore(self):
+        with self.lock:
+            self.restore_timer = None
+            if not self.saved:
+                return
+
+            try:
+                current = paste()
+                if current in (self.pasted, self.pasted.encode("utf-8")):
+                    copy(self.saved)
+            except Exception as e:
+                logger.warning(f"Could not restore the clipboard: {e}")
+
+
+INJECTOR_CLASSES = {
+    "xtest": XTestInjector,
+    "clipboard": ClipboardInjector,
+    "typewrite": TypewriteInjector,
+}
+
+# Injectors created on first use, None when not available on this system
+injectors: Dict[str, Optional[object]] = {}
+
+
+def get_injector(name: str):
+    """
+    Returns the injector, created once per process.
+
+    Args:
+        name (str): One of INJECTOR_CLASSES
+
+    Returns:
+        injector: The injector, None if it can not run here
+    """
+    if name not in injectors:
+        try:
+            injectors[name] = INJECTOR_CLASSES[name]()
+        except Exception as e:
+            logger.info(f"Text injector {name} not available: {e}")
+            injectors[name] = None
+
+    return injectors[name]
+
+
+def select_injector(text: str, injector: str = TEXT_INJECTOR):
+    """
+    Picks the injector of a text.
+
+    Args:
+        text (str): The text to be written
+        injector (str): One of TEXT_INJECTORS, "auto" picks from the text
+
+    Returns:
+        injector: The injector writing the text
+    """
+    if injector not in TEXT_INJECTORS:
+        raise ValueError(
+            f"Unknown text injector {injector}, expected one of {TEXT_INJECTORS}"
+        )
+    if injector != "auto":
+        return get_injector(injector) or get_injector("typewrite")
+
+    # Pasting takes the same time for any length
+    if len(text) >= CLIPBOARD_MIN_CHARS:
+        return get_injector("clipboard")
+
+    # Only X11 has XTest
+    xtest = get_injector("xtest") if environ.get("DISPLAY") else None
+    if xtest is not None and xtest.can_write(text):
+        return xtest
+
+    if not text.isascii():
+        return get_injector("clipboard")
+
+    return get_injector("typewrite")
+
+
+def inject_text(text: str):
+    """Writes the text at the cursor with the injector picked for it"""
+    if not text:
+        return
+
+    injector = select_injector(text)
+    t0 = perf_counter()
+    injector.write(text)
+    logger.debug(
+        f"Wrote {len(text)} characters with {injector.name} "
+        + f"in {(perf_counter() - t0) * 1000:.1f}ms"
+    )
+
+
+class KeyReceiver:
+    """
+    Window standing in for the application being written to, it counts the
+    key presses it receives so the time to the last character is measured.
+    """
+
+    def __init__(self):
+        from Xlib import X
+        from Xlib.display import Display
+
+        self.X = X
+        self.display = Display()
+        screen = self.display.screen()
+        self.window = screen.root.create_window(
+            0,
+            0,
+            400,
+            100,
+            0,
+            screen.root_depth,
+            event_mask=X.KeyPressMask | X.StructureNotifyMask,
+        )
+        self.window.set_wm_name("Text injection benchmark")
+        self.window.map()
+        while self.display.next_event().type != X.MapNotify:
+            pass
+
+        # Shift and the other modifiers are not characters
+        self.modifiers = {
+            keycode
+            for keycodes in self.display.get_modifier_mapping()
+            for keycode in keycodes
+            if keycode
+        }
+
+        self.expected = 0
+        self.received = 0
+        self.last_at = 0.0
+        self.done = Event()
+        Thread(target=self.run, daemon=True).start()
+
+    def focus(self):
+        self.window.set_input_focus(self.X.RevertToParent, self.X.CurrentTime)
+        self.display.sync()
+
+    def expect(self, n: int):
+        self.received = 0
+        self.expected = n
+        self.done.clear()
+
+    def run(self):
+        while True:
+            event = self.display.next_event()
+            if event.type == self.X.KeyPress and event.detail not in self.modifiers:
+                self.received += 1
+                if self.received == self.expected:
+                    self.last_at = perf_counter()
+                    self.done.set()
+
+    def close(self):
+        self.window.destroy()
+        self.display.flush()
+
+
+def measure(injector, receiver: KeyReceiver, text: str, timeout: float = 60.0):
+    """
+    Writes the text into the receiver window.
+
+    Returns:
+        stats (dict): Seconds until write returned and until the last key
+            press arrived, None if it did not arrive
+    """
+    # Pasting is a single ctrl+v, the application reads the text itself
+    receiver.expect(1 if injector.name == "clipboard" else len(text))
+    receiver.focus()
+
+    t0 = perf_counter()
+    injector.write(text)
+    returned = perf_counter() - t0
+
+    last = receiver.last_at - t0 if receiver.done.wait(timeout) else None
+    return {"returned": returned, "last": last}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", nargs="+", type=int, default=[20, 100, 500])
+    args = parser.parse_args()
+
+    if not environ.get("DISPLAY"):
+        raise SystemExit("The benchmark types into a window, it needs an X display")
+
+    sentence = "The quick brown fox jumps over the lazy dog, 12 times. "
+    receiver = KeyReceiver()
+
+    for name in INJECTOR_CLASSES:
+        injector = get_injector(name)
+        if injector is None:
+            print(f"{name}: not available")
+            continue
+
+        for length in args.lengths:
+            text = (sentence * (length // len(sentence) + 1))[:length]
+            stats = measure(injector, receiver, text)
+
+            if stats["last"] is None:
+                print(f"{name:<10} {length:5} chars: the last character did not arrive")
+                continue
+            print(
+                f"{name:<10} {length:5} chars: returned {stats['returned'] * 1000:8.1f}ms "
+                + f"last character {stats['last'] * 1000:8.1f}ms "
+                + f"{length / max(stats['last'], 1e-6):9.0f} chars/s"
+            )
+
+    # Giving the clipboard of the user back before exiting
+    clipboard = injectors.get("clipboard", None)
+    if clipboard is not None and clipboard.restore_timer is not None:
+        clipboard.restore_timer.join()
+    receiver.close()
@@ -1,13 +1,16 @@
-from time import time, sleep
-from os.path import join
+from time import time
 import logging
 import traceback
-from threading import Thread
 
-from src.config import SAVE_AUDIO
-from src.utils.funcs import get_audio, create_sound_file, pcm_to_wav
+from src.config import SAVE_AUDIO, STREAM_STEP_S, DICTATION_MODES
+from src.config import DEFAULT_PIPELINED_DICTATION
+from src.config import DEFAULT_ALWAYS_ON_MIC, PRE_ROLL_MS, get_from_config
+from src.utils.funcs import get_audio, create_sound_file, RATE
+from src.utils.audio_buffer import Recorder
+from src.utils.audio_cues import CuePlayer
+from src.utils.synchronization import wait_any, wait_for
 
-from playsound import playsound
+from pyaudio import paContinue
 
 # Global variables
 # -------------------------
@@ -15,74 +18,127 @@ from playsound import playsound
 # Create a logger instance
 logger = logging.getLogger(__name__)
 
+# Seconds of audio preallocated for a recording, grows for long dictations
+CAPTURE_BUFFER_S = 30
+
 # -------------------------
 
 
-def start_recording(start_event, model_event, queue):
-    logger.debug("sound-high played")
+def start_recording(
+    start_event,
+    model_event,
+    queue,
+    streaming=False,
+    sequence=0,
+    pipelined=False,
+    terminate_event=None,
+):
+    """
+    Records audio while the hotkey is held and sends it to the model service.
+
+    Args:
+        start_event (SynchEvent): Set while the hotkey is held
+        model_event (SynchEvent): Set while the model is transcribing
+        queue (queue.Queue): Queue of the model service, in the same process
+        streaming (bool): Sends partial audio while recording
+        sequence (int): Number of the utterance, transcripts are typed in this order
+        pipelined (bool): Does not wait for the model before the next recording
+        terminate_event (SynchEvent, optional): Set when the program stops,
+            the recording is dropped
+
+    Returns:
+        bool: True if the recording was sent to the model service
+    """
     t0 = time()
 
-    # This line to wake device from sleep state
-    # Huge performance gain from Threading and playsound
-    sound1 = Thread(
-        target=playsound, args=(join("effects", "button-high.wav"),), name="play-sound1"
-    )
-    sound2 = Thread(
-        target=playsound, args=(join("effects", "button-low.wav"),), name="play-sound2"
-    )
-
-    # Start stream
-    stream_input.start_stream()
-    logger.debug(f"Get read: {stream_input.get_read_available()}")
-
-    if not stream_input.is_active():
-        print("Stream is not active")
-        return
-
-    # Capturing audio
-    frames = []
+    # Capturing audio, sent once the model service has the recording
+    sent = False
     try:
-        # Playing start sound
-        sound1.start()
+        # Start recording, the stream is already running when the mic is always on.
+        # The recorder and stream are stopped on the way out
+        recorder.start()
+        if not always_on:
+            stream_input.start_stream()
+
+        if not stream_input.is_active():
+            print("Stream is not active")
+            return False
+
+        # Playing start sound, the cue player does not block capture
+        cue_player.play("start")
+        logger.debug("sound-high played")
         logger.debug(f"From start to capture: {time() - t0:.2f}s")
 
-        # Capturing audio
+        # Capturing audio until the hotkey is released, woken up by the listener
         print("Capture STARTED")
-        while start_event.is_set():
-            data = stream_input.read(1024)
-            frames.append(data)
+        step = STREAM_STEP_S if streaming else None
+        while not wait_for(
+            start_event.condition,
+            lambda: not start_event.is_set() or terminated(terminate_event),
+            step,
+        ):
+
+            # Sending a view of the growing buffer for a partial decode
+            queue.put(
+                {
+                    "message": recorder.view(),
+                    "sampling_rate": RATE,
+                    "queued_at": time(),
+                    "do_action": True,
+                    "partial": True,
+                }
+            )
+
+        # Stop is pressed while recording
+        if terminated(terminate_event):
+            print("Capture STOPPED")
+            return False
+
+        # Recording is handed over without a copy, the ASR service converts it
+        samples = recorder.stop()
         print("Capture FINISHED")
 
-        # Converting to wav
-        sound_byte_wav = pcm_to_wav(b"".join(frames))
+        # Stop stream
+        if not always_on:
+            stream_input.stop_stream()
 
         # Sending sound to model for inference
-        queue.put({"message": sound_byte_wav, "do_action": True})
+        queue.put(
+            {
+                "message": samples,
+                "sampling_rate": RATE,
+                "queued_at": time(),
+                "do_action": True,
+                "streaming": streaming,
+                "sequence": sequence,
+            }
+        )
+        sent = True
 
-        # Checking extreme case
-        if model_event.is_set():
-            print("!!Already doing inference!!")
-            logger.error("Already doing inference, too quick")
-            return
-        # Start model to be quicker
-        model_event.set()
+        # Checking extreme case, pipelined recordings are queued instead
+        if not pipelined:
+            if model_event.is_set():
+                print("!!Already doing inference!!")
+                logger.error("Already doing inference, too quick")
+                return True
+            # Start model to be quicker
+            model_event.set()
 
         # Playing end sound
-        sound2.start()
+        cue_player.play("end")
         logger.debug("sound-low played")
 
     except KeyboardInterrupt:
         print("Keyboard interrupt")
-        return
+        return sent
     except Exception:
         print(f"\nCAPTURE UNSUCCESFUL!")
-        return
+        return sent
     finally:
-        sound1.join()
-        sound2.join()
-
-    # Stop stream
-    stream_input.stop_stream()
+        if recorder.recording:
+            recorder.stop()
+        if not always_on:
+            stream_input.stop_stream()
 
     # Saving audio
     if SAVE_AUDIO:
@@ -90,7 +146,7 @@ def start_recording(start_event, model_event, queue):
         sound_file = create_sound_file("recording.wav")
 
         # Writing to file
-        sound_file.writeframes(b"".join(frames))
+        sound_file.writeframes(samples)
 
         # Logging
         logger.debug(f"Sound file tell: {sound_file.tell()}")
@@ -101,7 +157,11 @@ def start_recording(start_event, model_event, queue):
         sound_file.close()
         print("Saved audio")
 
-    return
+    return True
+
+
+def terminated(terminate_event) -> bool:
+    return terminate_event is not None and terminate_event.is_set()
 
 
 def main_loop(
@@ -109,15 +169,32 @@ def main_loop(
     model_event,
     terminate_event,
     sound_data_queue,
+    dictation_mode_value=None,
+    pending_utterances=None,
+    gui_pipe=None,
+    cancel_event=None,
 ):
     ## Initial processes ##
 
-    # Getting audio inputs
-    global audio, stream_input
-    audio, stream_input = get_audio()
+    # Getting audio inputs, captured by the stream callback into the recorder
+    global audio, stream_input, recorder, always_on
+    always_on = bool(get_from_config("Always-On Microphone") or DEFAULT_ALWAYS_ON_MIC)
+    pre_roll = int(PRE_ROLL_MS * RATE / 1000) if always_on else 0
+    recorder = Recorder(CAPTURE_BUFFER_S * RATE, pre_roll)
+
+    def capture_callback(in_data, frame_count, time_info, status):
+        recorder.write(in_data)
+        return (None, paContinue)
+
+    audio, stream_input = get_audio(capture_callback)
 
-    # No audio being recorded
-    stream_input.stop_stream()
+    # Sound effects decoded once and played on persistent output streams
+    global cue_player
+    cue_player = CuePlayer(audio)
+
+    # No audio being recorded, an always on mic only fills the pre-roll when idle
+    if not always_on:
+        stream_input.stop_stream()
 
     logger.debug(f"Audio: Default input info: {audio.get_default_input_device_info()}")
     logger.debug(f"Audio: Default output info: {audio.get_default_output_device_info()}")
@@ -129,9 +206,14 @@ def main_loop(
         f"Input device detected: \033[94m{audio.get_default_input_device_info()['name']} \033[0m"
     )
 
+    # Recording while the previous utterances are transcribed
+    pipelined = pending_utterances is not None and bool(
+        get_from_config("Pipelined Dictation") or DEFAULT_PIPELINED_DICTATION
+    )
+    sequence = 0
+
     # Waiting for model to be loaded
-    while not (model_event.is_set() or terminate_event.is_set()):
-        sleep(0.5)
+    wait_any(model_event, terminate_event)
     model_event.clear()
 
     ## Main loop ##
@@ -140,23 +222,87 @@ def main_loop(
         while 1:
             # Waiting for Start event
             print("Waiting for hotkey")
-            start_event.wait()
+            wait_any(start_event, terminate_event)
 
             # To terminate process
             if terminate_event.is_set():
                 raise KeyboardInterrupt
 
+            # Backpressure, too many utterances are waiting to be typed
+            if pipelined and not pending_utterances.acquire(timeout=0):
+                logger.warning(f"{pending_utterances.count} utterances pending")
+                if gui_pipe:
+                    gui_pipe.send(
+                        f"Busy: {pending_utterances.count} utterances transcribing, "
+                        + "recording once one is written"
+                    )
+
+                # Recording starts when a slot is freed, if the hotkey is still held
+                wait_for(
+                    pending_utterances.condition,
+                    lambda: pending_utterances.count < pending_utterances.limit
+                    or not start_event.is_set()
+                    or terminate_event.is_set(),
+                )
+                if (
+                    not start_event.is_set()
+                    or terminate_event.is_set()
+                    or not pending_utterances.acquire(timeout=0)
+                ):
+                    continue
+
             # Starting to Record
             print("Recording...\n")
             if start_event.is_set():
-                start_recording(start_event, model_event, sound_data_queue)
+                streaming = (
+                    dictation_mode_value is not None
+                    and DICTATION_MODES[dictation_mode_value.value] == "streaming"
+                )
+                sent = start_recording(
+                    start_event,
+                    model_event,
+                    sound_data_queue,
+                    streaming=streaming,
+                    sequence=sequence,
+                    pipelined=pipelined,
+                    terminate_event=terminate_event,
+                )
             else:
+                sent = False
                 print("Did not record properly")
-                continue
 
-            # Waiting for inference to complete
-            while model_event.is_set():
-                sleep(0.01)
+            # Numbers are only used by recordings that reached the model service
+            if sent:
+                sequence += 1
+            elif pipelined:
+                pending_utterances.release()
+
+            # Waiting for inference to complete, notified by the model service
+            if not pipelined:
+                with model_event.condition:
+                    model_event.condition.wait_for(
+                        lambda: not model_event.is_set()
+                        or start_event.is_set()
+                        or terminate_event.is_set()
+                    )
+
+                # To terminate process, the model service is told to stop by the GUI
+                if terminate_event.is_set():
+                    raise KeyboardInterrupt
+
+                # Pressing the hotkey again cancels it and starts a new recording
+                if model_event.is_set() and cancel_event is not None:
+                    logger.info("Hotkey pressed during inference, cancelling it")
+                    cancel_event.set()
+                    wait_for(
+                        model_event.condition,
+                        lambda: not model_event.is_set() or terminate_event.is_set(),
+                    )
+                    continue
+                wait_for(
+                    model_event.condition,
+                    lambda: not model_event.is_set() or terminate_event.is_set(),
+                )
 
             # Clearing events
             start_event.clear()
@@ -171,6 +317,7 @@ def main_loop(
 
     finally:
         # Audio
+        cue_player.close()
         stream_input.stop_stream()
         stream_input.close()
         audio.terminate()